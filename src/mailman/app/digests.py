@@ -18,12 +18,220 @@
 """Digest functions."""
 
 import os
+import re
+import json
+import logging
 
+from email.mime.message import MIMEMessage
+from email.utils import getaddresses
+from io import StringIO
 from mailman import public
 from mailman.config import config
 from mailman.email.message import Message
 from mailman.interfaces.digests import DigestFrequency
+from mailman.interfaces.listmanager import IListManager
 from mailman.utilities.datetime import now as right_now
+from mailman.utilities.string import oneline, wrap
+from zope.component import getUtility
+
+
+log = logging.getLogger('mailman.error')
+
+
+@public
+def toc_entry(mlist, msg):
+    """Return the table of contents entry of a digest message.
+
+    :param mlist: The mailing list the digest belongs to.
+    :type mlist: IMailingList
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :return: The message's subject without the list's subject prefix, or
+        None if it has no subject, and the name or address of its author.
+    :rtype: 2-tuple of (str or None, str)
+    """
+    subject = msg.get('subject')
+    if subject is not None:
+        subject = oneline(subject, in_unicode=True)
+        # Don't include the redundant subject prefix in the toc
+        mo = re.match('(re:? *)?({0})'.format(
+            re.escape(mlist.subject_prefix)),
+                      subject, re.IGNORECASE)
+        if mo:
+            subject = subject[:mo.start(2)] + subject[mo.end(2):]
+    # Take only the first author we find.
+    username = ''
+    addresses = getaddresses(
+        [oneline(msg.get('from', ''), in_unicode=True)])
+    if addresses:
+        username = addresses[0][0]
+        if not username:
+            username = addresses[0][1]
+    return subject, username
+
+
+@public
+def mime_part(msg):
+    """Return a message as a part of the MIME digest.
+
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :return: The flattened message/rfc822 part.
+    :rtype: bytes
+    """
+    return MIMEMessage(msg).as_bytes()
+
+
+@public
+def rfc1153_part(msg):
+    """Return a message as a section of the RFC 1153 digest.
+
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :return: The few headers kept in the RFC 1153 digest, followed by the
+        decoded payload.
+    :rtype: str
+    """
+    text = StringIO()
+    # Each message section contains a few headers.
+    for header in config.digests.plain_digest_keep_headers.split():
+        if header in msg:
+            value = oneline(msg[header], in_unicode=True)
+            value = wrap('{}: {}'.format(header, value))
+            value = '\n\t'.join(value.split('\n'))
+            print(value, file=text)
+    print(file=text)
+    # Add the payload.  If the decoded payload is empty, this may be a
+    # multipart message.  In that case, just stringify it.
+    payload = msg.get_payload(decode=True)
+    if not payload:
+        payload = msg.as_string().split('\n\n', 1)[1]
+    if isinstance(payload, bytes):
+        try:
+            # Do the decoding inside the try/except so that if the charset
+            # conversion fails, we'll just drop back to ascii.
+            charset = msg.get_content_charset('us-ascii')
+            payload = payload.decode(charset, 'replace')
+        except (LookupError, TypeError):
+            # Unknown or empty charset.
+            payload = payload.decode('us-ascii', 'replace')
+    print(payload, file=text)
+    if not payload.endswith('\n'):
+        print(file=text)
+    return text.getvalue()
+
+
+@public
+def digest_parts(mlist, msg):
+    """Return everything a digest needs from one of its messages.
+
+    :param mlist: The mailing list the digest belongs to.
+    :type mlist: IMailingList
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :return: The subject and author for the table of contents, the MIME
+        digest part and the RFC 1153 digest section.
+    :rtype: 4-tuple of (str or None, str, bytes, str)
+    """
+    return toc_entry(mlist, msg) + (mime_part(msg), rfc1153_part(msg))
+
+
+@public
+class DigestJournal:
+    """The digest parts of the messages in a digest mailbox.
+
+    As each message is added to a digest mailbox, everything the digests need
+    from it is appended to a journal file next to the mailbox.  The digest
+    runner then only has to copy these parts into the digests, instead of
+    parsing and rendering all the messages at once.
+
+    Each record in the journal is a line of JSON, followed by the message's
+    MIME part and RFC 1153 section.  The JSON includes the size of the
+    mailbox before and after the message was added, so that a journal which
+    doesn't match its mailbox is never used.
+    """
+
+    def __init__(self, mailbox_path):
+        self.mailbox_path = mailbox_path
+        self.path = os.path.splitext(mailbox_path)[0] + '.journal'
+
+    def append(self, mlist, msg, start, end):
+        """Append a message's digest parts to the journal.
+
+        This must be called with the mailbox locked, right after the message
+        has been added to it.
+
+        :param mlist: The mailing list the digest belongs to.
+        :type mlist: IMailingList
+        :param msg: The message.
+        :type msg: `email.message.Message`
+        :param start: The size of the mailbox before the message was added.
+        :type start: int
+        :param end: The size of the mailbox after the message was added.
+        :type end: int
+        """
+        record = dict(start=start, end=end)
+        parts = []
+        try:
+            subject, author, mime, text = digest_parts(mlist, msg)
+            text = text.encode('utf-8')
+        except Exception:
+            # Leave it to the digest runner, which renders all the messages
+            # itself when any one of them isn't in the journal.
+            log.exception('Digest parts of {} in {}'.format(
+                msg.get('message-id', 'n/a'), mlist.fqdn_listname))
+        else:
+            record.update(subject=subject, author=author,
+                          mime=len(mime), text=len(text))
+            parts = [mime, text]
+        # A new mailbox starts a new journal.
+        with open(self.path, ('wb' if start == 0 else 'ab')) as fp:
+            fp.write(json.dumps(record).encode('utf-8') + b'\n')
+            for part in parts:
+                fp.write(part)
+
+    def load(self):
+        """Return the records of the journal, if it can be used.
+
+        :return: The records, each with the offset of its parts in the
+            journal file, or None if the journal is missing, damaged or out
+            of step with the mailbox, or any message's parts are missing.
+        :rtype: list of dicts
+        """
+        records = []
+        end = 0
+        try:
+            with open(self.path, 'rb') as fp:
+                for line in iter(fp.readline, b''):
+                    record = json.loads(line.decode('utf-8'))
+                    if record['start'] != end or 'mime' not in record:
+                        return None
+                    end = record['end']
+                    record['offset'] = fp.tell()
+                    fp.seek(record['mime'] + record['text'], os.SEEK_CUR)
+                    records.append(record)
+                if fp.tell() != os.fstat(fp.fileno()).st_size:
+                    return None
+            if end != os.path.getsize(self.mailbox_path):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return records
+
+    def parts(self, records):
+        """Read the digest parts of the loaded records.
+
+        :param records: The records returned by `load()`.
+        :type records: list of dicts
+        :return: An iterator over the subject, author, MIME part and RFC 1153
+            section of each message, as returned by `digest_parts()`.
+        """
+        with open(self.path, 'rb') as fp:
+            for record in records:
+                fp.seek(record['offset'])
+                mime = fp.read(record['mime'])
+                text = fp.read(record['text']).decode('utf-8')
+                yield record['subject'], record['author'], mime, text
 
 
 @public
@@ -67,7 +275,33 @@ def bump_digest_number_and_volume(mlist):
 
 
 @public
-def maybe_send_digest_now(mlist, *, force=False):
+def lists_with_digests(*, periodic=False):
+    """Find the mailing lists with collected digest messages.
+
+    The list ids are found with a single query, and only the mailing lists
+    which actually have a digest mailbox waiting are looked up.
+
+    :param periodic: Only consider the mailing lists which send their digests
+        periodically.
+    :type periodic: boolean
+    :return: The mailing lists whose digests can be sent.
+    :rtype: iterator over `IMailingList`
+    """
+    list_manager = getUtility(IListManager)
+    list_ids = (list_manager.periodic_digest_list_ids if periodic
+                else list_manager.list_ids)
+    for list_id in list_ids:
+        mailbox_path = os.path.join(
+            config.LIST_DATA_DIR, list_id, 'digest.mmdf')
+        if os.path.exists(mailbox_path):
+            mlist = list_manager.get_by_list_id(list_id)
+            # The list could have been deleted in the meantime.
+            if mlist is not None:
+                yield mlist
+
+
+@public
+def maybe_send_digest_now(mlist, *, force=False, deliver_after=None):
     """Send this mailing list's digest now.
 
     If there are any messages in this mailing list's digest, the
@@ -81,6 +315,9 @@ def maybe_send_digest_now(mlist, *, force=False):
     :param force: Should the digest be sent even if the size threshold hasn't
         been met?
     :type force: boolean
+    :param deliver_after: If given, the digest runner holds off building and
+        sending the digest until this time.
+    :type deliver_after: datetime
     """
     mailbox_path = os.path.join(mlist.data_path, 'digest.mmdf')
     # Calculate the current size of the mailbox file.  This will not tell
@@ -104,8 +341,17 @@ def maybe_send_digest_now(mlist, *, force=False):
         digest_number = mlist.next_digest_number
         bump_digest_number_and_volume(mlist)
         os.rename(mailbox_path, mailbox_dest)
+        try:
+            os.rename(DigestJournal(mailbox_path).path,
+                      DigestJournal(mailbox_dest).path)
+        except FileNotFoundError:
+            # The digest runner renders the messages itself.
+            pass
+        msgdata = {}
+        if deliver_after is not None:
+            msgdata['deliver_after'] = deliver_after
         config.switchboards['digest'].enqueue(
-            Message(),
+            Message(), msgdata,
             listid=mlist.list_id,
             digest_path=mailbox_dest,
             volume=volume,
@@ -22,6 +22,7 @@ from mailman.app import (
     domain, membership, moderator, registrar, subscriptions)
 from mailman.core import i18n, switchboard
 from mailman.languages import manager as language_manager
+from mailman.model import bans
 from mailman.styles import manager as style_manager
 from mailman.utilities import passwords
 from zope import event
@@ -31,6 +32,7 @@ from zope import event
 def initialize():
     """Initialize global event subscribers."""
     event.subscribers.extend([
+        bans.handle_BanChangeEvent,
         domain.handle_DomainDeletingEvent,
         i18n.handle_ConfigurationUpdatedEvent,
         language_manager.handle_ConfigurationUpdatedEvent,
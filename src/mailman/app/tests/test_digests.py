@@ -22,7 +22,8 @@ import unittest
 
 from datetime import timedelta
 from mailman.app.digests import (
-    bump_digest_number_and_volume, maybe_send_digest_now)
+    DigestJournal, bump_digest_number_and_volume, lists_with_digests,
+    maybe_send_digest_now)
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.interfaces.digests import DigestFrequency
@@ -33,6 +34,8 @@ from mailman.testing.helpers import (
     specialized_message_from_string as mfs, subscribe)
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import factory, now as right_now
+from mailman.utilities.mailbox import Mailbox
+from unittest.mock import patch
 
 
 class TestBumpDigest(unittest.TestCase):
@@ -224,3 +227,150 @@ Subject: message {}
         digest_contents = str(items[0].msg)
         self.assertIn('Subject: message 1', digest_contents)
         self.assertIn('Subject: message 2', digest_contents)
+
+    def test_deliver_digest_later(self):
+        # A digest can be held off until a later time.
+        self._to_digest(3)
+        maybe_send_digest_now(
+            self._mlist, force=True,
+            deliver_after=right_now() + timedelta(hours=1))
+        self.assertFalse(os.path.exists(self._mailbox_path))
+        # The digest runner keeps deferred digests queued, so only run it once
+        # through the queue.
+        runner = make_testable_runner(
+            DigestRunner, 'digest', lambda runner: True)
+        switchboard = config.switchboards['digest']
+        files = switchboard.files
+        with patch.object(runner.switchboard, 'dequeue') as dequeue, \
+                patch.object(runner.switchboard, 'metadata',
+                             wraps=runner.switchboard.metadata) as metadata:
+            runner.run()
+            runner.run()
+        # The digest runner hasn't built the digest yet, and has left its
+        # queue entry alone.  It only read the entry's metadata once.
+        self.assertEqual(dequeue.call_count, 0)
+        self.assertEqual(metadata.call_count, 1)
+        self.assertEqual(switchboard.files, files)
+        get_queue_messages('virgin', expected_count=0)
+        # Once its time has come, it does.
+        factory.fast_forward()
+        runner.run()
+        get_queue_messages('digest', expected_count=0)
+        items = get_queue_messages('virgin', expected_count=1)
+        self.assertIn('Subject: message 3', str(items[0].msg))
+
+    def test_lists_with_digests(self):
+        # Only the mailing lists with a digest mailbox are found.
+        bee = create_list('bee@example.com')
+        cat = create_list('cat@example.com')
+        cat.digest_send_periodic = False
+        self._to_digest()
+        config.handlers['to-digest'].process(cat, mfs("""\
+To: cat@example.com
+From: anne@example.com
+Subject: message
+
+"""), {})
+        self.assertEqual(
+            sorted(mlist.list_id for mlist in lists_with_digests()),
+            ['ant.example.com', 'cat.example.com'])
+        self.assertEqual(
+            [mlist.list_id for mlist in lists_with_digests(periodic=True)],
+            ['ant.example.com'])
+        # bee collects its first message.
+        config.handlers['to-digest'].process(bee, mfs("""\
+To: bee@example.com
+From: anne@example.com
+Subject: message
+
+"""), {})
+        self.assertEqual(
+            sorted(mlist.list_id
+                   for mlist in lists_with_digests(periodic=True)),
+            ['ant.example.com', 'bee.example.com'])
+
+
+class TestDigestJournal(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('ant@example.com')
+        self._mlist.digest_size_threshold = 100
+        self._mailbox_path = os.path.join(self._mlist.data_path, 'digest.mmdf')
+        self._journal = DigestJournal(self._mailbox_path)
+
+    def _to_digest(self, *subjects):
+        for subject in subjects:
+            msg = mfs("""\
+To: ant@example.com
+From: Anne Person <anne@example.com>
+Subject: {}
+
+A message.
+""".format(subject))
+            config.handlers['to-digest'].process(self._mlist, msg, {})
+
+    def test_journal(self):
+        # The digest parts of each message are journaled as it is added to
+        # the digest mailbox.
+        self._to_digest('message 1', 'message 2')
+        records = self._journal.load()
+        self.assertEqual(len(records), 2)
+        parts = list(self._journal.parts(records))
+        self.assertEqual([part[:2] for part in parts], [
+            ('message 1', 'Anne Person'),
+            ('message 2', 'Anne Person'),
+            ])
+        self.assertIn(b'Subject: message 2', parts[1][2])
+        self.assertEqual(parts[1][3], """\
+From: Anne Person <anne@example.com>
+Subject: message 2
+To: ant@example.com
+
+A message.
+
+""")
+
+    def test_out_of_step_journal(self):
+        # A message was added to the mailbox without being journaled.
+        self._to_digest('message 1')
+        with Mailbox(self._mailbox_path) as mbox:
+            mbox.add(mfs('Subject: message 2\n\n'))
+        self.assertIsNone(self._journal.load())
+        # Neither does it help when the next message is journaled.
+        self._to_digest('message 3')
+        self.assertIsNone(self._journal.load())
+
+    def test_damaged_journal(self):
+        self._to_digest('message 1', 'message 2')
+        with open(self._journal.path, 'rb+') as fp:
+            fp.truncate(os.path.getsize(self._journal.path) - 1)
+        self.assertIsNone(self._journal.load())
+
+    def test_unrendered_message(self):
+        # When a message's parts can't be rendered, the digest runner has to
+        # render them all itself.
+        with patch('mailman.app.digests.mime_part', side_effect=TypeError):
+            self._to_digest('message 1')
+        self.assertIsNone(self._journal.load())
+
+    def test_new_mailbox_new_journal(self):
+        # A new digest mailbox starts a new journal.
+        self._to_digest('message 1')
+        os.remove(self._mailbox_path)
+        self._to_digest('message 2')
+        records = self._journal.load()
+        self.assertEqual([record['subject'] for record in records],
+                         ['message 2'])
+
+    def test_journal_is_sent_along(self):
+        # When the digest is sent, the journal is moved along with the
+        # mailbox.
+        self._to_digest('message 1')
+        maybe_send_digest_now(self._mlist, force=True)
+        self.assertFalse(os.path.exists(self._journal.path))
+        item = get_queue_messages('digest', expected_count=1)[0]
+        journal = DigestJournal(item.msgdata['digest_path'])
+        records = journal.load()
+        self.assertEqual([record['subject'] for record in records],
+                         ['message 1'])
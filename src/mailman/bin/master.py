@@ -27,12 +27,13 @@ import logging
 from datetime import timedelta
 from enum import Enum
 from flufl.lock import Lock, NotLockedError, TimeOutError
-from lazr.config import as_boolean
+from lazr.config import ConfigSchema, as_boolean
 from mailman import public
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
 from mailman.utilities.options import Options
+from pkg_resources import resource_filename
 
 
 DOT = '.'
@@ -65,7 +66,10 @@ and SIGUSR1 all cause a runner to exit cleanly.  The master will restart
 runners that have exited due to a SIGUSR1 or some kind of other exit condition
 (say because of an uncaught exception).  SIGHUP causes the master and the
 runners to close their log files, and reopen then upon the next printed
-message.
+message.  When runners which claim their queue entries are restarted because
+of a SIGUSR1, the master first re-reads their number of instances from the
+configuration file, and starts or retires instances accordingly.  The master
+does the same on a SIGHUP, without restarting the other runners.
 
 The master also responds to SIGINT, SIGTERM, SIGUSR1 and SIGHUP, which it
 simply passes on to the runners.  Note that the master will close and reopen
@@ -267,6 +271,18 @@ class PIDWatcher:
         """
         return self._pids.pop(pid)
 
+    def get(self, pid):
+        """Return existing process information.
+
+        :param pid: The process id.
+        :type pid: int
+        :return: The process information, or None if the process id is not
+            being tracked.
+        :rtype: 4-tuple consisting of
+            (runner-name, slice-number, slice-count, restart-count)
+        """
+        return self._pids.get(pid)
+
     def drop(self, pid):
         """Remove and return existing process information.
 
@@ -292,6 +308,10 @@ class Loop:
         self._restartable = restartable
         self._config_file = config_file
         self._kids = PIDWatcher()
+        # The number of instances of each runner which claims its queue
+        # entries.  These may change when the runners are restarted.
+        self._claim_counts = {}
+        self._reload = False
 
     def install_signal_handlers(self):
         """Install various signals handlers for control from the master."""
@@ -304,15 +324,18 @@ class Loop:
             signal.alarm(SECONDS_IN_A_DAY)
         signal.signal(signal.SIGALRM, sigalrm_handler)
         signal.alarm(SECONDS_IN_A_DAY)
-        # SIGHUP tells the runners to close and reopen their log files.
+        # SIGHUP tells the runners to close and reopen their log files.  The
+        # claiming runners are also resized to their configured instances.
         def sighup_handler(signum, frame):          # noqa
             reopen()
             for pid in self._kids:
                 os.kill(pid, signal.SIGHUP)
             log.info('Master watcher caught SIGHUP.  Re-opening log files.')
+            self._resize()
         signal.signal(signal.SIGHUP, sighup_handler)
         # SIGUSR1 is used by 'mailman restart'.
         def sigusr1_handler(signum, frame):         # noqa
+            self._reload = True
             for pid in self._kids:
                 os.kill(pid, signal.SIGUSR1)
             log.info('Master watcher caught SIGUSR1.  Exiting.')
@@ -406,18 +429,91 @@ class Loop:
             if not as_boolean(runner_config.start):
                 continue
             # Find out how many runners to instantiate.  This must be a power
-            # of 2.
+            # of 2, unless the runners claim their queue entries.
             count = int(runner_config.instances)
-            assert (count & (count - 1)) == 0, (
-                'Runner "{0}", not a power of 2: {1}'.format(name, count))
+            if as_boolean(runner_config.claim):
+                self._claim_counts[name] = count
+            else:
+                assert (count & (count - 1)) == 0, (
+                    'Runner "{0}", not a power of 2: {1}'.format(name, count))
+            for slice_number in range(count):
+                self._start_slice(name, slice_number, count)
+
+    def _start_slice(self, name, slice_number, count, restarts=0):
+        # runner name, slice #, # of slices, restart count
+        info = (name, slice_number, count, restarts)
+        spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
+        pid = self._start_runner(spec)
+        log = logging.getLogger('mailman.runner')
+        log.debug('[{0:d}] {1}'.format(pid, spec))
+        self._kids.add(pid, info)
+
+    def _read_claim_counts(self):
+        """Re-read the instance counts of the claiming runners.
+
+        The counts are read from a fresh copy of the configuration, so that
+        they can be changed while the master is running.  If the
+        configuration can't be read, the current counts are kept.
+        """
+        log = logging.getLogger('mailman.runner')
+        config_file = (config.filename if self._config_file is None
+                       else self._config_file)
+        try:
+            schema = ConfigSchema(
+                resource_filename('mailman.config', 'schema.cfg'))
+            fresh = schema.load(
+                resource_filename('mailman.config', 'mailman.cfg'))
+            if config_file is not None:
+                with open(config_file, 'r', encoding='utf-8') as fp:
+                    fresh.push(config_file, fp.read())
+            counts = {}
+            for name in self._claim_counts:
+                runner_config = fresh['runner.' + name]
+                # A runner which stopped claiming keeps its count until the
+                # master is restarted.
+                if as_boolean(runner_config.claim):
+                    counts[name] = int(runner_config.instances)
+        except Exception:
+            log.exception('Cannot re-read runner instances from: %s',
+                          config_file)
+            return
+        for name, count in counts.items():
+            if count != self._claim_counts[name]:
+                log.info('Runner {0} resized from {1:d} to {2:d} '
+                         'instances'.format(
+                             name, self._claim_counts[name], count))
+            self._claim_counts[name] = count
+
+    def _resize_claiming_runners(self, exited_name=None, exited_slice=None):
+        """Start the missing instances of the claiming runners.
+
+        The instance which just exited, if any, is skipped, since it is
+        restarted separately.
+        """
+        running = set()
+        for pid in self._kids:
+            info = self._kids.get(pid)
+            if info is not None:
+                running.add(info[:2])
+        running.add((exited_name, exited_slice))
+        for name, count in self._claim_counts.items():
             for slice_number in range(count):
-                # runner name, slice #, # of slices, restart count
-                info = (name, slice_number, count, 0)
-                spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
-                pid = self._start_runner(spec)
-                log = logging.getLogger('mailman.runner')
-                log.debug('[{0:d}] {1}'.format(pid, spec))
-                self._kids.add(pid, info)
+                if (name, slice_number) not in running:
+                    self._start_slice(name, slice_number, count)
+
+    def _resize(self):
+        """Resize the claiming runners, without restarting them.
+
+        The missing instances are started, and the instances which are no
+        longer configured are stopped with a SIGUSR1, so that they are
+        retired instead of restarted.
+        """
+        self._read_claim_counts()
+        self._resize_claiming_runners()
+        for pid in list(self._kids):
+            name, slice_number = self._kids.get(pid)[:2]
+            if slice_number >= self._claim_counts.get(name, slice_number + 1):
+                os.kill(pid, signal.SIGUSR1)
 
     def _pause(self):
         """Sleep until a signal is received."""
@@ -464,6 +560,18 @@ class Loop:
             restart = False
             if why == signal.SIGUSR1 and self._restartable:
                 restart = True
+                # The first runner exiting because of a restart picks up the
+                # new sizes of the claiming runners.
+                if self._reload:
+                    self._reload = False
+                    self._read_claim_counts()
+                    self._resize_claiming_runners(rname, slice_number)
+            if rname in self._claim_counts:
+                count = self._claim_counts[rname]
+                if restart and slice_number >= count:
+                    log.info('Runner {0} retiring instance {1:d}'.format(
+                        rname, slice_number))
+                    restart = False
             # Have we hit the maximum number of restarts?
             restarts += 1
             max_restarts = int(getattr(config, config_name).max_restarts)
@@ -18,13 +18,19 @@
 """Test master watcher utilities."""
 
 import os
+import errno
+import signal
 import tempfile
 import unittest
 
 from contextlib import suppress
 from datetime import timedelta
 from flufl.lock import Lock
+from itertools import count
 from mailman.bin import master
+from mailman.testing.helpers import configuration
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
 
 
 class TestMasterLock(unittest.TestCase):
@@ -60,3 +66,98 @@ class TestMasterLock(unittest.TestCase):
             my_lock.unlock()
         self.assertEqual(state, master.WatcherState.conflict)
         # XXX test stale_lock and host_mismatch states.
+
+
+class TestClaimingRunners(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._specs = []
+        self._pids = count(1)
+        fd, self._config_file = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self._config_file)
+        self._loop = master.Loop(restartable=True,
+                                 config_file=self._config_file)
+        patcher = patch.object(self._loop, '_start_runner', self._start)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _start(self, spec):
+        # Pretend to start the runner, returning its fake process id.
+        self._specs.append(spec)
+        return next(self._pids)
+
+    def _restart(self, instances):
+        # Change the configuration, then restart all the runners.
+        with open(self._config_file, 'w') as fp:
+            print('[runner.in]\nclaim: yes\ninstances: {}'.format(
+                instances), file=fp)
+        exits = [(pid, signal.SIGUSR1) for pid in self._loop._kids]
+        def wait():                                 # noqa
+            if len(exits) == 0:
+                raise OSError(errno.ECHILD, 'No child processes')
+            return exits.pop(0)
+        self._loop._reload = True
+        del self._specs[:]
+        with patch('mailman.bin.master.os.wait', wait), \
+                patch.object(self._loop, '_pause'):
+            self._loop.loop()
+
+    def _running(self):
+        return sorted(self._loop._kids.get(pid)[:3]
+                      for pid in self._loop._kids)
+
+    @configuration('runner.in', claim='yes', instances=3)
+    def test_not_power_of_two(self):
+        self._loop.start_runners(['in'])
+        self.assertEqual(self._specs, ['in:0:3', 'in:1:3', 'in:2:3'])
+
+    @configuration('runner.in', claim='yes', instances=3)
+    def test_grow(self):
+        self._loop.start_runners(['in'])
+        self._restart(5)
+        self.assertEqual(self._running(), [
+            ('in', 0, 5), ('in', 1, 5), ('in', 2, 5),
+            ('in', 3, 5), ('in', 4, 5)])
+
+    @configuration('runner.in', claim='yes', instances=3)
+    def test_shrink(self):
+        self._loop.start_runners(['in'])
+        self._restart(2)
+        self.assertEqual(self._running(), [('in', 0, 2), ('in', 1, 2)])
+        self.assertEqual(sorted(self._specs), ['in:0:2', 'in:1:2'])
+
+    @configuration('runner.in', claim='yes', instances=3)
+    def test_resize_on_sighup(self):
+        # The claiming runners are resized without being restarted.
+        self._loop.start_runners(['in'])
+        with open(self._config_file, 'w') as fp:
+            print('[runner.in]\nclaim: yes\ninstances: 5', file=fp)
+        del self._specs[:]
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop._resize()
+        self.assertEqual(self._specs, ['in:3:5', 'in:4:5'])
+        self.assertEqual(kill.call_count, 0)
+        with open(self._config_file, 'w') as fp:
+            print('[runner.in]\nclaim: yes\ninstances: 2', file=fp)
+        del self._specs[:]
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop._resize()
+        self.assertEqual(self._specs, [])
+        # The instances which are no longer configured are stopped, and then
+        # retired instead of restarted.
+        retired = sorted(args[0] for args, kws in kill.call_args_list)
+        self.assertEqual(retired, [3, 4, 5])
+        for args, kws in kill.call_args_list:
+            self.assertEqual(args[1], signal.SIGUSR1)
+        exits = [(pid, signal.SIGUSR1) for pid in retired]
+        def wait():                                 # noqa
+            if len(exits) == 0:
+                raise OSError(errno.ECHILD, 'No child processes')
+            return exits.pop(0)
+        with patch('mailman.bin.master.os.wait', wait), \
+                patch.object(self._loop, '_pause'):
+            self._loop.loop()
+        self.assertEqual(self._specs, [])
+        self.assertEqual(self._running(), [('in', 0, 3), ('in', 1, 3)])
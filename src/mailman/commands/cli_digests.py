@@ -18,13 +18,17 @@
 """The `send_digests` subcommand."""
 
 import sys
+import time
 
+from lazr.config import as_timedelta
 from mailman import public
 from mailman.app.digests import (
-    bump_digest_number_and_volume, maybe_send_digest_now)
+    bump_digest_number_and_volume, lists_with_digests, maybe_send_digest_now)
+from mailman.config import config
 from mailman.core.i18n import _
 from mailman.interfaces.command import ICLISubCommand
 from mailman.interfaces.listmanager import IListManager
+from mailman.utilities.datetime import now as right_now
 from zope.component import getUtility
 from zope.interface import implementer
 
@@ -57,6 +61,11 @@ class Digests:
             help=_("""Increment the digest volume number and reset the digest
                    number to one.  If given with --send, the volume number is
                    incremented before any current digests are sent."""))
+        command_parser.add_argument(
+            '-p', '--periodic',
+            default=False, action='store_true',
+            help=_("""Only send the digests of the mailing lists which are
+                   configured to send their digests periodically."""))
         command_parser.add_argument(
             '-n', '--dry-run',
             default=False, action='store_true',
@@ -83,9 +92,10 @@ class Digests:
                 else:
                     lists.append(mlist)
         else:
-            lists = list(list_manager.mailing_lists)
+            lists = None
         if args.bump:
-            for mlist in lists:
+            for mlist in (list_manager.mailing_lists if lists is None
+                          else lists):
                 if args.verbose:
                     print(_('\
 $mlist.list_id is at volume $mlist.volume, number \
@@ -97,9 +107,31 @@ ${mlist.next_digest_number}'))
 $mlist.list_id bumped to volume $mlist.volume, number \
 ${mlist.next_digest_number}'))
         if args.send:
-            for mlist in lists:
+            # Without any --list options, find the mailing lists which have
+            # digests waiting, rather than looking at every mailing list.
+            if lists is None:
+                lists = list(lists_with_digests(periodic=args.periodic))
+            elif args.periodic:
+                lists = [mlist for mlist in lists
+                         if mlist.digest_send_periodic]
+            # The digest runner builds the digests at evenly spaced times
+            # during the send window.
+            window = as_timedelta(config.digests.send_window)
+            start = right_now()
+            started = time.time()
+            for index, mlist in enumerate(lists):
                 if args.verbose:
                     print(_('\
 $mlist.list_id sent volume $mlist.volume, number ${mlist.next_digest_number}'))
                 if not args.dry_run:
-                    maybe_send_digest_now(mlist, force=True)
+                    deliver_after = (start + window * index / len(lists)
+                                     if window else None)
+                    maybe_send_digest_now(
+                        mlist, force=True, deliver_after=deliver_after)
+            if args.verbose:
+                count = len(lists)
+                seconds = '{:.2f}'.format(time.time() - started)    # noqa
+                print(_('Queued $count digests in $seconds seconds'))
+                if window and count > 1:
+                    print(_('The digests will be built during the next '
+                            '$window'))
@@ -22,14 +22,17 @@ import sys
 from contextlib import ExitStack
 from email.utils import formataddr, parseaddr
 from mailman import public
-from mailman.app.membership import add_member
 from mailman.core.i18n import _
 from mailman.database.transaction import transactional
+from mailman.interfaces.address import InvalidEmailAddressError
 from mailman.interfaces.command import ICLISubCommand
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.member import (
-    AlreadySubscribedError, DeliveryMode, DeliveryStatus, MemberRole)
-from mailman.interfaces.subscriptions import RequestRecord
+    AlreadySubscribedError, DeliveryMode, DeliveryStatus, MemberRole,
+    MembershipIsBannedError)
+from mailman.interfaces.subscriptions import (
+    ISubscriptionService, RequestRecord)
+from mailman.model.member import QUERY_BATCH_SIZE
 from operator import attrgetter
 from zope.component import getUtility
 from zope.interface import implementer
@@ -53,6 +56,12 @@ class Members:
             indicate standard input.  Blank lines and lines That start with a
             '#' are ignored.  Without this option, this command displays
             mailing list members."""))
+        command_parser.add_argument(
+            '-q', '--quiet',
+            default=False, action='store_true',
+            help=_("""\
+            Don't print the progress of adding members.  Warnings about
+            skipped addresses are still printed."""))
         command_parser.add_argument(
             '-o', '--output',
             dest='output_filename', metavar='FILENAME',
@@ -215,18 +224,19 @@ class Members:
             else:
                 fp = resources.enter_context(
                     open(args.input_filename, 'r', encoding='utf-8'))
-            for line in fp:
-                # Ignore blank lines and lines that start with a '#'.
-                if line.startswith('#') or len(line.strip()) == 0:
-                    continue
-                # Parse the line and ensure that the values are unicodes.
-                display_name, email = parseaddr(line)
-                try:
-                    add_member(mlist,
-                               RequestRecord(email, display_name,
-                                             DeliveryMode.regular,
-                                             mlist.preferred_language.code))
-                except AlreadySubscribedError:
+            records = self._read_records(mlist, fp)
+            results = getUtility(ISubscriptionService).subscribe_members(
+                mlist.list_id, records)
+            # The members are subscribed a batch at a time, so report the
+            # progress after each batch.
+            processed = subscribed = 0
+            for record, result in results:
+                processed += 1
+                if not isinstance(result, Exception):
+                    subscribed += 1
+                email = record.email                    # noqa
+                display_name = record.display_name
+                if isinstance(result, AlreadySubscribedError):
                     # It's okay if the address is already subscribed, just
                     # print a warning and continue.
                     if not display_name:
@@ -234,3 +244,27 @@ class Members:
                     else:
                         print(_('Already subscribed (skipping): '
                                 '$display_name <$email>'))
+                elif isinstance(result, MembershipIsBannedError):
+                    print(_('Banned address (skipping): $email'))
+                elif isinstance(result, InvalidEmailAddressError):
+                    print(_('Invalid email address (skipping): $email'))
+                if processed % QUERY_BATCH_SIZE == 0:
+                    self._print_progress(args, processed, subscribed)
+            if processed % QUERY_BATCH_SIZE != 0:
+                self._print_progress(args, processed, subscribed)
+
+    def _print_progress(self, args, processed, subscribed):
+        if not args.quiet:
+            print(_('Processed $processed records, '
+                    'subscribed $subscribed'), flush=True)
+
+    def _read_records(self, mlist, fp):
+        for line in fp:
+            # Ignore blank lines and lines that start with a '#'.
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
+            # Parse the line and ensure that the values are unicodes.
+            display_name, email = parseaddr(line)
+            yield RequestRecord(email, display_name,
+                                DeliveryMode.regular,
+                                mlist.preferred_language.code)
@@ -21,6 +21,7 @@ import pickle
 
 from mailman import public
 from mailman.core.i18n import _
+from mailman.core.switchboard import RAW_MAGIC, read_raw_queue_file
 from mailman.interfaces.command import ICLISubCommand
 from mailman.utilities.interact import interact
 from pprint import PrettyPrinter
@@ -65,11 +66,16 @@ class QFile:
         printer = PrettyPrinter(indent=4)
         assert len(args.qfile) == 1, 'Wrong number of positional arguments'
         with open(args.qfile[0], 'rb') as fp:
-            while True:
-                try:
-                    m.append(pickle.load(fp))
-                except EOFError:
-                    break
+            if fp.read(len(RAW_MAGIC)) == RAW_MAGIC:
+                # Raw format queue files hold the message and its metadata.
+                m.extend(read_raw_queue_file(fp))
+            else:
+                fp.seek(0)
+                while True:
+                    try:
+                        m.append(pickle.load(fp))
+                    except EOFError:
+                        break
         if args.doprint:
             print(_('[----- start pickle -----]'))
             for i, obj in enumerate(m):
@@ -21,6 +21,7 @@ import socket
 
 from mailman import public
 from mailman.bin.master import WatcherState, master_state
+from mailman.config import config
 from mailman.core.i18n import _
 from mailman.interfaces.command import ICLISubCommand
 from zope.interface import implementer
@@ -35,7 +36,12 @@ class Status:
 
     def add(self, parser, command_parser):
         """See `ICLISubCommand`."""
-        pass
+        command_parser.add_argument(
+            '-q', '--queues',
+            default=False, action='store_true',
+            help=_("""\
+            Also print the number of entries waiting in each queue, and in
+            each of the queue's slices."""))
 
     def process(self, args):
         """See `ICLISubCommand`."""
@@ -56,4 +62,15 @@ class Status:
             message = _('GNU Mailman is in an unexpected state '
                         '($hostname != $fqdn_name)')
         print(message)
+        if args.queues:
+            for name in sorted(config.switchboards):
+                backlog = config.switchboards[name].backlog()
+                total = sum(backlog.values())           # noqa
+                if len(backlog) == 1:
+                    print(_('$name: $total waiting'))
+                else:
+                    slices = ', '.join(                 # noqa
+                        '{}: {}'.format(slice_number, backlog[slice_number])
+                        for slice_number in sorted(backlog))
+                    print(_('$name: $total waiting (slices $slices)'))
         return status.value
@@ -41,6 +41,7 @@ class FakeArgs:
         self.lists = []
         self.send = False
         self.bump = False
+        self.periodic = False
         self.dry_run = False
         self.verbose = False
 
@@ -344,6 +345,62 @@ Subject: message 3
         self.assertIn('Subject: message 3', digest_contents)
         self.assertIn('Subject: message 4', digest_contents)
 
+    def test_send_periodic_digests(self):
+        # Only the digests of the mailing lists which send them periodically
+        # are sent.
+        bee = create_list('bee@example.com')
+        bee.digests_enabled = True
+        bee.digest_send_periodic = False
+        bee.send_welcome_message = False
+        member = subscribe(bee, 'Bart')
+        member.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        msg = mfs("""\
+To: ant@example.com
+From: anne@example.com
+Subject: message 1
+
+""")
+        self._handler.process(self._mlist, msg, {})
+        self._handler.process(bee, msg, {})
+        args = FakeArgs()
+        args.send = True
+        args.periodic = True
+        self._command.process(args)
+        self._runner.run()
+        items = get_queue_messages('virgin', expected_count=1)
+        self.assertEqual(items[0].msg['to'], 'ant@example.com')
+        bee_mailbox_path = os.path.join(bee.data_path, 'digest.mmdf')
+        self.assertGreater(os.path.getsize(bee_mailbox_path), 0)
+
+    def test_send_digests_over_window(self):
+        # The digests are spread out over the send window.
+        bee = create_list('bee@example.com')
+        bee.send_welcome_message = False
+        msg = mfs("""\
+To: ant@example.com
+From: anne@example.com
+Subject: message 1
+
+""")
+        self._handler.process(self._mlist, msg, {})
+        self._handler.process(bee, msg, {})
+        config.push('window', """
+        [digests]
+        send_window: 1h
+        """)
+        self.addCleanup(config.pop, 'window')
+        args = FakeArgs()
+        args.send = True
+        self._command.process(args)
+        items = get_queue_messages('digest', expected_count=2)
+        deliver_after = sorted(
+            (item.msgdata['listid'], item.msgdata['deliver_after'])
+            for item in items)
+        self.assertEqual(deliver_after, [
+            ('ant.example.com', right_now()),
+            ('bee.example.com', right_now() + timedelta(minutes=30)),
+            ])
+
     def test_send_no_digest_ready(self):
         # If no messages have been sent through the mailing list, no digest
         # can be sent.
@@ -446,6 +503,7 @@ ant.example.com bumped to volume 7, number 5
         output = StringIO()
         with patch('sys.stdout', output):
             self._command.process(args)
-        self.assertMultiLineEqual(output.getvalue(), """\
-ant.example.com sent volume 7, number 4
-""")
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0], 'ant.example.com sent volume 7, number 4')
+        self.assertRegex(lines[1], r'^Queued 1 digests in \d+\.\d\d seconds$')
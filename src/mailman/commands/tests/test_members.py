@@ -20,10 +20,12 @@
 import sys
 import unittest
 
+from contextlib import ExitStack
 from functools import partial
 from io import StringIO
 from mailman.app.lifecycle import create_list
 from mailman.commands.cli_members import Members
+from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.member import MemberRole
 from mailman.testing.helpers import subscribe
 from mailman.testing.layers import ConfigLayer
@@ -39,6 +41,7 @@ class FakeArgs:
     digest = None
     nomail = None
     list = None
+    quiet = True
 
 
 class FakeParser:
@@ -144,3 +147,51 @@ class TestCLIMembers(unittest.TestCase):
            outfp.getvalue(),
            'Already subscribed (skipping): Anne Person <aperson@example.com>\n'
            )
+
+    def test_banned_and_invalid_addresses(self):
+        # Banned and invalid addresses are skipped with a warning, and the
+        # other addresses are still subscribed.
+        IBanManager(self._mlist).ban('bart@example.com')
+        outfp = StringIO()
+        with NamedTemporaryFile('w', buffering=1, encoding='utf-8') as infp:
+            print('Bart Person <bart@example.com>', file=infp)
+            print('bogus', file=infp)
+            print('cate@example.com', file=infp)
+            self.args.list = ['ant.example.com']
+            self.args.input_filename = infp.name
+            with patch('builtins.print', partial(print, file=outfp)):
+                self.command.process(self.args)
+        self.assertEqual(
+           outfp.getvalue(),
+           'Banned address (skipping): bart@example.com\n'
+           'Invalid email address (skipping): bogus\n'
+           )
+        self.assertEqual(
+            [address.email for address in self._mlist.members.addresses],
+            ['cate@example.com'])
+
+    def test_progress(self):
+        # Unless the command is quiet, it reports its progress after each
+        # batch of addresses.
+        self.args.quiet = False
+        outfp = StringIO()
+        with NamedTemporaryFile('w', buffering=1, encoding='utf-8') as infp:
+            for name in ('anne', 'bart', 'anne', 'cate', 'dave'):
+                print('{}@example.com'.format(name), file=infp)
+            self.args.list = ['ant.example.com']
+            self.args.input_filename = infp.name
+            with ExitStack() as resources:
+                resources.enter_context(patch(
+                    'mailman.model.subscriptions.QUERY_BATCH_SIZE', 2))
+                resources.enter_context(patch(
+                    'mailman.commands.cli_members.QUERY_BATCH_SIZE', 2))
+                resources.enter_context(
+                    patch('builtins.print', partial(print, file=outfp)))
+                self.command.process(self.args)
+        self.assertEqual(
+           outfp.getvalue(),
+           'Processed 2 records, subscribed 2\n'
+           'Already subscribed (skipping): anne@example.com\n'
+           'Processed 4 records, subscribed 3\n'
+           'Processed 5 records, subscribed 4\n'
+           )
@@ -0,0 +1,62 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+"""Test the `mailman qfile` command."""
+
+import unittest
+
+from io import StringIO
+from mailman.commands.cli_qfile import QFile, m
+from mailman.config import config
+from mailman.core.switchboard import Switchboard
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+class FakeArgs:
+    interactive = False
+    doprint = True
+    qfile = []
+
+
+class TestQFile(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._command = QFile()
+        self.addCleanup(m.clear)
+
+    def test_raw_format(self):
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+Hello.
+""")
+        shunt = config.switchboards['shunt']
+        switchboard = Switchboard(
+            'shunt', shunt.queue_directory, file_format='raw')
+        filebase = switchboard.enqueue(msg, foo=7)
+        FakeArgs.qfile = [
+            '{}/{}.pck'.format(switchboard.queue_directory, filebase)]
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self._command.process(FakeArgs)
+        self.assertEqual(len(m), 2)
+        self.assertEqual(m[0]['message-id'], '<ant>')
+        self.assertEqual(m[1]['foo'], 7)
+        self.assertIn('Hello.', stdout.getvalue())
@@ -29,10 +29,11 @@ from mailman import public
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
-from mailman.core.switchboard import Switchboard
+from mailman.core.switchboard import GroupCommit, Switchboard
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.runner import IRunner, RunnerCrashEvent
+from mailman.interfaces.switchboard import AlreadyClaimedError
 from mailman.utilities.string import expand
 from zope.component import getUtility
 from zope.event import notify
@@ -68,7 +69,9 @@ class Runner:
         if self.is_queue_runner:
             self.queue_directory = expand(section.path, substitutions)
             self.switchboard = Switchboard(
-                name, self.queue_directory, slice, numslices, True)
+                name, self.queue_directory, slice, numslices, True,
+                as_boolean(section.index), section.file_format,
+                as_boolean(section.claim))
         else:
             self.queue_directory = None
             self.switchboard = None
@@ -78,6 +81,9 @@ class Runner:
                             self.sleep_time.seconds +
                             self.sleep_time.microseconds / 1.0e6)
         self.max_restarts = int(section.max_restarts)
+        self.sync_batch = int(section.sync_batch)
+        self._group_commit = None
+        self._unfinished = []
         self.start = as_boolean(section.start)
         self._stop = False
         self.status = 0
@@ -133,15 +139,38 @@ class Runner:
         """See `IRunner`."""
         me = self.__class__.__name__
         dlog.debug('[%s] starting oneloop', me)
+        files = self._get_files()
+        if self.sync_batch == 0:
+            self._process_files(files)
+        else:
+            try:
+                with GroupCommit() as self._group_commit:
+                    self._process_files(files)
+                    self._commit()
+            finally:
+                # Whatever was not committed is processed again.
+                self._group_commit = None
+                del self._unfinished[:]
+        dlog.debug('[%s] ending oneloop: %s', me, len(files))
+        return len(files)
+
+    def _get_files(self):
+        """See `IRunner`."""
         # List all the files in our queue directory.  The switchboard is
         # guaranteed to hand us the files in FIFO order.
-        files = self.switchboard.files
+        return self.switchboard.files
+
+    def _process_files(self, files):
+        me = self.__class__.__name__
         for filebase in files:
             dlog.debug('[%s] processing filebase: %s', me, filebase)
             try:
                 # Ask the switchboard for the message and metadata objects
                 # associated with this queue file.
                 msg, msgdata = self.switchboard.dequeue(filebase)
+            except AlreadyClaimedError:
+                # Another instance of this runner is processing it.
+                continue
             except Exception as error:
                 # This used to just catch email.Errors.MessageParseError, but
                 # other problems can occur in message parsing, e.g.
@@ -158,7 +187,7 @@ class Runner:
                 dlog.debug('[%s] processing onefile', me)
                 self._process_one_file(msg, msgdata)
                 dlog.debug('[%s] finishing filebase: %s', me, filebase)
-                self.switchboard.finish(filebase)
+                self._finish(filebase)
             except Exception as error:
                 # All runners that implement _dispose() must guarantee that
                 # exceptions are caught and dealt with properly.  Still, there
@@ -176,7 +205,7 @@ class Runner:
                     shunt = config.switchboards['shunt']
                     new_filebase = shunt.enqueue(msg, msgdata)
                     elog.error('SHUNTING: %s', new_filebase)
-                    self.switchboard.finish(filebase)
+                    self._finish(filebase)
                 except Exception as error:
                     # The message wasn't successfully shunted.  Log the
                     # exception and try to preserve the original queue entry
@@ -185,7 +214,7 @@ class Runner:
                     elog.error(
                         'SHUNTING FAILED, preserving original entry: %s',
                         filebase)
-                    self.switchboard.finish(filebase, preserve=True)
+                    self._finish(filebase, preserve=True)
                 config.db.abort()
             # Other work we want to do each time through the loop.
             dlog.debug('[%s] doing periodic', me)
@@ -196,8 +225,22 @@ class Runner:
             if self._short_circuit():
                 dlog.debug('[%s] short circuiting', me)
                 break
-        dlog.debug('[%s] ending oneloop: %s', me, len(files))
-        return len(files)
+
+    def _finish(self, filebase, preserve=False):
+        if self._group_commit is None:
+            self.switchboard.finish(filebase, preserve)
+            return
+        # The backup file may only be removed once everything enqueued while
+        # processing it is durable.
+        self._unfinished.append((filebase, preserve))
+        if len(self._unfinished) >= self.sync_batch:
+            self._commit()
+
+    def _commit(self):
+        self._group_commit.commit()
+        for filebase, preserve in self._unfinished:
+            self.switchboard.finish(filebase, preserve)
+        del self._unfinished[:]
 
     def _process_one_file(self, msg, msgdata):
         """See `IRunner`."""
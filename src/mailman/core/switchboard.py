@@ -15,28 +15,77 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Queuing and dequeuing message/metadata pickle files.
+"""Queuing and dequeuing message/metadata files.
 
 Messages are represented as email.message.Message objects (or an instance ofa
 subclass).  Metadata is represented as a Python dictionary.  For every
 message/metadata pair in a queue, a single file containing two pickles is
 written.  First, the message is written to the pickle, then the metadata
 dictionary is written.
+
+Alternatively, a queue can use the raw file format.  Such a file starts with
+a magic line and a JSON header line, followed by the message as raw RFC 5322
+bytes, and then the metadata dictionary as JSON.  Metadata which JSON can't
+represent exactly, e.g. because it contains tuples, is pickled instead.
+Dequeuing a raw file returns a `LazyMessage`, which is only parsed when it is
+actually used.  Large messages are memory mapped from the file instead of
+being read, and a message which is itself memory mapped is always written in
+the raw format, so neither has to be held in memory; in a pickle queue, its
+metadata is still pickled.  Both formats can always be dequeued, whatever the
+queue's configured format.
+
+Normally every queue file is synced to disk before it is renamed into place,
+so once enqueue() returns, the entry survives a crash.  A runner can instead
+process several queue entries inside a `GroupCommit`.  The files enqueued
+meanwhile are then written but left under their temporary names, and the
+runner's commit syncs them all together, renames them into place, and then
+syncs each queue directory once.  The runner only removes the backup files of
+the entries it processed after that commit, so a crash before the commit
+loses no messages; the backups are recovered and processed again when the
+runner restarts.  The files enqueued by an aborted group are removed.  A group
+only applies to the thread which opened it, so files enqueued by other
+threads meanwhile are synced and published immediately, as usual.
+
+A queue can also keep a ready index.  Every enqueued file base is then
+appended to a journal file for the slice it belongs to, and the runner owning
+that slice reads only the new journal entries on each pass, instead of listing
+the whole queue directory.  The journal is not synced to disk, so the queue
+directory is still fully scanned whenever the runner starts.
+
+Instead of splitting the hash space into fixed slices, the instances of a
+runner can share its queue by claiming entries.  Every instance then sees all
+the queue files, and dequeuing atomically moves the file into the instance's
+own claim directory, where its backup lives while it is being processed.  An
+instance which loses the race for an entry just skips it.  Each instance holds
+a lock on its claim directory while it runs, so the claims of instances that
+died, or that are no longer configured, can be safely recovered by any other
+instance when it starts.  The ready index is not used by claiming runners.
 """
 
 import os
+import json
+import mmap
 import time
 import email
+import fcntl
 import pickle
 import hashlib
 import logging
+import threading
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from enum import Enum
+from lazr.config import as_boolean
 from mailman import public
 from mailman.config import config
-from mailman.email.message import Message
+from mailman.email.message import LazyMessage, Message
 from mailman.interfaces.configuration import ConfigurationUpdatedEvent
-from mailman.interfaces.switchboard import ISwitchboard
+from mailman.interfaces.switchboard import AlreadyClaimedError, ISwitchboard
 from mailman.utilities.filesystem import makedirs
+from mailman.utilities.modules import find_name
 from mailman.utilities.string import expand
 from zope.interface import implementer
 
@@ -51,6 +100,25 @@ DELTA = .0001
 # In order to prevent loops and a message flood, when the count reaches this
 # value, we move the file to the bad queue as a .psv.
 MAX_BAK_COUNT = 3
+# Once a ready journal has grown past this many bytes, and all its entries
+# have been read, the runner consuming it removes it and starts a new one.
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+# Raw format queue files start with this line.
+RAW_MAGIC = b'MMQ1\n'
+# Messages of at least this many bytes in raw format queue files are memory
+# mapped when they are dequeued, instead of being read into memory.
+MAP_SIZE = 1024 * 1024
+# The keys of the dictionaries representing other types in JSON metadata.
+JSON_TAGS = ('__set__', '__datetime__', '__timedelta__', '__enum__')
+# Claiming runner instances keep their backup files in subdirectories of the
+# queue directory with this prefix, followed by the slice number.
+CLAIM_PREFIX = 'claimed-'
+
+# The number of threads syncing the files of a group commit in parallel.
+SYNC_THREADS = 4
+
+# The active group commit of each thread, if any.
+_local = threading.local()
 
 elog = logging.getLogger('mailman.error')
 
@@ -61,7 +129,8 @@ class Switchboard:
     """See `ISwitchboard`."""
 
     def __init__(self, name, queue_directory,
-                 slice=None, numslices=1, recover=False):
+                 slice=None, numslices=1, recover=False, index=False,
+                 file_format='pickle', claim=False):
         """Create a switchboard object.
 
         :param name: The queue name.
@@ -72,13 +141,28 @@ class Switchboard:
             None, it must be [0..`numslices`).
         :type slice: int or None
         :param numslices: The total number of slices to split this queue
-            directory into.  It must be a power of 2.
+            directory into.  It must be a power of 2, unless `claim` is True.
         :type numslices: int
         :param recover: True if backup files should be recovered.
         :type recover: bool
+        :param index: True if this queue keeps a ready index.  Every enqueued
+            file is then appended to the journal of its slice, and if `slice`
+            is also given, `get_files()` reads new entries from that journal
+            instead of listing the queue directory.
+        :type index: bool
+        :param file_format: The format of the queue files written by this
+            switchboard, either 'pickle' or 'raw'.
+        :type file_format: str
+        :param claim: True if the runner instances share this queue by
+            claiming its entries, instead of each owning a slice of the hash
+            space.  `slice` then just identifies the instance, and its claimed
+            entries are kept in its own claim directory.
+        :type claim: bool
         """
-        assert (numslices & (numslices - 1)) == 0, (
+        assert claim or (numslices & (numslices - 1)) == 0, (
             'Not a power of 2: {}'.format(numslices))
+        assert file_format in ('pickle', 'raw'), (
+            'Unknown queue file format: {}'.format(file_format))
         self.name = name
         self.queue_directory = queue_directory
         # If configured to, create the directory if it doesn't yet exist.
@@ -88,9 +172,31 @@ class Switchboard:
         self._lower = None
         self._upper = None
         # BAW: test performance and end-cases of this algorithm
-        if numslices != 1:
+        if slice is not None and numslices != 1 and not claim:
             self._lower = ((shamax + 1) * slice) / numslices
             self._upper = (((shamax + 1) * (slice + 1)) / numslices) - 1
+        self._numslices = numslices
+        self._claim = claim
+        self._index = index and not claim
+        self._file_format = file_format
+        # Only a switchboard owning a slice consumes the ready index.  The
+        # ready entries stay unknown until the first full directory scan.
+        self._journal = None
+        self._journal_offset = 0
+        self._ready = None
+        if self._index and slice is not None:
+            self._journal = self._journal_path(
+                0 if numslices == 1 else slice)
+        # A claiming instance keeps its backup files in its own directory,
+        # which it holds locked for as long as it runs.
+        self._backup_directory = self.queue_directory
+        self._claim_lock = None
+        if claim and slice is not None:
+            self._backup_directory = os.path.join(
+                self.queue_directory, CLAIM_PREFIX + str(slice))
+            makedirs(self._backup_directory, 0o770)
+            self._claim_lock = self._lock_claims(self._backup_directory)
+            fcntl.flock(self._claim_lock, fcntl.LOCK_EX)
         if recover:
             self.recover_backup_files()
 
@@ -98,75 +204,126 @@ class Switchboard:
         """See `ISwitchboard`."""
         if _metadata is None:
             _metadata = {}
-        # Calculate the SHA hexdigest of the message to get a unique base
-        # filename.  We're also going to use the digest as a hash into the set
-        # of parallel runner processes.
+        # Calculate the SHA hexdigest of the queue file contents to get a
+        # unique base filename.  We're also going to use the digest as a hash
+        # into the set of parallel runner processes.
         data = _metadata.copy()
         data.update(_kws)
         list_id = data.get('listid', '--nolist--')
-        # Get some data for the input to the sha hash.
+        # Always add the metadata schema version number
+        data['version'] = config.QFILE_SCHEMA_VERSION
+        # Filter out volatile entries, remembering whether the message should
+        # be stored as plain text.  Use .keys() so that we can mutate the
+        # dictionary during the iteration.
+        plaintext = data.get('_plaintext', False)
+        for k in list(data):
+            if k.startswith('_'):
+                del data[k]
+        # The contents are a list of bytes-like chunks, so that a large
+        # message body can be written without being copied in memory.  A
+        # memory mapped message is always written in the raw format, since a
+        # pickle would have to copy it.
+        contents = None
+        mapped = isinstance(_msg, LazyMessage) and _msg.is_mapped
+        if self._file_format == 'raw' or (mapped and not plaintext):
+            contents = _dumps_raw(
+                _msg, data, plaintext,
+                pickle_metadata=(self._file_format == 'pickle'))
+        if contents is None:
+            contents = [_dumps_pickle(_msg, data, plaintext)]
+        # Get some data for the input to the sha hash.  The list-id field is
+        # a string but the input to the hash function must be bytes.
         now = repr(time.time())
-        if data.get('_plaintext'):
-            protocol = 0
-            msgsave = pickle.dumps(str(_msg), protocol)
-        else:
-            protocol = pickle.HIGHEST_PROTOCOL
-            msgsave = pickle.dumps(_msg, protocol)
-        # The list-id field is a string but the input to the hash function must
-        # be bytes.
-        hashfood = msgsave + list_id.encode('utf-8') + now.encode('utf-8')
+        hashfood = hashlib.sha1()
+        for chunk in contents:
+            hashfood.update(chunk)
+        hashfood.update(list_id.encode('utf-8') + now.encode('utf-8'))
         # Encode the current time into the file name for FIFO sorting.  The
         # file name consists of two parts separated by a '+': the received
         # time for this message (i.e. when it first showed up on this system)
         # and the sha hex digest.
-        filebase = now + '+' + hashlib.sha1(hashfood).hexdigest()
+        filebase = now + '+' + hashfood.hexdigest()
         filename = os.path.join(self.queue_directory, filebase + '.pck')
         tmpfile = filename + '.tmp'
-        # Always add the metadata schema version number
-        data['version'] = config.QFILE_SCHEMA_VERSION
-        # Filter out volatile entries.  Use .keys() so that we can mutate the
-        # dictionary during the iteration.
-        for k in list(data):
-            if k.startswith('_'):
-                del data[k]
-        # We have to tell the dequeue() method whether to parse the message
-        # object or not.
-        data['_parsemsg'] = (protocol == 0)
-        # Write to the pickle file the message object and metadata.
+        # Write the message object and metadata to the queue file.  During a
+        # group commit, the file is synced and published later, along with
+        # all the other files in the group.
+        group_commit = getattr(_local, 'group_commit', None)
         with open(tmpfile, 'wb') as fp:
-            fp.write(msgsave)
-            pickle.dump(data, fp, protocol)
-            fp.flush()
-            os.fsync(fp.fileno())
-        os.rename(tmpfile, filename)
+            for chunk in contents:
+                fp.write(chunk)
+            if group_commit is None:
+                fp.flush()
+                os.fsync(fp.fileno())
+        if group_commit is None:
+            self._publish(filebase)
+        else:
+            group_commit.add(self, filebase)
         return filebase
 
+    def _publish(self, filebase):
+        # Make a synced queue file visible to the runners.
+        filename = os.path.join(self.queue_directory, filebase + '.pck')
+        os.rename(filename + '.tmp', filename)
+        if self._index:
+            self._append_to_journal(filebase)
+
     def dequeue(self, filebase):
         """See `ISwitchboard`."""
         # Calculate the filename from the given filebase.
         filename = os.path.join(self.queue_directory, filebase + '.pck')
-        backfile = os.path.join(self.queue_directory, filebase + '.bak')
+        backfile = os.path.join(self._backup_directory, filebase + '.bak')
+        if self._ready is not None:
+            self._ready.pop(filebase, None)
+        if self._claim:
+            # Claim the entry first.  Only one of the competing instances
+            # can succeed with the rename.
+            try:
+                os.rename(filename, backfile)
+            except FileNotFoundError:
+                raise AlreadyClaimedError(filebase)
+            filename = backfile
         # Read the message object and metadata.
         with open(filename, 'rb') as fp:
             # Move the file to the backup file name for processing.  If this
             # process crashes uncleanly the .bak file will be used to
             # re-instate the .pck file in order to try again.
-            os.rename(filename, backfile)
-            msg = pickle.load(fp)
-            data = pickle.load(fp)
+            if not self._claim:
+                os.rename(filename, backfile)
+            if fp.read(len(RAW_MAGIC)) == RAW_MAGIC:
+                msg, data = read_raw_queue_file(fp)
+                raw = True
+            else:
+                fp.seek(0)
+                msg = pickle.load(fp)
+                data = pickle.load(fp)
+                raw = False
         if data.get('_parsemsg'):
             # Calculate the original size of the text now so that we won't
             # have to generate the message later when we do size restriction
             # checking.
-            original_size = len(msg)
-            msg = email.message_from_string(msg, Message)
+            if raw:
+                original_size = len(msg._raw)
+            else:
+                original_size = len(msg)
+                msg = email.message_from_string(msg, Message)
             msg.original_size = original_size
             data['original_size'] = original_size
         return msg, data
 
+    def metadata(self, filebase):
+        """See `ISwitchboard`."""
+        filename = os.path.join(self.queue_directory, filebase + '.pck')
+        with open(filename, 'rb') as fp:
+            metadata_format = _skip_message(fp)
+            return _load_metadata(fp, metadata_format)
+
     def finish(self, filebase, preserve=False):
         """See `ISwitchboard`."""
-        bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        bakfile = os.path.join(self._backup_directory, filebase + '.bak')
+        self._finish_backup(bakfile, filebase, preserve)
+
+    def _finish_backup(self, bakfile, filebase, preserve):
         try:
             if preserve:
                 bad_dir = config.switchboards['bad'].queue_directory
@@ -185,10 +342,44 @@ class Switchboard:
 
     def get_files(self, extension='.pck'):
         """See `ISwitchboard`."""
+        if self._journal is None or extension != '.pck':
+            return self._scan_files(extension)
+        if self._ready is None:
+            # This is the first pass, so the directory has to be scanned for
+            # files enqueued before the runner started.  Any older journal
+            # entries are covered by the scan.
+            with self._new_journal():
+                self._ready = OrderedDict.fromkeys(self._scan_files(extension))
+        else:
+            self._read_journal()
+            if self._journal_offset >= JOURNAL_COMPACT_SIZE:
+                with self._new_journal():
+                    self._read_journal()
+        return list(self._ready)
+
+    def backlog(self):
+        """Return the number of waiting entries in each slice of the queue.
+
+        :return: A dictionary mapping slice numbers to the number of queue
+            files waiting in that slice.  A queue shared by claiming runners
+            isn't sliced, so all its files are counted under slice 0.
+        :rtype: dict
+        """
+        numslices = 1 if self._claim else self._numslices
+        counts = dict.fromkeys(range(numslices), 0)
+        for filebase in self._scan_files('.pck', bounds=False):
+            when, digest = filebase.split('+', 1)
+            counts[int(digest, 16) * numslices // (shamax + 1)] += 1
+        return counts
+
+    def _scan_files(self, extension, directory=None, bounds=True):
+        if directory is None:
+            directory = (self._backup_directory if extension == '.bak'
+                         else self.queue_directory)
         times = {}
-        lower = self._lower
+        lower = self._lower if bounds else None
         upper = self._upper
-        for f in os.listdir(self.queue_directory):
+        for f in os.listdir(directory):
             # By ignoring anything that doesn't end in .pck, we ignore
             # tempfiles and avoid a race condition.
             filebase, ext = os.path.splitext(f)
@@ -206,48 +397,377 @@ class Switchboard:
         # FIFO sort
         return [times[k] for k in sorted(times)]
 
+    def _journal_path(self, slice):
+        return os.path.join(
+            self.queue_directory, 'ready-{:d}.idx'.format(slice))
+
+    def _append_to_journal(self, filebase):
+        when, digest = filebase.split('+', 1)
+        slice = int(digest, 16) * self._numslices // (shamax + 1)
+        path = self._journal_path(slice)
+        line = (filebase + '\n').encode('ascii')
+        while True:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o660)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                # The runner may have replaced the journal while we were
+                # waiting for the lock, in which case we have to start over
+                # with the new one.
+                try:
+                    current = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if current.st_ino == os.fstat(fd).st_ino:
+                    os.write(fd, line)
+                    return
+            finally:
+                os.close(fd)
+
+    def _read_journal(self):
+        try:
+            with open(self._journal, 'rb') as fp:
+                fp.seek(self._journal_offset)
+                data = fp.read()
+        except FileNotFoundError:
+            return
+        # An enqueuer may be in the middle of appending, so only consume
+        # complete lines.
+        end = data.rfind(b'\n') + 1
+        self._journal_offset += end
+        for filebase in data[:end].decode('ascii').splitlines():
+            filename = os.path.join(self.queue_directory, filebase + '.pck')
+            if os.path.exists(filename):
+                self._ready[filebase] = None
+
+    @contextmanager
+    def _new_journal(self):
+        # Lock out the enqueuers while the body runs, then remove the current
+        # journal so that the next enqueue starts a new one.
+        fd = os.open(self._journal, os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+            os.unlink(self._journal)
+            self._journal_offset = 0
+        finally:
+            os.close(fd)
+
     def recover_backup_files(self):
         """See `ISwitchboard`."""
+        self._recover_backup_files(self._backup_directory)
+        if self._claim_lock is None:
+            return
+        # Also recover the claims of the instances which aren't running, e.g.
+        # because they died or because there are fewer instances now.  The
+        # first instance also takes care of the backup files left in the
+        # queue directory itself, by runners that didn't claim.
+        for name in os.listdir(self.queue_directory):
+            directory = os.path.join(self.queue_directory, name)
+            if (not name.startswith(CLAIM_PREFIX) or
+                    directory == self._backup_directory):
+                continue
+            fd = self._lock_claims(directory)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # The owning instance is running.
+                    continue
+                self._recover_backup_files(directory)
+            finally:
+                os.close(fd)
+        if self._backup_directory.endswith(CLAIM_PREFIX + '0'):
+            self._recover_backup_files(self.queue_directory)
+
+    def _lock_claims(self, directory):
+        return os.open(os.path.join(directory, 'claims.lock'),
+                       os.O_RDWR | os.O_CREAT, 0o660)
+
+    def _recover_backup_files(self, directory):
         # Move all .bak files in our slice to .pck.  It's impossible for both
         # to exist at the same time, so the move is enough to ensure that our
         # normal dequeuing process will handle them.  We keep count in
         # _bak_count in the metadata of the number of times we recover this
         # file.  When the count reaches MAX_BAK_COUNT, we move the .bak file
         # to a .psv file in the bad queue.
-        for filebase in self.get_files('.bak'):
-            src = os.path.join(self.queue_directory, filebase + '.bak')
+        for filebase in self._scan_files('.bak', directory):
+            src = os.path.join(directory, filebase + '.bak')
             dst = os.path.join(self.queue_directory, filebase + '.pck')
             with open(src, 'rb+') as fp:
                 try:
-                    # Throw away the message object.
-                    pickle.load(fp)
+                    metadata_format = _skip_message(fp)
                     data_pos = fp.tell()
-                    data = pickle.load(fp)
+                    data = _load_metadata(fp, metadata_format)
                 except Exception as error:
                     # If unpickling throws any exception, just log and
                     # preserve this entry
                     elog.error('Unpickling .bak exception: %s\n'
                                'Preserving file: %s', error, filebase)
-                    self.finish(filebase, preserve=True)
+                    self._finish_backup(src, filebase, preserve=True)
                 else:
                     data['_bak_count'] = data.get('_bak_count', 0) + 1
                     fp.seek(data_pos)
-                    if data.get('_parsemsg'):
-                        protocol = 0
+                    if metadata_format == 'json':
+                        fp.write(_dumps_json(data))
                     else:
-                        protocol = 1
-                    pickle.dump(data, fp, protocol)
+                        if data.get('_parsemsg'):
+                            protocol = 0
+                        else:
+                            protocol = 1
+                        pickle.dump(data, fp, protocol)
                     fp.truncate()
                     fp.flush()
                     os.fsync(fp.fileno())
                     if data['_bak_count'] >= MAX_BAK_COUNT:
                         elog.error('.bak file max count, preserving file: %s',
                                    filebase)
-                        self.finish(filebase, preserve=True)
+                        self._finish_backup(src, filebase, preserve=True)
                     else:
                         os.rename(src, dst)
 
 
+@public
+class GroupCommit:
+    """Make the files enqueued by this thread durable in batches.
+
+    While a group commit is active, the files the thread enqueues are written
+    to their temporary names only.  `commit()` syncs all of them, a few at a
+    time in parallel, and then renames them into place, making them visible
+    to the runners.  Finally, each queue directory is synced once, instead of
+    once for every file, so that the renames are durable too.
+    """
+
+    def __init__(self):
+        self._pending = []
+
+    def __enter__(self):
+        assert getattr(_local, 'group_commit', None) is None, (
+            'Nested group commit')
+        _local.group_commit = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.group_commit = None
+        if exc_type is not None:
+            # The files which were not committed are thrown away.  The backup
+            # files of the entries being processed are not finished either,
+            # so those entries will be processed again.
+            pending, self._pending = self._pending, []
+            for switchboard, filebase in pending:
+                filename = os.path.join(
+                    switchboard.queue_directory, filebase + '.pck.tmp')
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+        # Don't suppress exceptions.
+        return False
+
+    def add(self, switchboard, filebase):
+        """Add a written, but not yet synced, queue file to the group."""
+        self._pending.append((switchboard, filebase))
+
+    def commit(self):
+        """Sync all the pending queue files, then make them visible."""
+        pending, self._pending = self._pending, []
+        if len(pending) == 0:
+            return
+        filenames = [
+            os.path.join(switchboard.queue_directory, filebase + '.pck.tmp')
+            for switchboard, filebase in pending
+            ]
+        with ThreadPoolExecutor(min(SYNC_THREADS, len(filenames))) as pool:
+            # Consume the results, so that any error is raised here.
+            for result in pool.map(_fsync_file, filenames):
+                pass
+        directories = set(
+            switchboard.queue_directory for switchboard, filebase in pending)
+        for switchboard, filebase in pending:
+            switchboard._publish(filebase)
+        # Make the renames durable too.
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def _fsync_file(filename):
+    # Sync a written queue file to disk.
+    with open(filename, 'rb') as fp:
+        os.fsync(fp.fileno())
+
+
+def _skip_message(fp):
+    # Move past the message in a queue file, to its metadata.  Return the
+    # format of the metadata, either 'json' or 'pickle'.
+    if fp.read(len(RAW_MAGIC)) == RAW_MAGIC:
+        # Skip over the message bytes.
+        header = json.loads(fp.readline().decode('utf-8'))
+        fp.seek(header['size'], os.SEEK_CUR)
+        return header.get('metadata', 'json')
+    # Throw away the message object.
+    fp.seek(0)
+    pickle.load(fp)
+    return 'pickle'
+
+
+def _load_metadata(fp, metadata_format):
+    if metadata_format == 'json':
+        return _loads_json(fp.read())
+    return pickle.load(fp)
+
+
+def _dumps_pickle(msg, data, plaintext):
+    if plaintext:
+        protocol = 0
+        msgsave = pickle.dumps(str(msg), protocol)
+    else:
+        protocol = pickle.HIGHEST_PROTOCOL
+        msgsave = pickle.dumps(msg, protocol)
+    # We have to tell the dequeue() method whether to parse the message
+    # object or not.
+    data['_parsemsg'] = (protocol == 0)
+    return msgsave + pickle.dumps(data, protocol)
+
+
+def _dumps_raw(msg, data, plaintext, pickle_metadata=False):
+    metadata = dict(data, _parsemsg=plaintext)
+    # Besides its headers and payload, a message object can carry extra
+    # attributes, e.g. original_size, which must survive the queue.
+    attributes = {}
+    if not plaintext:
+        attributes = {
+            name: value for name, value in vars(msg).items()
+            if name not in LazyMessage.state_attributes
+            }
+    try:
+        if plaintext:
+            text = [str(msg).encode('utf-8', 'surrogateescape')]
+        elif isinstance(msg, LazyMessage):
+            text = msg.as_chunks(unixfrom=(msg.get_unixfrom() is not None))
+        else:
+            text = [msg.as_bytes(unixfrom=(msg.get_unixfrom() is not None))]
+        size = sum(len(chunk) for chunk in text)
+        _check_json(attributes)
+        header = dict(size=size, attributes=attributes)
+        _dumps_json(header)
+    except (TypeError, UnicodeError):
+        # Either the message can't be flattened to bytes as it is, or one of
+        # its attributes can't be represented in JSON, so use a pickle
+        # instead.
+        return None
+    # The metadata can be pickled on its own, when the queue is configured to
+    # use pickles, or when it can't be represented in JSON exactly.
+    if not pickle_metadata:
+        try:
+            _check_json(metadata)
+            metadata = _dumps_json(metadata)
+        except TypeError:
+            pickle_metadata = True
+    if pickle_metadata:
+        header['metadata'] = 'pickle'
+        metadata = pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL)
+    header = _dumps_json(header)
+    if size >= MAP_SIZE:
+        # Pad the header line, so that the message starts on a boundary at
+        # which it can be memory mapped when it's dequeued.
+        offset = len(RAW_MAGIC) + len(header) + 1
+        header += b' ' * (-offset % mmap.ALLOCATIONGRANULARITY)
+    return [RAW_MAGIC + header + b'\n'] + text + [metadata]
+
+
+def _check_json(obj):
+    # JSON silently turns tuples into lists, and non-string keys into
+    # strings, so make sure there are none of them.  Neither must there be any
+    # dictionaries which would be mistaken for the tagged values of _encode(),
+    # which checks all the other types.
+    if isinstance(obj, tuple):
+        raise TypeError('Cannot store tuples in JSON: {!r}'.format(obj))
+    if isinstance(obj, dict):
+        if len(obj) == 1 and next(iter(obj)) in JSON_TAGS:
+            raise TypeError('Cannot store in JSON: {!r}'.format(obj))
+        for key, value in obj.items():
+            if not isinstance(key, str):
+                raise TypeError('Cannot store key in JSON: {!r}'.format(key))
+            _check_json(value)
+    elif isinstance(obj, (list, set)):
+        for value in obj:
+            _check_json(value)
+
+
+def _encode(obj):
+    # Represent the non-JSON types which commonly appear in message metadata
+    # as tagged dictionaries.
+    if type(obj) is set:
+        return {'__set__': list(obj)}
+    if isinstance(obj, datetime) and obj.tzinfo is None:
+        return {'__datetime__': [
+            obj.year, obj.month, obj.day,
+            obj.hour, obj.minute, obj.second, obj.microsecond]}
+    if isinstance(obj, timedelta):
+        return {'__timedelta__': [obj.days, obj.seconds, obj.microseconds]}
+    if isinstance(obj, Enum):
+        enum_class = type(obj)
+        return {'__enum__': [
+            enum_class.__module__ + '.' + enum_class.__name__, obj.name]}
+    raise TypeError('Cannot store in a raw queue file: {!r}'.format(obj))
+
+
+def _decode(obj):
+    if len(obj) != 1:
+        return obj
+    if '__set__' in obj:
+        return set(obj['__set__'])
+    if '__datetime__' in obj:
+        return datetime(*obj['__datetime__'])
+    if '__timedelta__' in obj:
+        return timedelta(*obj['__timedelta__'])
+    if '__enum__' in obj:
+        class_path, name = obj['__enum__']
+        enum_class = find_name(class_path)
+        if not issubclass(enum_class, Enum):
+            raise TypeError('Not an enum: {}'.format(class_path))
+        return enum_class[name]
+    return obj
+
+
+def _dumps_json(obj):
+    return json.dumps(obj, default=_encode).encode('utf-8')
+
+
+def _loads_json(data):
+    return json.loads(data.decode('utf-8'), object_hook=_decode)
+
+
+@public
+def read_raw_queue_file(fp):
+    """Read the message and metadata from a raw format queue file.
+
+    :param fp: The queue file, opened in binary mode and positioned just
+        after the magic line.
+    :return: The `LazyMessage` and the metadata dictionary.  Large messages
+        are memory mapped from the file rather than read into memory.
+    """
+    header = _loads_json(fp.readline())
+    size = header['size']
+    offset = fp.tell()
+    if size >= MAP_SIZE and offset % mmap.ALLOCATIONGRANULARITY == 0:
+        # Map a large message instead of reading it, so that only the parts
+        # which are actually used are paged in.  The mapping stays valid
+        # after the queue file is removed.
+        raw = mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ,
+                        offset=offset)
+        fp.seek(size, os.SEEK_CUR)
+    else:
+        raw = fp.read(size)
+    msg = LazyMessage(raw)
+    for name, value in header['attributes'].items():
+        setattr(msg, name, value)
+    return msg, _load_metadata(fp, header.get('metadata', 'json'))
+
+
 @public
 def handle_ConfigurationUpdatedEvent(event):
     """Initialize the global switchboards for input/output."""
@@ -264,4 +784,7 @@ def handle_ConfigurationUpdatedEvent(event):
             substitutions = config.paths
             substitutions['name'] = name
             path = expand(conf.path, substitutions)
-            config.switchboards[name] = Switchboard(name, path)
+            config.switchboards[name] = Switchboard(
+                name, path, numslices=int(conf.instances),
+                index=as_boolean(conf.index), file_format=conf.file_format,
+                claim=as_boolean(conf.claim))
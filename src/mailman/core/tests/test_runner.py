@@ -17,11 +17,13 @@
 
 """Test some Runner base class behavior."""
 
+import os
 import unittest
 
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.core.runner import Runner
+from mailman.core.switchboard import GroupCommit, Switchboard
 from mailman.interfaces.member import DeliveryMode
 from mailman.interfaces.runner import RunnerCrashEvent
 from mailman.runners.virgin import VirginRunner
@@ -31,6 +33,7 @@ from mailman.testing.helpers import (
     specialized_message_from_string as mfs,
     subscribe)
 from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
 
 
 class CrashingRunner(Runner):
@@ -38,6 +41,12 @@ class CrashingRunner(Runner):
         raise RuntimeError('borked')
 
 
+class ForwardingRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        config.switchboards['out'].enqueue(msg, msgdata)
+        config.switchboards['archive'].enqueue(msg, msgdata)
+
+
 class TestRunner(unittest.TestCase):
     """Test the Runner base class behavior."""
 
@@ -118,3 +127,92 @@ Message-ID: <ant>
         # The list's -request address is the original sender.
         self.assertEqual(item.msgdata['original_sender'],
                          'test-request@example.com')
+
+    @configuration('runner.in', sync_batch=2)
+    def test_group_commit(self):
+        # With group commits, the files enqueued while processing a batch of
+        # queue entries are synced together.
+        runner = make_testable_runner(ForwardingRunner, 'in')
+        for i in range(3):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{}>
+
+""".format(i))
+            config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        committed = []
+        finish = config.switchboards['in'].finish
+
+        def check_finish(filebase, preserve=False):
+            # By the time an entry is finished, everything enqueued for its
+            # batch has been committed.
+            committed.append(len(config.switchboards['out'].files))
+            finish(filebase, preserve)
+
+        with patch.object(runner.switchboard, 'finish', check_finish):
+            runner.run()
+        # Two batches: the first with two entries, the second with one.
+        self.assertEqual(committed, [2, 2, 3])
+        get_queue_messages('out', expected_count=3)
+        get_queue_messages('archive', expected_count=3)
+
+    @configuration('runner.in', sync_batch=2)
+    def test_group_commit_aborted(self):
+        # When a batch is aborted, the files enqueued for it are removed and
+        # its entries are left to be processed again.
+        runner = make_testable_runner(ForwardingRunner, 'in')
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        with patch.object(GroupCommit, 'commit',
+                          side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, runner._one_iteration)
+        self.assertEqual(runner._unfinished, [])
+        self.assertIsNone(runner._group_commit)
+        out = config.switchboards['out']
+        self.assertEqual(os.listdir(out.queue_directory), [])
+        # The entry's backup file is recovered and processed again.
+        switchboard = Switchboard('in', runner.queue_directory, recover=True)
+        self.assertEqual(len(switchboard.files), 1)
+
+    @configuration('runner.in', claim='yes', instances=3)
+    def test_claimed_elsewhere(self):
+        # Queue entries claimed by another instance of the runner are
+        # silently skipped.
+        runner = make_testable_runner(ForwardingRunner, 'in')
+        other = Switchboard('in', runner.queue_directory, 1, 3, claim=True)
+        self.addCleanup(os.close, other._claim_lock)
+        for i in range(3):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{}>
+
+""".format(i))
+            config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        dequeue = runner.switchboard.dequeue
+        claimed = []
+
+        def race(filebase):
+            # The other instance wins the race for the first entry.
+            if len(claimed) == 0:
+                claimed.append(other.dequeue(filebase))
+            return dequeue(filebase)
+
+        error_log = LogFileMark('mailman.error')
+        with patch.object(runner.switchboard, 'dequeue', race):
+            runner.run()
+        self.assertEqual(error_log.read(), '')
+        self.assertEqual(claimed[0][0]['message-id'], '<ant0>')
+        items = get_queue_messages('out', expected_count=2)
+        self.assertEqual(
+            sorted(item.msg['message-id'] for item in items),
+            ['<ant1>', '<ant2>'])
+        get_queue_messages('shunt', expected_count=0)
+        # The other instance still holds its claim.
+        self.assertEqual(len(other.get_files('.bak')), 1)
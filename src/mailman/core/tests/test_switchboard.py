@@ -17,13 +17,24 @@
 
 """Switchboard tests."""
 
+import os
+import shutil
+import tempfile
 import unittest
 
+from datetime import datetime, timedelta
 from mailman.config import config
+from mailman.core.switchboard import (
+    GroupCommit, MAP_SIZE, RAW_MAGIC, Switchboard)
+from mailman.email.message import LazyMessage
+from mailman.interfaces.action import Action
+from mailman.interfaces.switchboard import AlreadyClaimedError
 from mailman.testing.helpers import (
     LogFileMark,
     specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
+from stat import S_ISDIR
+from threading import Thread
 from unittest.mock import patch
 
 
@@ -51,3 +62,476 @@ Message-ID: <ant>
         traceback = error_log.read().splitlines()
         self.assertEqual(traceback[1], 'Traceback (most recent call last):')
         self.assertEqual(traceback[-1], 'OSError: Oops!')
+
+    def test_metadata(self):
+        # The metadata of a queue entry can be read without dequeuing it.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        switchboard = config.switchboards['shunt']
+        filebase = switchboard.enqueue(msg, listid='test.example.com')
+        msgdata = switchboard.metadata(filebase)
+        self.assertEqual(msgdata['listid'], 'test.example.com')
+        self.assertEqual(switchboard.files, [filebase])
+        switchboard.dequeue(filebase)
+        self.assertRaises(FileNotFoundError, switchboard.metadata, filebase)
+        switchboard.finish(filebase)
+
+
+class TestSwitchboardIndex(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def _switchboard(self, slice=None, numslices=1):
+        return Switchboard('test', self._queue_directory,
+                           slice, numslices, index=True)
+
+    def test_startup_scan(self):
+        # Files enqueued before the runner starts are found by the full scan.
+        producer = self._switchboard()
+        filebases = [producer.enqueue(self._msg) for i in range(3)]
+        consumer = self._switchboard(slice=0)
+        self.assertEqual(consumer.files, filebases)
+
+    def test_new_files_without_listing(self):
+        # After the first scan, new files are read from the journal, in FIFO
+        # order, without listing the queue directory.
+        producer = self._switchboard()
+        consumer = self._switchboard(slice=0)
+        self.assertEqual(consumer.files, [])
+        filebases = [producer.enqueue(self._msg) for i in range(3)]
+        with patch('mailman.core.switchboard.os.listdir',
+                   side_effect=AssertionError):
+            self.assertEqual(consumer.files, filebases)
+            # Dequeued files are no longer ready.
+            consumer.dequeue(filebases[0])
+            consumer.finish(filebases[0])
+            self.assertEqual(consumer.files, filebases[1:])
+
+    def test_slices(self):
+        # Every enqueued file shows up in exactly one slice's journal.
+        producer = self._switchboard(numslices=2)
+        consumers = [self._switchboard(slice=i, numslices=2)
+                     for i in range(2)]
+        for consumer in consumers:
+            self.assertEqual(consumer.files, [])
+        filebases = [producer.enqueue(self._msg) for i in range(20)]
+        files = [consumer.files for consumer in consumers]
+        self.assertEqual(set(files[0]) & set(files[1]), set())
+        self.assertEqual(sorted(files[0] + files[1]), sorted(filebases))
+        # The journal agrees with the directory scan.
+        scanned = Switchboard('test', self._queue_directory, 0, 2)
+        self.assertEqual(files[0], scanned.files)
+
+    def test_journal_compaction(self):
+        # Once read, a large journal is replaced by a new one.
+        producer = self._switchboard()
+        consumer = self._switchboard(slice=0)
+        self.assertEqual(consumer.files, [])
+        journal = os.path.join(self._queue_directory, 'ready-0.idx')
+        with patch('mailman.core.switchboard.JOURNAL_COMPACT_SIZE', 1):
+            first = producer.enqueue(self._msg)
+            self.assertTrue(os.path.exists(journal))
+            self.assertEqual(consumer.files, [first])
+            self.assertFalse(os.path.exists(journal))
+            second = producer.enqueue(self._msg)
+            self.assertEqual(consumer.files, [first, second])
+
+    def test_partial_journal_line(self):
+        # An entry still being written is not consumed.
+        producer = self._switchboard()
+        consumer = self._switchboard(slice=0)
+        self.assertEqual(consumer.files, [])
+        filebase = producer.enqueue(self._msg)
+        journal = os.path.join(self._queue_directory, 'ready-0.idx')
+        with open(journal, 'ab') as fp:
+            fp.write(b'1234.5+abcd')
+        self.assertEqual(consumer.files, [filebase])
+        with open(journal, 'ab') as fp:
+            fp.write(b'\n')
+        # The completed entry has no queue file, so it is ignored.
+        self.assertEqual(consumer.files, [filebase])
+
+
+class TestRawFormat(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._queue_directory)
+        self._switchboard = Switchboard(
+            'test', self._queue_directory, file_format='raw')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+An attachment follows.
+--BOUNDARY
+Content-Type: text/plain
+
+Hello.
+--BOUNDARY--
+""")
+
+    def test_raw_file(self):
+        # The queue file holds the message's raw bytes, not a pickle.
+        filebase = self._switchboard.enqueue(self._msg, foo='yes')
+        path = os.path.join(self._queue_directory, filebase + '.pck')
+        with open(path, 'rb') as fp:
+            contents = fp.read()
+        self.assertTrue(contents.startswith(RAW_MAGIC))
+        self.assertIn(self._msg.as_bytes(), contents)
+
+    def test_metadata(self):
+        # The metadata is read without reading the message.
+        when = datetime(2016, 1, 2, 3, 4, 5)
+        filebase = self._switchboard.enqueue(self._msg, deliver_after=when)
+        with patch('mailman.core.switchboard.read_raw_queue_file') as read:
+            msgdata = self._switchboard.metadata(filebase)
+        self.assertEqual(msgdata['deliver_after'], when)
+        self.assertEqual(read.call_count, 0)
+        self.assertEqual(self._switchboard.files, [filebase])
+
+    def test_round_trip(self):
+        when = datetime(2016, 1, 2, 3, 4, 5)
+        filebase = self._switchboard.enqueue(
+            self._msg, listid='test.example.com', recipients={'bart@ex.com'},
+            deliver_until=when, delay=timedelta(hours=1),
+            action=Action.hold)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg.original_size, self._msg.original_size)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msg.get_payload(1).get_payload(), 'Hello.')
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+        self.assertEqual(msgdata['listid'], 'test.example.com')
+        self.assertEqual(msgdata['recipients'], {'bart@ex.com'})
+        self.assertEqual(msgdata['deliver_until'], when)
+        self.assertEqual(msgdata['delay'], timedelta(hours=1))
+        self.assertEqual(msgdata['action'], Action.hold)
+        self.assertFalse(msgdata['_parsemsg'])
+
+    def test_lazy_parsing(self):
+        # Moving a message to another queue never parses its body.
+        filebase = self._switchboard.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertNotIn('_headers', vars(msg))
+        msg['X-Retried'] = 'yes'
+        self.assertEqual(msg.sender, 'anne@example.com')
+        filebase = self._switchboard.enqueue(msg, msgdata)
+        self.assertNotIn('_payload', vars(msg))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msg['x-retried'], 'yes')
+        self.assertTrue(msg.is_multipart())
+        self.assertEqual(len(msg.get_payload()), 2)
+
+    def test_pickle_fallback(self):
+        # Metadata which can't be stored as JSON falls back to a pickle,
+        # while the message is still stored raw.
+        filebase = self._switchboard.enqueue(self._msg, thing=bytes(3))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['thing'], bytes(3))
+
+    def test_metadata_round_trip(self):
+        # Metadata which JSON would silently change is pickled instead.
+        metadata = dict(
+            pair=('a', 1),
+            numbers={1: 'one', 2: ('two', [2])},
+            nested=[{'__set__': [1]}],
+            frozen=frozenset(['x']),
+            )
+        for key, value in metadata.items():
+            filebase = self._switchboard.enqueue(self._msg, **{key: value})
+            self.assertEqual(self._switchboard.metadata(filebase)[key], value)
+            msg, msgdata = self._switchboard.dequeue(filebase)
+            self._switchboard.finish(filebase)
+            self.assertIsInstance(msg, LazyMessage)
+            self.assertEqual(msgdata[key], value)
+            self.assertEqual(type(msgdata[key]), type(value))
+
+    def test_recover_backup_files_pickled_metadata(self):
+        filebase = self._switchboard.enqueue(self._msg, pair=('a', 1))
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+        self.assertEqual(msgdata['pair'], ('a', 1))
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_read_pickles(self):
+        # Files written in the pickle format can still be dequeued.
+        pickles = Switchboard('test', self._queue_directory)
+        filebase = pickles.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertNotIsInstance(msg, LazyMessage)
+        self.assertEqual(msg['message-id'], '<ant>')
+
+    def test_plaintext(self):
+        filebase = self._switchboard.enqueue(self._msg, _plaintext=True)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['original_size'], len(str(self._msg)))
+
+    def test_recover_backup_files(self):
+        filebase = self._switchboard.enqueue(self._msg, foo='yes')
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+        self.assertEqual(msgdata['foo'], 'yes')
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_large_message_is_mapped(self):
+        # Large messages are memory mapped when they are dequeued, and stay
+        # in the raw format even when they move to a pickle queue.
+        body = 'A line of text.\n' * (MAP_SIZE // 16)
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""" + body)
+        filebase = self._switchboard.enqueue(msg, listid='ant')
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertTrue(msg.is_mapped)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msg.header_defects, [])
+        msg['X-Retried'] = 'yes'
+        # The metadata is still pickled in a pickle queue, so it comes back
+        # just the same.
+        msgdata['pair'] = ('a', 1)
+        pickles = Switchboard('test', self._queue_directory)
+        filebase = pickles.enqueue(msg, msgdata)
+        path = os.path.join(self._queue_directory, filebase + '.pck')
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(len(RAW_MAGIC)), RAW_MAGIC)
+        msg, msgdata = pickles.dequeue(filebase)
+        pickles.finish(filebase)
+        self.assertTrue(msg.is_mapped)
+        self.assertEqual(msg['x-retried'], 'yes')
+        self.assertEqual(msg.get_payload(), body)
+        self.assertEqual(msgdata['listid'], 'ant')
+        self.assertEqual(msgdata['pair'], ('a', 1))
+
+
+class TestGroupCommit(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def test_not_visible_before_commit(self):
+        switchboard = config.switchboards['shunt']
+        with GroupCommit() as group:
+            filebase = switchboard.enqueue(self._msg)
+            self.assertEqual(switchboard.files, [])
+            group.commit()
+            self.assertEqual(switchboard.files, [filebase])
+
+    def test_one_directory_sync(self):
+        # Each file in a group is synced, but each queue directory is only
+        # synced once, after all the files.
+        shunt = config.switchboards['shunt']
+        bad = config.switchboards['bad']
+        synced = []
+        fsync = os.fsync
+
+        def record_fsync(fd):
+            synced.append(S_ISDIR(os.fstat(fd).st_mode))
+            fsync(fd)
+
+        with patch('mailman.core.switchboard.os.fsync', record_fsync):
+            with GroupCommit() as group:
+                shunt.enqueue(self._msg)
+                shunt.enqueue(self._msg)
+                bad.enqueue(self._msg)
+                self.assertEqual(synced, [])
+                group.commit()
+        self.assertEqual(synced, [False, False, False, True, True])
+        self.assertEqual(len(shunt.files), 2)
+        self.assertEqual(len(bad.files), 1)
+
+    def test_other_threads(self):
+        # Files enqueued by other threads are not part of the group, so they
+        # are published right away, and survive the group being aborted.
+        switchboard = config.switchboards['shunt']
+        filebases = []
+
+        def enqueue():
+            filebases.append(switchboard.enqueue(self._msg))
+
+        with self.assertRaises(RuntimeError):
+            with GroupCommit():
+                thread = Thread(target=enqueue)
+                thread.start()
+                thread.join()
+                self.assertEqual(switchboard.files, filebases)
+                raise RuntimeError
+        self.assertEqual(len(filebases), 1)
+        self.assertEqual(switchboard.files, filebases)
+
+    def test_aborted(self):
+        # When the group is aborted by an exception, the files enqueued in it
+        # are removed.
+        switchboard = config.switchboards['shunt']
+        with self.assertRaises(RuntimeError):
+            with GroupCommit():
+                switchboard.enqueue(self._msg)
+                switchboard.enqueue(self._msg)
+                raise RuntimeError
+        self.assertEqual(os.listdir(switchboard.queue_directory), [])
+        # The next group is not affected.
+        with GroupCommit() as group:
+            filebase = switchboard.enqueue(self._msg)
+            group.commit()
+        self.assertEqual(switchboard.files, [filebase])
+
+    def test_uncommitted(self):
+        # Files which were never committed are not visible.
+        switchboard = config.switchboards['shunt']
+        with GroupCommit():
+            switchboard.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [])
+        # Outside the group commit, files are published immediately.
+        filebase = switchboard.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase])
+
+
+class TestClaim(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def _switchboard(self, slice=None, numslices=3, recover=False):
+        switchboard = Switchboard('test', self._queue_directory,
+                                  slice, numslices, recover, claim=True)
+        self.addCleanup(self._stop, switchboard)
+        return switchboard
+
+    def _stop(self, switchboard):
+        # Release the claim directory, as when the instance exits.
+        if switchboard._claim_lock is not None:
+            os.close(switchboard._claim_lock)
+            switchboard._claim_lock = None
+
+    def test_all_files(self):
+        # Claiming instances see the whole queue, whatever their number.
+        producer = self._switchboard()
+        consumers = [self._switchboard(slice=i) for i in range(3)]
+        filebases = [producer.enqueue(self._msg) for i in range(10)]
+        for consumer in consumers:
+            self.assertEqual(consumer.files, filebases)
+
+    def test_claim(self):
+        # Only one instance can dequeue an entry.
+        producer = self._switchboard()
+        first = self._switchboard(slice=0)
+        second = self._switchboard(slice=1)
+        filebase = producer.enqueue(self._msg)
+        msg, data = first.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        with self.assertRaises(AlreadyClaimedError) as cm:
+            second.dequeue(filebase)
+        self.assertEqual(cm.exception.filebase, filebase)
+        # The backup file lives in the claim directory of the first instance.
+        self.assertEqual(first.get_files('.bak'), [filebase])
+        self.assertEqual(second.get_files('.bak'), [])
+        self.assertEqual(producer.files, [])
+        first.finish(filebase)
+        self.assertEqual(first.get_files('.bak'), [])
+
+    def test_recover_own_claims(self):
+        # A restarted instance recovers its own claims.
+        producer = self._switchboard()
+        consumer = self._switchboard(slice=1)
+        filebase = producer.enqueue(self._msg)
+        consumer.dequeue(filebase)
+        self._stop(consumer)
+        self._switchboard(slice=1, recover=True)
+        self.assertEqual(producer.files, [filebase])
+
+    def test_adopt_orphaned_claims(self):
+        # The claims of an instance which isn't running, e.g. because there
+        # are fewer instances now, are recovered by another instance.
+        producer = self._switchboard()
+        retired = self._switchboard(slice=5, numslices=6)
+        running = self._switchboard(slice=1)
+        first = producer.enqueue(self._msg)
+        second = producer.enqueue(self._msg)
+        retired.dequeue(first)
+        running.dequeue(second)
+        # The retired instance is still running, so its claims stay put.
+        self._switchboard(slice=2, recover=True)
+        self.assertEqual(producer.files, [])
+        self._stop(retired)
+        self._switchboard(slice=0, recover=True)
+        # The running instance's claim stays put.
+        self.assertEqual(producer.files, [first])
+        self.assertEqual(running.get_files('.bak'), [second])
+
+    def test_no_index(self):
+        # Claiming runners don't use the ready index.
+        switchboard = Switchboard('test', self._queue_directory, 0, 3,
+                                  index=True, claim=True)
+        self.addCleanup(os.close, switchboard._claim_lock)
+        switchboard.enqueue(self._msg)
+        self.assertEqual(
+            [name for name in os.listdir(self._queue_directory)
+             if name.endswith('.idx')], [])
+
+    def test_backlog(self):
+        # The backlog is counted for each slice of the queue, or for the
+        # whole queue when it is shared by claiming.
+        sliced = Switchboard('test', self._queue_directory, numslices=4)
+        filebases = [sliced.enqueue(self._msg) for i in range(20)]
+        backlog = sliced.backlog()
+        self.assertEqual(sorted(backlog), [0, 1, 2, 3])
+        for slice_number in range(4):
+            slice_switchboard = Switchboard(
+                'test', self._queue_directory, slice_number, 4)
+            self.assertEqual(backlog[slice_number],
+                             len(slice_switchboard.files))
+        self.assertEqual(self._switchboard().backlog(), {0: 20})
+        sliced.dequeue(filebases[0])
+        self.assertEqual(sum(sliced.backlog().values()), 19)
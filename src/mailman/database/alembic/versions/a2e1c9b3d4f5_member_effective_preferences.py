@@ -0,0 +1,140 @@
+"""Member effective preferences
+
+Revision ID: a2e1c9b3d4f5
+Revises: 7b254d88f122
+Create Date: 2026-10-17 09:12:31.227184
+
+Materialize the preferences which members inherit from their address, user
+and member preferences in the member table.
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+from mailman.database.helpers import exists_in_db, is_sqlite
+from mailman.database.types import Enum
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+
+
+# Revision identifiers, used by Alembic.
+revision = 'a2e1c9b3d4f5'
+down_revision = '7b254d88f122'
+
+
+COLUMNS = (
+    ('acknowledge_posts', sa.Boolean),
+    ('delivery_mode', Enum(DeliveryMode)),
+    ('delivery_status', Enum(DeliveryStatus)),
+    ('preferred_language', sa.Unicode),
+    ('receive_list_copy', sa.Boolean),
+    ('receive_own_postings', sa.Boolean),
+    )
+NAMES = [name for name, column_type in COLUMNS]
+# The members are migrated this many at a time.
+CHUNK_SIZE = 500
+
+
+member_table = sa.sql.table(
+    'member',
+    sa.sql.column('id', sa.Integer),
+    sa.sql.column('address_id', sa.Integer),
+    sa.sql.column('user_id', sa.Integer),
+    sa.sql.column('preferences_id', sa.Integer),
+    *(sa.sql.column(name) for name in NAMES)
+    )
+
+
+address_table = sa.sql.table(
+    'address',
+    sa.sql.column('id', sa.Integer),
+    sa.sql.column('user_id', sa.Integer),
+    sa.sql.column('preferences_id', sa.Integer),
+    )
+
+
+user_table = sa.sql.table(
+    'user',
+    sa.sql.column('id', sa.Integer),
+    sa.sql.column('_preferred_address_id', sa.Integer),
+    sa.sql.column('preferences_id', sa.Integer),
+    )
+
+
+preferences_table = sa.sql.table(
+    'preferences',
+    sa.sql.column('id', sa.Integer),
+    *(sa.sql.column(name) for name in NAMES)
+    )
+
+
+def _effective_preferences():
+    # The member's preferences are inherited from the member, address and user
+    # preferences, in that order.  Members subscribed through their user get
+    # the user's preferred address.
+    member_user = user_table.alias()
+    address_user = user_table.alias()
+    address = address_table.alias()
+    preferences = [preferences_table.alias() for i in range(3)]
+    member_preferences, address_preferences, user_preferences = preferences
+    joined = member_table.outerjoin(
+        member_user, member_table.c.user_id == member_user.c.id
+        ).outerjoin(
+            address, address.c.id == sa.func.coalesce(
+                member_table.c.address_id,
+                member_user.c._preferred_address_id)
+        ).outerjoin(
+            address_user, address_user.c.id == address.c.user_id
+        ).outerjoin(
+            member_preferences,
+            member_preferences.c.id == member_table.c.preferences_id
+        ).outerjoin(
+            address_preferences,
+            address_preferences.c.id == address.c.preferences_id
+        ).outerjoin(
+            user_preferences,
+            user_preferences.c.id == address_user.c.preferences_id)
+    return sa.select(
+        [member_table.c.id.label('member_id')] + [
+            sa.func.coalesce(*(table.c[name] for table in preferences)
+                             ).label('new_' + name)
+            for name in NAMES
+            ]).select_from(joined)
+
+
+def upgrade():
+    for name, column_type in COLUMNS:
+        if not exists_in_db(op.get_bind(), 'member', name):
+            # SQLite may not have removed it when downgrading.
+            op.add_column('member', sa.Column(name, column_type))
+    op.create_index(op.f('ix_member_delivery_mode'),
+                    'member', ['delivery_mode'], unique=False)
+    op.create_index(op.f('ix_member_delivery_status'),
+                    'member', ['delivery_status'], unique=False)
+    # Now migrate the data, a chunk of members at a time, so that they never
+    # have to be held in memory all at once.
+    connection = op.get_bind()
+    update = member_table.update().where(
+        member_table.c.id == sa.bindparam('member_id')
+        ).values({
+            name: sa.bindparam('new_' + name) for name in NAMES
+            })
+    last_id = None
+    while True:
+        query = _effective_preferences().order_by(
+            member_table.c.id).limit(CHUNK_SIZE)
+        if last_id is not None:
+            query = query.where(member_table.c.id > last_id)
+        chunk = [dict(row) for row in connection.execute(query)]
+        if len(chunk) == 0:
+            break
+        connection.execute(update, chunk)
+        last_id = chunk[-1]['member_id']
+
+
+def downgrade():
+    op.drop_index(op.f('ix_member_delivery_status'), table_name='member')
+    op.drop_index(op.f('ix_member_delivery_mode'), table_name='member')
+    if not is_sqlite(op.get_bind()):
+        # SQLite does not support dropping columns.
+        for name in NAMES:
+            op.drop_column('member', name)
@@ -0,0 +1,33 @@
+"""Generation markers
+
+Revision ID: c9f4a6d2b1e8
+Revises: a2e1c9b3d4f5
+Create Date: 2026-10-17 11:02:45.317415
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# Revision identifiers, used by Alembic.
+revision = 'c9f4a6d2b1e8'
+down_revision = 'a2e1c9b3d4f5'
+
+
+def upgrade():
+    op.create_table(
+        'generation',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.Unicode(), nullable=True),
+        sa.Column('value', sa.Unicode(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index(
+        op.f('ix_generation_name'), 'generation', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_generation_name'), table_name='generation')
+    op.drop_table('generation')
@@ -0,0 +1,70 @@
+"""Message segments
+
+Revision ID: d6b3e8f1a2c7
+Revises: c9f4a6d2b1e8
+Create Date: 2026-10-17 13:26:08.540219
+
+Messages are packed into segment files, instead of being pickled into files
+of their own.  Messages which are already stored keep their files.
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+from mailman.database.helpers import exists_in_db, is_sqlite
+
+
+# Revision identifiers, used by Alembic.
+revision = 'd6b3e8f1a2c7'
+down_revision = 'c9f4a6d2b1e8'
+
+
+COLUMNS = (
+    ('segment', sa.Integer),
+    ('offset', sa.Integer),
+    ('length', sa.Integer),
+    ('body_id', sa.Integer),
+    )
+
+
+def upgrade():
+    op.create_table(
+        'message_body',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('body_hash', sa.Unicode(), nullable=True),
+        sa.Column('segment', sa.Integer(), nullable=True),
+        sa.Column('offset', sa.Integer(), nullable=True),
+        sa.Column('length', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index(op.f('ix_message_body_body_hash'),
+                    'message_body', ['body_hash'], unique=False)
+    op.create_index(op.f('ix_message_body_segment'),
+                    'message_body', ['segment'], unique=False)
+    for name, column_type in COLUMNS:
+        if not exists_in_db(op.get_bind(), 'message', name):
+            # SQLite may not have removed it when downgrading.
+            op.add_column('message', sa.Column(name, column_type))
+    op.create_index(op.f('ix_message_message_id'),
+                    'message', ['message_id'], unique=False)
+    op.create_index(op.f('ix_message_message_id_hash'),
+                    'message', ['message_id_hash'], unique=False)
+    op.create_index(op.f('ix_message_segment'),
+                    'message', ['segment'], unique=False)
+    op.create_index(op.f('ix_message_body_id'),
+                    'message', ['body_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_message_body_id'), table_name='message')
+    op.drop_index(op.f('ix_message_segment'), table_name='message')
+    op.drop_index(op.f('ix_message_message_id_hash'), table_name='message')
+    op.drop_index(op.f('ix_message_message_id'), table_name='message')
+    if not is_sqlite(op.get_bind()):
+        # SQLite does not support dropping columns.
+        for name, column_type in COLUMNS:
+            op.drop_column('message', name)
+    op.drop_index(op.f('ix_message_body_segment'), table_name='message_body')
+    op.drop_index(op.f('ix_message_body_body_hash'),
+                  table_name='message_body')
+    op.drop_table('message_body')
@@ -0,0 +1,145 @@
+"""Pended payloads
+
+Revision ID: e3a7c5d92f41
+Revises: d6b3e8f1a2c7
+Create Date: 2026-10-17 16:02:51.118362
+
+The key/value pairs of a pendable are stored as a single JSON object in the
+pended table, instead of one row each in the pendedkeyvalue table.  The type
+and the list-id of the pendable get columns of their own, since pendables are
+searched for by them.
+"""
+
+import json
+import sqlalchemy as sa
+
+from alembic import op
+from collections import OrderedDict
+from mailman.database.helpers import exists_in_db, is_sqlite
+
+
+# Revision identifiers, used by Alembic.
+revision = 'e3a7c5d92f41'
+down_revision = 'd6b3e8f1a2c7'
+
+
+COLUMNS = ('pend_type', 'list_id', 'payload')
+# The pended rows are migrated this many at a time.
+CHUNK_SIZE = 500
+
+
+pended_table = sa.sql.table(
+    'pended',
+    sa.sql.column('id', sa.Integer),
+    sa.sql.column('pend_type', sa.Unicode),
+    sa.sql.column('list_id', sa.Unicode),
+    sa.sql.column('payload', sa.Unicode),
+    )
+
+keyvalue_table = sa.sql.table(
+    'pendedkeyvalue',
+    sa.sql.column('id', sa.Integer),
+    sa.sql.column('key', sa.Unicode),
+    sa.sql.column('value', sa.Unicode),
+    sa.sql.column('pended_id', sa.Integer),
+    )
+
+
+def _pended_chunks(connection):
+    # Read the pended rows in id order, a chunk at a time, so that they never
+    # have to be held in memory all at once.
+    last_id = None
+    while True:
+        query = pended_table.select().order_by(
+            pended_table.c.id).limit(CHUNK_SIZE)
+        if last_id is not None:
+            query = query.where(pended_table.c.id > last_id)
+        chunk = connection.execute(query).fetchall()
+        if len(chunk) == 0:
+            return
+        yield chunk
+        last_id = chunk[-1]['id']
+
+
+def upgrade():
+    for name in COLUMNS:
+        if not exists_in_db(op.get_bind(), 'pended', name):
+            # SQLite may not have removed it when downgrading.
+            op.add_column('pended', sa.Column(name, sa.Unicode))
+    # Data migration.  The pendables are migrated a chunk at a time, along
+    # with their key/value pairs.
+    connection = op.get_bind()
+    update = pended_table.update().where(
+        pended_table.c.id == sa.bindparam('pended_id')
+        ).values({
+            name: sa.bindparam('new_' + name) for name in COLUMNS
+            })
+    for chunk in _pended_chunks(connection):
+        pendables = OrderedDict((pended['id'], {}) for pended in chunk)
+        # Select the key/value pairs by the ids of the chunk, rather than by
+        # their range, since SQLite doesn't enforce the foreign key, so there
+        # may be pairs left over from deleted pendables.
+        for keyvalue in connection.execute(keyvalue_table.select().where(
+                keyvalue_table.c.pended_id.in_(list(pendables))
+                ).order_by(keyvalue_table.c.pended_id, keyvalue_table.c.id)):
+            pendable = pendables[keyvalue['pended_id']]
+            if keyvalue['key'] == 'type':
+                # The type is not JSONified.
+                pendable[keyvalue['key']] = keyvalue['value']
+            else:
+                pendable[keyvalue['key']] = json.loads(keyvalue['value'])
+        rows = []
+        for pended_id, pendable in pendables.items():
+            pend_type = pendable.pop('type', None)
+            list_id = pendable.get('list_id')
+            rows.append(dict(
+                pended_id=pended_id,
+                new_pend_type=pend_type,
+                new_list_id=(list_id if isinstance(list_id, str) else None),
+                new_payload=json.dumps(pendable)))
+        connection.execute(update, rows)
+    op.drop_table('pendedkeyvalue')
+    op.create_index(op.f('ix_pended_pend_type'),
+                    'pended', ['pend_type'], unique=False)
+    op.create_index(op.f('ix_pended_list_id'),
+                    'pended', ['list_id'], unique=False)
+
+
+def downgrade():
+    op.create_table(
+        'pendedkeyvalue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.Unicode(), nullable=True),
+        sa.Column('value', sa.Unicode(), nullable=True),
+        sa.Column('pended_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['pended_id'], ['pended.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index(op.f('ix_pendedkeyvalue_key'),
+                    'pendedkeyvalue', ['key'], unique=False)
+    op.create_index(op.f('ix_pendedkeyvalue_value'),
+                    'pendedkeyvalue', ['value'], unique=False)
+    op.create_index(op.f('ix_pendedkeyvalue_pended_id'),
+                    'pendedkeyvalue', ['pended_id'], unique=False)
+    # Data migration.
+    connection = op.get_bind()
+    for chunk in _pended_chunks(connection):
+        keyvalues = []
+        for pended in chunk:
+            if pended['pend_type'] is not None:
+                keyvalues.append(dict(
+                    pended_id=pended['id'], key='type',
+                    value=pended['pend_type']))
+            payload = json.loads(pended['payload'] or '{}')
+            for key, value in payload.items():
+                keyvalues.append(dict(
+                    pended_id=pended['id'], key=key,
+                    value=json.dumps(value)))
+        if len(keyvalues) > 0:
+            connection.execute(keyvalue_table.insert(), keyvalues)
+    op.drop_index(op.f('ix_pended_list_id'), table_name='pended')
+    op.drop_index(op.f('ix_pended_pend_type'), table_name='pended')
+    if not is_sqlite(op.get_bind()):
+        # SQLite does not support dropping columns.
+        for name in COLUMNS:
+            op.drop_column('pended', name)
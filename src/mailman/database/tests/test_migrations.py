@@ -30,7 +30,7 @@ from mailman.database.model import Model
 from mailman.database.transaction import transaction
 from mailman.database.types import Enum
 from mailman.interfaces.action import Action
-from mailman.interfaces.member import MemberRole
+from mailman.interfaces.member import DeliveryMode, MemberRole
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.layers import ConfigLayer
 from zope.component import getUtility
@@ -241,11 +241,13 @@ class TestMigrations(unittest.TestCase):
             sa.sql.column('moderation_action', Enum(Action)),
             )
         user_manager = getUtility(IUserManager)
+        # Create a mailing list through the standard API, which needs the
+        # current schema.
+        with transaction():
+            ant = create_list('ant@example.com')
         with transaction():
             # Start at the previous revision.
             alembic.command.downgrade(alembic_cfg, 'd4fbb4fd34ca')
-            # Create a mailing list through the standard API.
-            ant = create_list('ant@example.com')
             # Create some members.
             anne = user_manager.create_address('anne@example.com')
             bart = user_manager.create_address('bart@example.com')
@@ -296,3 +298,235 @@ class TestMigrations(unittest.TestCase):
             (cris.id, Action.defer),
             (dana.id, Action.hold),
             ])
+
+    def test_a2e1c9b3d4f5_member_effective_preferences(self):
+        member_table = sa.sql.table(
+            'member',
+            sa.sql.column('id', sa.Integer),
+            sa.sql.column('list_id', sa.Unicode),
+            sa.sql.column('address_id', sa.Integer),
+            sa.sql.column('role', Enum(MemberRole)),
+            )
+        effective_table = sa.sql.table(
+            'member',
+            sa.sql.column('address_id', sa.Integer),
+            sa.sql.column('delivery_mode', Enum(DeliveryMode)),
+            sa.sql.column('receive_list_copy', sa.Boolean),
+            sa.sql.column('preferred_language', sa.Unicode),
+            )
+        user_manager = getUtility(IUserManager)
+        with transaction():
+            ant = create_list('ant@example.com')
+        with transaction():
+            # Start at the previous revision.
+            alembic.command.downgrade(alembic_cfg, '7b254d88f122')
+            anne = user_manager.create_address('anne@example.com')
+            anne.preferences.delivery_mode = DeliveryMode.mime_digests
+            bart = user_manager.create_address('bart@example.com')
+            user = user_manager.create_user()
+            user.link(bart)
+            user.preferences.receive_list_copy = False
+            user.preferences.preferred_language = 'fr'
+            config.db.store.flush()
+            config.db.store.execute(member_table.insert().values([
+                {'address_id': anne.id, 'role': MemberRole.member,
+                 'list_id': ant.list_id},
+                {'address_id': bart.id, 'role': MemberRole.member,
+                 'list_id': ant.list_id},
+                ]))
+        alembic.command.upgrade(alembic_cfg, 'a2e1c9b3d4f5')
+        members = config.db.store.execute(sa.select([
+            effective_table.c.address_id,
+            effective_table.c.delivery_mode,
+            effective_table.c.receive_list_copy,
+            effective_table.c.preferred_language,
+            ]).order_by(effective_table.c.address_id)).fetchall()
+        self.assertEqual(members, [
+            (anne.id, DeliveryMode.mime_digests, None, None),
+            (bart.id, None, False, 'fr'),
+            ])
+
+    def test_a2e1c9b3d4f5_member_effective_preferences_chunks(self):
+        # The members are migrated in chunks.
+        member_table = sa.sql.table(
+            'member',
+            sa.sql.column('id', sa.Integer),
+            sa.sql.column('list_id', sa.Unicode),
+            sa.sql.column('address_id', sa.Integer),
+            sa.sql.column('role', Enum(MemberRole)),
+            )
+        effective_table = sa.sql.table(
+            'member',
+            sa.sql.column('delivery_mode', Enum(DeliveryMode)),
+            )
+        user_manager = getUtility(IUserManager)
+        with transaction():
+            ant = create_list('ant@example.com')
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, '7b254d88f122')
+            anne = user_manager.create_address('anne@example.com')
+            anne.preferences.delivery_mode = DeliveryMode.mime_digests
+            config.db.store.flush()
+            config.db.store.execute(member_table.insert(), [
+                {'id': i, 'address_id': anne.id, 'role': MemberRole.member,
+                 'list_id': ant.list_id}
+                for i in range(1, 1202)])
+        alembic.command.upgrade(alembic_cfg, 'a2e1c9b3d4f5')
+        modes = config.db.store.execute(
+            sa.select([effective_table.c.delivery_mode])).fetchall()
+        self.assertEqual(len(modes), 1201)
+        self.assertEqual(
+            set(mode for (mode,) in modes), {DeliveryMode.mime_digests})
+
+    def test_d6b3e8f1a2c7_message_segments(self):
+        with transaction():
+            # Start at the previous revision.
+            alembic.command.downgrade(alembic_cfg, 'c9f4a6d2b1e8')
+            self.assertFalse(exists_in_db(
+                config.db.engine, 'message_body'))
+        with transaction():
+            alembic.command.upgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            self.assertTrue(exists_in_db(
+                config.db.engine, 'message_body'))
+            for column in ('segment', 'offset', 'length', 'body_id'):
+                self.assertTrue(exists_in_db(
+                    config.db.engine, 'message', column))
+
+    def test_e3a7c5d92f41_pended_payloads(self):
+        pended_table = sa.sql.table(
+            'pended',
+            sa.sql.column('id', sa.Integer),
+            sa.sql.column('token', sa.Unicode),
+            )
+        keyvalue_table = sa.sql.table(
+            'pendedkeyvalue',
+            sa.sql.column('key', sa.Unicode),
+            sa.sql.column('value', sa.Unicode),
+            sa.sql.column('pended_id', sa.Integer),
+            )
+        # Start at the previous revision.
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            self.assertTrue(exists_in_db(config.db.engine, 'pendedkeyvalue'))
+            config.db.store.execute(pended_table.insert().values([
+                {'id': 1, 'token': 'one'},
+                {'id': 2, 'token': 'two'},
+                ]))
+            config.db.store.execute(keyvalue_table.insert().values([
+                {'pended_id': 1, 'key': 'type', 'value': 'subscription'},
+                {'pended_id': 1, 'key': 'list_id',
+                 'value': '"ant.example.com"'},
+                {'pended_id': 1, 'key': 'count', 'value': '3'},
+                {'pended_id': 2, 'key': 'type', 'value': 'data'},
+                {'pended_id': 2, 'key': 'message',
+                 'value': '{"__encoding__": "utf-8", "value": "x"}'},
+                ]))
+        # Upgrading.
+        with transaction():
+            alembic.command.upgrade(alembic_cfg, 'e3a7c5d92f41')
+            self.assertFalse(exists_in_db(config.db.engine, 'pendedkeyvalue'))
+            results = config.db.store.execute(
+                'SELECT token, pend_type, list_id, payload FROM pended '
+                'ORDER BY id').fetchall()
+        self.assertEqual(results, [
+            ('one', 'subscription', 'ant.example.com',
+             '{"list_id": "ant.example.com", "count": 3}'),
+            ('two', 'data', None,
+             '{"message": {"__encoding__": "utf-8", "value": "x"}}'),
+            ])
+        # Downgrading.
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            results = config.db.store.execute(
+                'SELECT pended_id, key, value FROM pendedkeyvalue '
+                'ORDER BY id').fetchall()
+        self.assertEqual(results, [
+            (1, 'type', 'subscription'),
+            (1, 'list_id', '"ant.example.com"'),
+            (1, 'count', '3'),
+            (2, 'type', 'data'),
+            (2, 'message', '{"__encoding__": "utf-8", "value": "x"}'),
+            ])
+
+    def test_e3a7c5d92f41_pended_payloads_orphans(self):
+        # Key/value pairs whose pendable was deleted are dropped.
+        pended_table = sa.sql.table(
+            'pended',
+            sa.sql.column('id', sa.Integer),
+            sa.sql.column('token', sa.Unicode),
+            )
+        keyvalue_table = sa.sql.table(
+            'pendedkeyvalue',
+            sa.sql.column('key', sa.Unicode),
+            sa.sql.column('value', sa.Unicode),
+            sa.sql.column('pended_id', sa.Integer),
+            )
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            config.db.store.execute(pended_table.insert().values([
+                {'id': 1, 'token': 'one'},
+                {'id': 3, 'token': 'three'},
+                ]))
+            config.db.store.execute(keyvalue_table.insert().values([
+                {'pended_id': 1, 'key': 'type', 'value': 'data'},
+                {'pended_id': 2, 'key': 'type', 'value': 'orphan'},
+                {'pended_id': 2, 'key': 'n', 'value': '2'},
+                {'pended_id': 3, 'key': 'type', 'value': 'data'},
+                {'pended_id': 3, 'key': 'n', 'value': '3'},
+                ]))
+        with transaction():
+            alembic.command.upgrade(alembic_cfg, 'e3a7c5d92f41')
+            results = config.db.store.execute(
+                'SELECT id, pend_type, payload FROM pended '
+                'ORDER BY id').fetchall()
+        self.assertEqual(results, [
+            (1, 'data', '{}'),
+            (3, 'data', '{"n": 3}'),
+            ])
+
+    def test_e3a7c5d92f41_pended_payloads_chunks(self):
+        # The pendables are migrated in chunks, which don't all have the same
+        # number of key/value pairs.
+        pended_table = sa.sql.table(
+            'pended',
+            sa.sql.column('id', sa.Integer),
+            sa.sql.column('token', sa.Unicode),
+            )
+        keyvalue_table = sa.sql.table(
+            'pendedkeyvalue',
+            sa.sql.column('key', sa.Unicode),
+            sa.sql.column('value', sa.Unicode),
+            sa.sql.column('pended_id', sa.Integer),
+            )
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            config.db.store.execute(pended_table.insert(), [
+                {'id': i, 'token': str(i)} for i in range(1, 1202)])
+            keyvalues = []
+            for i in range(1, 1202):
+                # Every third pendable has no key/value pairs at all.
+                if i % 3 != 0:
+                    keyvalues.append(
+                        {'pended_id': i, 'key': 'type', 'value': 'data'})
+                    keyvalues.append(
+                        {'pended_id': i, 'key': 'n', 'value': str(i)})
+            config.db.store.execute(keyvalue_table.insert(), keyvalues)
+        with transaction():
+            alembic.command.upgrade(alembic_cfg, 'e3a7c5d92f41')
+            results = config.db.store.execute(
+                'SELECT id, token, pend_type, payload FROM pended '
+                'ORDER BY id').fetchall()
+        self.assertEqual(len(results), 1201)
+        for pended_id, token, pend_type, payload in results:
+            self.assertEqual(token, str(pended_id))
+            if pended_id % 3 == 0:
+                self.assertIsNone(pend_type)
+                self.assertEqual(payload, '{}')
+            else:
+                self.assertEqual(pend_type, 'data')
+                self.assertEqual(payload, '{{"n": {}}}'.format(pended_id))
+        with transaction():
+            alembic.command.downgrade(alembic_cfg, 'd6b3e8f1a2c7')
+            count = config.db.store.execute(
+                'SELECT COUNT(*) FROM pendedkeyvalue').scalar()
+        self.assertEqual(count, len(keyvalues))
@@ -23,8 +23,10 @@ safe pickle deserialization, even if the email package adds additional Message
 attributes.
 """
 
+import mmap
 import email
 import email.message
+import email.parser
 import email.utils
 
 from email.header import Header
@@ -35,6 +37,13 @@ from mailman.config import config
 
 COMMASPACE = ', '
 
+# The instance attributes making up the state of an email.message.Message,
+# split into those which only need the message's headers to be parsed, and
+# those which need its body.
+_HEADER_STATE = frozenset(('policy', '_headers', '_unixfrom', '_default_type'))
+_BODY_STATE = frozenset(
+    ('_payload', '_charset', 'preamble', 'epilogue', 'defects'))
+
 
 @public
 class Message(email.message.Message):
@@ -106,6 +115,119 @@ class Message(email.message.Message):
         return clean_senders
 
 
+@public
+class LazyMessage(Message):
+    """A message which is parsed from its raw bytes when it is first used.
+
+    The headers are parsed the first time they are accessed, and the body the
+    first time the payload is.  Until then, flattening the message to bytes
+    reuses the raw body instead of regenerating it from the MIME tree.
+
+    The raw bytes can also be a read-only memory map of a file, in which case
+    the body is only paged in when it is actually used.
+    """
+
+    # All the instance attributes which are not extra message data.
+    state_attributes = _HEADER_STATE | _BODY_STATE | {
+        '_raw', '_body_offset', '_header_defects'}
+
+    def __init__(self, raw):
+        # Don't call the base class constructor.  The state it would set up
+        # is parsed from the raw bytes when it is needed.
+        self._raw = raw
+
+    def __getattr__(self, name):
+        # This is only called for attributes which haven't been set yet.
+        if '_raw' not in self.__dict__:
+            raise AttributeError(name)
+        if name in _HEADER_STATE:
+            self._parse_headers()
+        elif name in _BODY_STATE:
+            self._parse_body()
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def __getstate__(self):
+        # A memory map can't be pickled, but its contents can.
+        state = self.__dict__.copy()
+        if '_raw' in state:
+            state['_raw'] = bytes(state['_raw'])
+        return state
+
+    def _parse_headers(self):
+        # Only the header block is handed to the parser, up to and including
+        # the first empty line.
+        raw = self._raw
+        ends = [raw.find(separator) for separator in (b'\n\n', b'\n\r\n')]
+        ends = [end for end in ends if end >= 0]
+        size = (len(raw) if len(ends) == 0
+                else min(ends) + (2 if raw[min(ends) + 1] == 10 else 3))
+        parser = email.parser.BytesParser(Message)
+        parsed = parser.parsebytes(raw[:size], headersonly=True)
+        for name in _HEADER_STATE:
+            self.__dict__.setdefault(name, getattr(parsed, name))
+        self._header_defects = parsed.defects
+        # In a headers-only parse, the payload is the unparsed start of the
+        # body, if the header block ended early.
+        body = parsed.get_payload().encode('ascii', 'surrogateescape')
+        self._body_offset = size - len(body)
+
+    def _parse_body(self):
+        parsed = email.message_from_bytes(bytes(self._raw), Message)
+        # Don't clobber anything which has already been parsed, and possibly
+        # changed since.
+        for name in _HEADER_STATE | _BODY_STATE:
+            self.__dict__.setdefault(name, getattr(parsed, name))
+        # The raw bytes are no longer needed.
+        del self._raw
+        self.__dict__.pop('_body_offset', None)
+
+    @property
+    def is_mapped(self):
+        """Whether the unparsed message is a memory map of a file."""
+        return isinstance(self.__dict__.get('_raw'), mmap.mmap)
+
+    @property
+    def header_defects(self):
+        """The defects found in the headers, without parsing the body."""
+        if '_raw' not in self.__dict__:
+            return self.defects
+        if '_header_defects' not in self.__dict__:
+            self._parse_headers()
+        return self._header_defects
+
+    def as_bytes(self, unixfrom=False, policy=None):
+        """See `email.message.Message`."""
+        if ('_raw' not in self.__dict__ or '_payload' in self.__dict__
+                or policy is not None):
+            return super().as_bytes(unixfrom, policy)
+        return b''.join(self.as_chunks(unixfrom))
+
+    def as_chunks(self, unixfrom=False):
+        """Flatten the message to a list of bytes-like objects.
+
+        While the body hasn't been parsed, only the headers, which may have
+        been changed, are generated.  The raw body is returned as a
+        memoryview, so it isn't copied.
+
+        :param unixfrom: Whether to include the Unix From_ line.
+        :type unixfrom: bool
+        :return: The pieces which, concatenated, make up the message.
+        :rtype: list
+        """
+        if '_raw' not in self.__dict__ or '_payload' in self.__dict__:
+            return [self.as_bytes(unixfrom)]
+        lines = []
+        if unixfrom and self._unixfrom is not None:
+            lines.append(self._unixfrom.encode('ascii', 'surrogateescape'))
+            lines.append(b'\n')
+        for name, value in self._headers:
+            lines.append(self.policy.fold_binary(name, value))
+        lines.append(b'\n')
+        return [b''.join(lines), memoryview(self._raw)[self._body_offset:]]
+
+
 @public
 class MultipartDigestMessage(MIMEMultipart, Message):
     """Mix-in class for MIME digest messages."""
@@ -47,13 +47,59 @@ def process(mlist, msg, msgdata):
     if member is not None:
         # Calculate the extra personalization dictionary.
         recipient = msgdata.get('recipient', member.address.original_email)
-        d['user_address'] = recipient
-        d['user_delivered_to'] = member.address.original_email
-        d['user_language'] = member.preferred_language.description
-        d['user_name'] = (member.user.display_name
-                          if member.user.display_name
-                          else member.address.original_email)
-        d['user_optionsurl'] = member.options_url
+        d.update(member_substitutions(member, recipient))
+    d.update(archiver_substitutions(mlist, msg))
+    # These strings are descriptive for the log file and shouldn't be i18n'd
+    d.update(msgdata.get('decoration-data', {}))
+    try:
+        header = decorate(mlist, mlist.header_uri, d)
+    except URLError:
+        header = None
+        log.exception('Header decorator URI not found ({0}): {1}'.format(
+            mlist.fqdn_listname, mlist.header_uri))
+    try:
+        footer = decorate(mlist, mlist.footer_uri, d)
+    except URLError:
+        footer = None
+        log.exception('Footer decorator URI not found ({0}): {1}'.format(
+            mlist.fqdn_listname, mlist.footer_uri))
+    decorate_message(mlist, msg, header, footer)
+
+
+@public
+def member_substitutions(member, recipient):
+    """Return the $user_* placeholders for a member.
+
+    :param member: The member receiving the message.
+    :type member: `IMember`
+    :param recipient: The address the message is delivered to.
+    :type recipient: str
+    :return: The placeholder values.
+    :rtype: dict
+    """
+    d = {}
+    d['user_address'] = recipient
+    d['user_delivered_to'] = member.address.original_email
+    d['user_language'] = member.preferred_language.description
+    d['user_name'] = (member.user.display_name
+                      if member.user.display_name
+                      else member.address.original_email)
+    d['user_optionsurl'] = member.options_url
+    return d
+
+
+@public
+def archiver_substitutions(mlist, msg):
+    """Return the $<archive-name>_url placeholders for a message.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :param msg: The message being decorated.
+    :type msg: `Message`
+    :return: The placeholder values.
+    :rtype: dict
+    """
+    d = {}
     # Calculate the archiver permalink substitution variables.  This provides
     # the $<archive-name>_url placeholder for every enabled archiver.
     for archiver in IListArchiverSet(mlist).archivers:
@@ -69,23 +115,28 @@ def process(mlist, msg, msgdata):
             if archive_url is not None:
                 placeholder = '{}_url'.format(archiver.system_archiver.name)
                 d[placeholder] = archive_url
-    # These strings are descriptive for the log file and shouldn't be i18n'd
-    d.update(msgdata.get('decoration-data', {}))
-    try:
-        header = decorate(mlist, mlist.header_uri, d)
-    except URLError:
-        header = None
-        log.exception('Header decorator URI not found ({0}): {1}'.format(
-            mlist.fqdn_listname, mlist.header_uri))
-    try:
-        footer = decorate(mlist, mlist.footer_uri, d)
-    except URLError:
-        footer = None
-        log.exception('Footer decorator URI not found ({0}): {1}'.format(
-            mlist.fqdn_listname, mlist.footer_uri))
+    return d
+
+
+@public
+def decorate_message(mlist, msg, header, footer):
+    """Add the expanded header and footer to the message.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :param msg: The message to decorate in place.
+    :type msg: `Message`
+    :param header: The expanded header, or None.
+    :type header: str
+    :param footer: The expanded footer, or None.
+    :type footer: str
+    :return: True if the header and footer were added to the text of a
+        text/plain message, False if they were added as separate parts, and
+        None if the message was left alone.
+    """
     # Escape hatch if both the footer and header are empty or None.
     if not header and not footer:
-        return
+        return None
     # Be MIME smart here.  We only attach the header and footer by
     # concatenation when the message is a non-multipart of type text/plain.
     # Otherwise, if it is not a multipart, we make it a multipart, and then we
@@ -166,7 +217,7 @@ def process(mlist, msg, msgdata):
     # at least do it by MIME encapsulation.  We want to keep as much of the
     # outer chrome as possible.
     if not wrap:
-        return
+        return msg.get_content_type() == 'text/plain'
     # Because of the way Message objects are passed around to process(), we
     # need to play tricks with the outer message -- i.e. the outer one must
     # remain the same instance.  So we're going to create a clone of the outer
@@ -207,11 +258,18 @@ def process(mlist, msg, msgdata):
     del msg['content-transfer-encoding']
     del msg['content-disposition']
     msg['Content-Type'] = 'multipart/mixed'
+    return False
 
 
 @public
 def decorate(mlist, uri, extradict=None):
     """Expand the decoration template from its URI."""
+    return decorate_template(mlist, load_decoration(mlist, uri), extradict)
+
+
+@public
+def load_decoration(mlist, uri):
+    """Return the unexpanded decoration template from its URI."""
     if uri is None:
         return ''
     # Get the decorator template.
@@ -221,8 +279,7 @@ def decorate(mlist, uri, extradict=None):
         list_id=mlist.list_id,
         listname=mlist.fqdn_listname,
         ))
-    template = loader.get(template_uri)
-    return decorate_template(mlist, template, extradict)
+    return loader.get(template_uri)
 
 
 @public
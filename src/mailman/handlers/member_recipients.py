@@ -80,9 +80,9 @@ for delivery.  The original message as received by Mailman is attached.
 """)
                 raise RejectMessage(wrap(text))
         # Calculate the regular recipients of the message
-        recipients = set(member.address.email
-                         for member in mlist.regular_members.members
-                         if member.delivery_status == DeliveryStatus.enabled)
+        recipients = set(entry.email
+                         for entry in mlist.regular_members.entries
+                         if entry.delivery_status == DeliveryStatus.enabled)
         # Remove the sender if they don't want to receive their own posts
         if not include_sender and member.address.email in recipients:
             recipients.remove(member.address.email)
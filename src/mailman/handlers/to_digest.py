@@ -20,7 +20,7 @@
 import os
 
 from mailman import public
-from mailman.app.digests import maybe_send_digest_now
+from mailman.app.digests import DigestJournal, maybe_send_digest_now
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
 from mailman.utilities.mailbox import Mailbox
@@ -43,7 +43,13 @@ class ToDigest:
             return
         # Open the mailbox that will be used to collect the current digest.
         mailbox_path = os.path.join(mlist.data_path, 'digest.mmdf')
-        # Lock the mailbox and append the message.
+        # Lock the mailbox and append the message.  While the mailbox is
+        # still locked, journal the parts of the digests the message makes
+        # up, so the digest runner doesn't have to render them all at once.
         with Mailbox(mailbox_path, create=True) as mbox:
+            start = os.path.getsize(mailbox_path)
             mbox.add(msg)
+            mbox.flush()
+            end = os.path.getsize(mailbox_path)
+            DigestJournal(mailbox_path).append(mlist, msg, start, end)
         maybe_send_digest_now(mlist)
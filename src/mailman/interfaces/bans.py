@@ -21,6 +21,25 @@ from mailman import public
 from zope.interface import Attribute, Interface
 
 
+@public
+class BanChangeEvent:
+    """Base class for ban events."""
+
+    def __init__(self, email, list_id):
+        self.email = email
+        self.list_id = list_id
+
+
+@public
+class BanEvent(BanChangeEvent):
+    """An email address or pattern was banned."""
+
+
+@public
+class UnbanEvent(BanChangeEvent):
+    """An email address or pattern ban was lifted."""
+
+
 @public
 class IBan(Interface):
     """A specific ban.
@@ -93,6 +112,18 @@ class IBanManager(Interface):
         :rtype: bool
         """
 
+    def is_banned_many(emails):
+        """Check which of several email addresses are banned.
+
+        This is equivalent to calling `is_banned()` for each email address,
+        but the bans are only looked up once.
+
+        :param emails: The text email addresses being checked.
+        :type emails: iterable of str
+        :return: The given email addresses which are banned.
+        :rtype: set of str
+        """
+
     def __iter__():
         """Iterate over all banned addresses.
 
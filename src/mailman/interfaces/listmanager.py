@@ -139,6 +139,18 @@ class IListManager(Interface):
         """An iterator over the list ids of all mailing lists managed by this
         list manager.""")
 
+    periodic_digest_list_ids = Attribute(
+        """An iterator over the list ids of all mailing lists which send their
+        digests periodically, i.e. whose `digest_send_periodic` is set.""")
+
     name_components = Attribute(
         """An iterator over the 2-tuple of (list_name, mail_host) for all
         mailing lists managed by this list manager.""")
+
+    generation = Attribute(
+        """A value which changes whenever a mailing list is created or
+        deleted.
+
+        Processes which cache information about all the mailing lists can
+        check this to find out whether their cache is still current.
+        """)
@@ -87,6 +87,24 @@ class UnsubscriptionEvent(MembershipChangeEvent):
         return '{0} left {1}'.format(self.member.address, self.mlist.list_id)
 
 
+@public
+class MassUnsubscriptionEvent:
+    """Event which gets triggered when a batch of members leave a list.
+
+    This is triggered instead of an `UnsubscriptionEvent` for every member.
+    Like that event, it gets triggered just before the members are
+    unsubscribed.
+    """
+
+    def __init__(self, mlist, members):
+        self.mlist = mlist
+        self.members = members
+
+    def __str__(self):
+        return '{0} members left {1}'.format(
+            len(self.members), self.mlist.list_id)
+
+
 @public
 class MembershipError(MailmanError):
     """Base exception for all membership errors."""
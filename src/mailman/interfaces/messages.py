@@ -103,4 +103,9 @@ class IMessage(Interface):
 
     message_id_hash = Attribute("""The unique SHA1 hash of the message.""")
 
-    path = Attribute("""The filesystem path to the message object.""")
+    path = Attribute(
+        """The filesystem path to the message object.
+
+        This is only set for messages stored by older versions.  Messages are
+        now packed into segment files, and this is None.
+        """)
@@ -60,15 +60,6 @@ class IPended(Interface):
     expiration_date = Attribute("""The expiration date of the pended event.""")
 
 
-@public
-class IPendedKeyValue(Interface):
-    """A pended key/value pair."""
-
-    key = Attribute("""The pended key.""")
-
-    value = Attribute("""The pended value.""")
-
-
 @public
 class IPendings(Interface):
     """Interface to pending database."""
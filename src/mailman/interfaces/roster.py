@@ -17,10 +17,17 @@
 
 """Interface for a roster of members."""
 
+from collections import namedtuple
 from mailman import public
 from zope.interface import Attribute, Interface
 
 
+public(RosterEntry=namedtuple(
+    'RosterEntry',
+    'email original_email delivery_mode delivery_status '
+    'receive_own_postings receive_list_copy'))
+
+
 @public
 class IRoster(Interface):
     """A roster is a collection of `IMembers`."""
@@ -49,6 +56,18 @@ class IRoster(Interface):
         managed by this roster.
         """)
 
+    entries = Attribute(
+        """An iterator over a summary of each member managed by this roster.
+
+        Each `RosterEntry` holds the member's subscribed email address and
+        its original case-preserved form, along with the member's effective
+        delivery_mode, delivery_status, receive_own_postings and
+        receive_list_copy preferences, i.e. the same values as the
+        corresponding `IMember` attributes.  All of this is retrieved from
+        the database at once, so this is much cheaper than going through the
+        `members` when only these values are needed.
+        """)
+
     def get_member(email):
         """Get the member for the given address.
 
@@ -72,3 +91,16 @@ class IRoster(Interface):
         :return: All the memberships associated with this email address.
         :rtype: sequence of length 0, 1, or 2 of ``IMember``
         """
+
+    def get_members(emails):
+        """Get the members for many addresses at once.
+
+        This is like calling ``get_member()`` for each address, but the
+        members are looked up with only a few queries.
+
+        :param emails: The email addresses to search for.
+        :type emails: iterable of strings
+        :return: A mapping from each email address found to its member.
+            Addresses which are not subscribed are missing from the mapping.
+        :rtype: dict
+        """
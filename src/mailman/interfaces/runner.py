@@ -75,6 +75,17 @@ class IRunner(Interface):
         :rtype: int
         """
 
+    def _get_files():
+        """Return the queue files to process in one iteration.
+
+        Can be overridden by subclasses, e.g. to leave some of the files in
+        the queue for later.  By default, these are all the files of the
+        runner's switchboard.
+
+        :return: The base names of the queue files, in FIFO order.
+        :rtype: list of strings
+        """
+
     def _process_one_file(msg, msgdata):
         """Process one queue file.
 
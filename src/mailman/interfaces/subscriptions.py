@@ -21,7 +21,8 @@ from collections import namedtuple
 from enum import Enum
 from mailman import public
 from mailman.interfaces.errors import MailmanError
-from mailman.interfaces.member import DeliveryMode, MembershipError
+from mailman.interfaces.member import (
+    DeliveryMode, MemberRole, MembershipError)
 from zope.interface import Interface
 
 
@@ -90,8 +91,9 @@ class ISubscriptionService(Interface):
         a digest member), the member can appear multiple times in this list.
         Roles are sorted by: owner, moderator, member.
 
-        :return: The list of all members.
-        :rtype: list of `IMember`
+        :return: The sequence of all members.  Slicing it only loads the
+            members in the slice from the database.
+        :rtype: sequence of `IMember`
         """
 
     def get_member(member_id):
@@ -163,9 +165,38 @@ class ISubscriptionService(Interface):
             mailing list.
         """
 
+    def subscribe_members(list_id, records, role=MemberRole.member):
+        """Subscribe a batch of addresses to a mailing list right now.
+
+        This is like `add_member()` for each of the subscription request
+        records, but the existing addresses, users and memberships are looked
+        up for many records at once, and the new rows are inserted in
+        batches.  The subscriptions are not subject to the mailing list's
+        subscription policy.
+
+        :param list_id: The list id to operate on.
+        :type list_id: string
+        :param records: The subscription request records.  This may be any
+            iterable, which is only consumed as the results are read.
+        :type records: iterable of `RequestRecord`
+        :param role: The membership role for these subscriptions.
+        :type role: `MemberRole`
+        :return: An iterator over the outcome of every record, in order.  The
+            outcomes are produced one batch of records at a time, so this can
+            be used to report progress.  Each outcome is a 2-tuple of the
+            record, and the new member or the `MembershipIsBannedError`,
+            `InvalidEmailAddressError` or `AlreadySubscribedError` which
+            prevented the subscription.
+        :rtype: iterator of 2-tuples
+        :raises NoSuchListError: if the named mailing list does not exist.
+        """
+
     def unsubscribe_members(list_id, emails):
         """Unsubscribe a batch of members from a mailing list.
 
+        A single `MassUnsubscriptionEvent` is triggered for all the members
+        being unsubscribed, instead of an `UnsubscriptionEvent` for each.
+
         :param list_id: The list id to operate on.
         :type list_id: string
         :param emails: A list of email addresses of the members getting
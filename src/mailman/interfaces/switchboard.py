@@ -18,9 +18,22 @@
 """Interface for switchboards."""
 
 from mailman import public
+from mailman.interfaces.errors import MailmanError
 from zope.interface import Attribute, Interface
 
 
+@public
+class AlreadyClaimedError(MailmanError):
+    """Another runner instance has already claimed the queue entry."""
+
+    def __init__(self, filebase):
+        super().__init__()
+        self.filebase = filebase
+
+    def __str__(self):
+        return self.filebase
+
+
 @public
 class ISwitchboard(Interface):
     """The switchboard."""
@@ -54,6 +67,19 @@ class ISwitchboard(Interface):
         be removed by calling the .finish() method.
 
         Returned is a 2-tuple of the form (message, metadata).
+
+        :raises AlreadyClaimedError: if the runner instances share the queue
+            by claiming its entries, and another instance got this one first.
+        """
+
+    def metadata(filebase):
+        """Return the metadata contained in the named file.
+
+        Unlike .dequeue(), this leaves the file in the queue untouched.  The
+        message is not returned, and where possible it isn't even read.
+
+        :raises FileNotFoundError: if the file is no longer in the queue,
+            e.g. because it has been dequeued meanwhile.
         """
 
     def finish(filebase, preserve=False):
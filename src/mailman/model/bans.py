@@ -22,8 +22,12 @@ import re
 from mailman import public
 from mailman.database.model import Model
 from mailman.database.transaction import dbconnection
-from mailman.interfaces.bans import IBan, IBanManager
+from mailman.interfaces.bans import (
+    BanChangeEvent, BanEvent, IBan, IBanManager, UnbanEvent)
+from mailman.model.generation import Generation
+from mailman.utilities.patterns import compile_patterns
 from sqlalchemy import Column, Integer, Unicode
+from zope.event import notify
 from zope.interface import implementer
 
 
@@ -44,6 +48,65 @@ class Ban(Model):
         self.list_id = list_id
 
 
+class BanIndex:
+    """The bans of a single mailing list, or the global bans."""
+
+    def __init__(self, emails):
+        self._emails = set(emails)
+        self._patterns = compile_patterns(
+            (email for email in self._emails if email.startswith('^')),
+            re.IGNORECASE)
+
+    def __contains__(self, email):
+        if email in self._emails:
+            return True
+        return any(pattern.match(email) is not None
+                   for pattern in self._patterns)
+
+
+class BanCache:
+    """The ban indexes of this process, keyed by list-id.
+
+    The global bans are keyed by None.
+    """
+
+    def __init__(self):
+        self._generation = None
+        self._indexes = {}
+
+    def clear(self):
+        self._generation = None
+        self._indexes.clear()
+
+    def get(self, store, *list_ids):
+        """Return the indexes of the given list-ids."""
+        # Bans can also be added or removed by other processes, or go away
+        # when a transaction is aborted, so check that the bans haven't
+        # changed since the indexes were built.
+        generation = Generation.get(store, 'bans')
+        if generation != self._generation:
+            self._indexes.clear()
+            self._generation = generation
+        indexes = []
+        for list_id in list_ids:
+            index = self._indexes.get(list_id)
+            if index is None:
+                emails = store.query(Ban.email).filter_by(list_id=list_id)
+                index = self._indexes[list_id] = BanIndex(
+                    email for (email,) in emails)
+            indexes.append(index)
+        return indexes
+
+
+_cache = BanCache()
+
+
+@public
+def handle_BanChangeEvent(event):
+    if isinstance(event, BanChangeEvent):
+        _cache.clear()
+
+
 @public
 @implementer(IBanManager)
 class BanManager:
@@ -60,6 +123,8 @@ class BanManager:
         if bans.count() == 0:
             ban = Ban(email, self._list_id)
             store.add(ban)
+            Generation.bump(store, 'bans')
+            notify(BanEvent(email, self._list_id))
 
     @dbconnection
     def unban(self, store, email):
@@ -68,45 +133,25 @@ class BanManager:
             email=email, list_id=self._list_id).first()
         if ban is not None:
             store.delete(ban)
+            Generation.bump(store, 'bans')
+            notify(UnbanEvent(email, self._list_id))
 
     @dbconnection
-    def is_banned(self, store, email):
+    def _indexes(self, store):
+        # The mailing list's bans are checked first, then the global ones.
+        if self._list_id is None:
+            return _cache.get(store, None)
+        return _cache.get(store, self._list_id, None)
+
+    def is_banned(self, email):
+        """See `IBanManager`."""
+        return any(email in index for index in self._indexes())
+
+    def is_banned_many(self, emails):
         """See `IBanManager`."""
-        list_id = self._list_id
-        if list_id is None:
-            # The client is asking for global bans.  Look up bans on the
-            # specific email address first.
-            bans = store.query(Ban).filter_by(email=email, list_id=None)
-            if bans.count() > 0:
-                return True
-            # And now look for global pattern bans.
-            bans = store.query(Ban).filter_by(list_id=None)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                        re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-        else:
-            # This is a list-specific ban.
-            bans = store.query(Ban).filter_by(email=email, list_id=list_id)
-            if bans.count() > 0:
-                return True
-            # Try global bans next.
-            bans = store.query(Ban).filter_by(email=email, list_id=None)
-            if bans.count() > 0:
-                return True
-            # Now try specific mailing list bans, but with a pattern.
-            bans = store.query(Ban).filter_by(list_id=list_id)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                        re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-            # And now try global pattern bans.
-            bans = store.query(Ban).filter_by(list_id=None)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                        re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-        return False
+        indexes = self._indexes()
+        return set(email for email in emails
+                   if any(email in index for index in indexes))
 
     @dbconnection
     def __iter__(self, store):
@@ -0,0 +1,64 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generation markers."""
+
+from mailman import public
+from mailman.database.model import Model
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.exc import IntegrityError
+from uuid import uuid4
+
+
+@public
+class Generation(Model):
+    """A marker which changes every time a set of objects changes.
+
+    Processes which cache those objects compare the marker with the value
+    they last saw to find out whether their cache is still current.  The
+    values are random, so that they never repeat, even if the database is
+    restored from a backup.
+    """
+
+    __tablename__ = 'generation'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode, index=True, unique=True)
+    value = Column(Unicode, nullable=False)
+
+    @staticmethod
+    def get(store, name):
+        """Return the current value of the named marker, or None."""
+        return store.query(Generation.value).filter_by(name=name).scalar()
+
+    @staticmethod
+    def bump(store, name):
+        """Change the named marker, in the current transaction."""
+        value = uuid4().hex
+        query = store.query(Generation).filter_by(name=name)
+        updated = query.update(
+            {Generation.value: value}, synchronize_session=False)
+        if updated > 0:
+            return
+        # The marker doesn't exist yet.  Another process may be adding it at
+        # the same time, so add it in a savepoint, and if the other process
+        # got there first, update its row instead.
+        try:
+            with store.begin_nested():
+                store.add(Generation(name=name, value=value))
+        except IntegrityError:
+            query.update({Generation.value: value}, synchronize_session=False)
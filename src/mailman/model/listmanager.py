@@ -25,6 +25,7 @@ from mailman.interfaces.listmanager import (
     ListDeletedEvent, ListDeletingEvent)
 from mailman.model.autorespond import AutoResponseRecord
 from mailman.model.bans import Ban
+from mailman.model.generation import Generation
 from mailman.model.mailinglist import (
     IAcceptableAliasSet, ListArchiver, MailingList)
 from mailman.model.mime import ContentFilter
@@ -53,6 +54,7 @@ class ListManager:
         mlist = MailingList(fqdn_listname)
         mlist.created_at = now()
         store.add(mlist)
+        Generation.bump(store, 'lists')
         notify(ListCreatedEvent(mlist))
         return mlist
 
@@ -78,8 +80,10 @@ class ListManager:
         store.query(AutoResponseRecord).filter_by(mailing_list=mlist).delete()
         store.query(ContentFilter).filter_by(mailing_list=mlist).delete()
         store.query(ListArchiver).filter_by(mailing_list=mlist).delete()
-        store.query(Ban).filter_by(list_id=mlist.list_id).delete()
+        if store.query(Ban).filter_by(list_id=mlist.list_id).delete() > 0:
+            Generation.bump(store, 'bans')
         store.delete(mlist)
+        Generation.bump(store, 'lists')
         notify(ListDeletedEvent(fqdn_listname))
 
     @property
@@ -113,6 +117,15 @@ class ListManager:
             assert isinstance(list_id, tuple) and len(list_id) == 1
             yield list_id[0]
 
+    @property
+    @dbconnection
+    def periodic_digest_list_ids(self, store):
+        """See `IListManager`."""
+        result_set = store.query(MailingList).filter_by(
+            digest_send_periodic=True)
+        for list_id in result_set.values(MailingList._list_id):
+            yield list_id[0]
+
     @property
     @dbconnection
     def name_components(self, store):
@@ -121,3 +134,9 @@ class ListManager:
         for mail_host, list_name in result_set.values(MailingList.mail_host,
                                                       MailingList.list_name):
             yield list_name, mail_host
+
+    @property
+    @dbconnection
+    def generation(self, store):
+        """See `IListManager`."""
+        return Generation.get(store, 'lists')
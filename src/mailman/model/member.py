@@ -17,6 +17,7 @@
 
 """Model for members."""
 
+from itertools import chain
 from mailman import public
 from mailman.core.constants import system_preferences
 from mailman.database.model import Model
@@ -24,20 +25,42 @@ from mailman.database.transaction import dbconnection
 from mailman.database.types import Enum, UUID
 from mailman.interfaces.action import Action
 from mailman.interfaces.address import IAddress
+from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.member import (
-    IMember, MemberRole, MembershipError, UnsubscriptionEvent)
+    DeliveryMode, DeliveryStatus, IMember, MemberRole, MembershipError,
+    UnsubscriptionEvent)
 from mailman.interfaces.user import IUser, UnverifiedAddressError
 from mailman.interfaces.usermanager import IUserManager
+from mailman.model.address import Address
+from mailman.model.preferences import Preferences
 from mailman.utilities.uid import UIDFactory
-from sqlalchemy import Column, ForeignKey, Integer, Unicode
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Boolean, Column, ForeignKey, Integer, Unicode, bindparam, func, inspect,
+    or_)
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session, aliased, object_session, relationship
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from zope.component import getUtility
 from zope.event import notify
 from zope.interface import implementer
 
 
 uid_factory = UIDFactory(context='members')
+# The preferences which members inherit from their address, their user and
+# the system, and which are materialized in the member table.
+EFFECTIVE_PREFERENCES = (
+    'acknowledge_posts',
+    'delivery_mode',
+    'delivery_status',
+    'preferred_language',
+    'receive_list_copy',
+    'receive_own_postings',
+    )
+# The maximum number of ids to look up in a single query.  SQLite limits the
+# number of parameters in a statement.
+QUERY_BATCH_SIZE = 500
 
 
 @public
@@ -60,6 +83,19 @@ class Member(Model):
     user_id = Column(Integer, ForeignKey('user.id'), index=True)
     _user = relationship('User')
 
+    # The member's preferences, as inherited from the address, user and
+    # member preferences, or NULL when the system preference applies.  These
+    # are brought up to date whenever changes to any of those are flushed, see
+    # `_update_effective_preferences()`.  Before that, the preferences are
+    # looked up the slow way.
+    _acknowledge_posts = Column('acknowledge_posts', Boolean)
+    _delivery_mode = Column('delivery_mode', Enum(DeliveryMode), index=True)
+    _delivery_status = Column(
+        'delivery_status', Enum(DeliveryStatus), index=True)
+    _preferred_language = Column('preferred_language', Unicode)
+    _receive_list_copy = Column('receive_list_copy', Boolean)
+    _receive_own_postings = Column('receive_own_postings', Boolean)
+
     def __init__(self, role, list_id, subscriber):
         self._member_id = uid_factory.new()
         self.role = role
@@ -131,21 +167,86 @@ class Member(Model):
     def subscriber(self):
         return (self._user if self._address is None else self._address)
 
+    @classmethod
+    def __declare_last__(cls):
+        # SQLAlchemy special directive hook called after mappings are assumed
+        # to be complete.  Use this to keep the effective preferences up to
+        # date on every flush.
+        listen(Session, 'after_flush', _update_effective_preferences)
+
+    def _has_unflushed_changes(self):
+        # The effective preferences are only brought up to date when changes
+        # are flushed.  Until then, a pending change to this member, its
+        # address or user, or any of their preferences makes them stale.
+        # Only objects which are already in the session can have such
+        # changes, so walk the inheritance chain through the identity map
+        # without loading anything.
+        # Avoid circular imports.
+        from mailman.model.user import User
+        session = object_session(self)
+        if session is None or _is_unflushed(self):
+            return True
+        keys = [
+            (Preferences, self.preferences_id),
+            (Address, self.address_id),
+            (User, self.user_id),
+            ]
+        seen = set()
+        while len(keys) > 0:
+            model, object_id = key = keys.pop()
+            if object_id is None or key in seen:
+                continue
+            seen.add(key)
+            instance = session.identity_map.get(identity_key(model, object_id))
+            if instance is None:
+                if model is Preferences:
+                    continue
+                # The rest of the chain is not known without loading this
+                # object, so look for any pending change it could inherit.
+                return _has_unflushed_objects(session)
+            if _is_unflushed(instance):
+                return True
+            if model is Preferences:
+                continue
+            state = inspect(instance)
+            if len(state.expired_attributes) > 0:
+                return _has_unflushed_objects(session)
+            keys.append((Preferences, instance.preferences_id))
+            if model is Address:
+                keys.append((User, instance.user_id))
+            elif self.address_id is None:
+                # Members subscribed through their user get the user's
+                # preferred address.
+                keys.append((Address, instance._preferred_address_id))
+        return False
+
     def _lookup(self, preference, default=None):
-        pref = getattr(self.preferences, preference)
-        if pref is not None:
-            return pref
-        pref = getattr(self.address.preferences, preference)
-        if pref is not None:
-            return pref
-        if self.address.user:
-            pref = getattr(self.address.user.preferences, preference)
+        if self._has_unflushed_changes():
+            # Walk the preferences the member inherits from, reading the raw
+            # columns as the materialized preferences do.
+            attribute = ('_preferred_language'
+                         if preference == 'preferred_language'
+                         else preference)
+            for preferences in self._inherited_preferences():
+                pref = getattr(preferences, attribute)
+                if pref is not None:
+                    return pref
+        else:
+            pref = getattr(self, '_' + preference)
             if pref is not None:
                 return pref
         if default is None:
             return getattr(system_preferences, preference)
         return default
 
+    def _inherited_preferences(self):
+        yield self.preferences
+        address = self.address
+        if address is not None:
+            yield address.preferences
+            if address.user is not None:
+                yield address.user.preferences
+
     @property
     def acknowledge_posts(self):
         """See `IMember`."""
@@ -158,7 +259,7 @@ class Member(Model):
         language = self._lookup('preferred_language', missing)
         return (self.mailing_list.preferred_language
                 if language is missing
-                else language)
+                else getUtility(ILanguageManager)[language])
 
     @property
     def receive_list_copy(self):
@@ -193,3 +294,165 @@ class Member(Model):
         notify(UnsubscriptionEvent(self.mailing_list, self))
         store.delete(self.preferences)
         store.delete(self)
+
+
+@public
+class EffectivePreferences:
+    """Join members to the rows their preferences are inherited from.
+
+    A member's preference is looked up in the member's own preferences, then
+    in the preferences of its subscribed address, then in the preferences of
+    the address's user, and finally in the system preferences.  This does the
+    same in SQL, for all the members of a query at once.
+    """
+
+    def __init__(self):
+        # Avoid circular imports.
+        from mailman.model.user import User
+        self.member_user = aliased(User)
+        self.address_user = aliased(User)
+        self.address = aliased(Address)
+        self.preferences = [aliased(Preferences) for i in range(3)]
+
+    def join_address(self, query):
+        """Join a query of members to their subscribed address.
+
+        :param query: A query of `Member` objects.
+        :return: The joined query.
+        """
+        # Members subscribed through their user get the user's preferred
+        # address.
+        return query.outerjoin(
+            self.member_user, Member.user_id == self.member_user.id
+            ).outerjoin(
+                self.address,
+                self.address.id == func.coalesce(
+                    Member.address_id,
+                    self.member_user._preferred_address_id))
+
+    def join(self, query):
+        """Join a query of members to their address, user and preferences.
+
+        :param query: A query of `Member` objects.
+        :return: The joined query.
+        """
+        member_preferences, address_preferences, user_preferences = (
+            self.preferences)
+        return self.join_address(query).outerjoin(
+            self.address_user,
+            self.address_user.id == self.address.user_id
+            ).outerjoin(
+                member_preferences,
+                member_preferences.id == Member.preferences_id
+            ).outerjoin(
+                address_preferences,
+                address_preferences.id == self.address.preferences_id
+            ).outerjoin(
+                user_preferences,
+                user_preferences.id == self.address_user.preferences_id)
+
+    def __getitem__(self, name):
+        """The SQL expression of a member's inherited preference.
+
+        This is NULL when the system preference applies.
+        """
+        attribute = ('_preferred_language'
+                     if name == 'preferred_language'
+                     else name)
+        return func.coalesce(*(
+            getattr(preferences, attribute)
+            for preferences in self.preferences))
+
+
+@public
+def effective_preference_in(name, values):
+    """The SQL condition for a member's effective preference.
+
+    :param name: The name of the preference.
+    :type name: str
+    :param values: The values of the preference to look for.
+    :return: The condition on the member table.
+    """
+    column = getattr(Member, '_' + name)
+    condition = column.in_(values)
+    if getattr(system_preferences, name) in values:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+
+def _is_unflushed(instance):
+    # Whether the instance is new, or has changes which are not flushed yet.
+    state = inspect(instance)
+    return state.pending or state.transient or state.modified
+
+
+def _has_unflushed_objects(session):
+    # Whether any member, address, user or preferences in the session has
+    # changes which are not flushed yet.
+    # Avoid circular imports.
+    from mailman.model.user import User
+    return any(
+        isinstance(instance, (Member, Address, User, Preferences))
+        for instance in chain(session.new, session.dirty))
+
+
+def _update_effective_preferences(session, flush_context):
+    # Recalculate the effective preferences of the members affected by the
+    # objects which have just been flushed.  The session still shows them as
+    # new, dirty or deleted.
+    # Avoid circular imports.
+    from mailman.model.user import User
+    ids = {Member: set(), Preferences: set(), Address: set(), User: set()}
+    # New members are not in the identity map yet.
+    members = {}
+    for instance in chain(session.new, session.dirty, session.deleted):
+        model = type(instance)
+        if model in ids:
+            ids[model].add(instance.id)
+        if model is Member:
+            members[instance.id] = instance
+    if not any(ids.values()):
+        return
+    effective = EffectivePreferences()
+    affected = [
+        (Member.id, ids[Member]),
+        (effective.address.id, ids[Address]),
+        (effective.member_user.id, ids[User]),
+        (effective.address_user.id, ids[User]),
+        ]
+    affected.extend(
+        (preferences.id, ids[Preferences])
+        for preferences in effective.preferences)
+    query = effective.join(session.query(Member.id)).add_columns(
+        *(effective[name] for name in EFFECTIVE_PREFERENCES))
+    values = {}
+    for column, column_ids in affected:
+        column_ids = list(column_ids)
+        for start in range(0, len(column_ids), QUERY_BATCH_SIZE):
+            batch = column_ids[start:start + QUERY_BATCH_SIZE]
+            for row in query.filter(column.in_(batch)):
+                values[row[0]] = row[1:]
+    if len(values) == 0:
+        return
+    table = Member.__table__
+    session.execute(
+        table.update().where(
+            table.c.id == bindparam('member_id')
+            ).values({
+                name: bindparam('new_' + name, type_=table.c[name].type)
+                for name in EFFECTIVE_PREFERENCES
+                }),
+        [dict(member_id=member_id,
+              **{'new_' + name: value
+                 for name, value in zip(EFFECTIVE_PREFERENCES, row)})
+         for member_id, row in values.items()])
+    # Members which are already loaded get the new values too.
+    for member_id, row in values.items():
+        member = members.get(member_id)
+        if member is None:
+            member = session.identity_map.get(
+                identity_key(Member, member_id))
+        if member is None:
+            continue
+        for name, value in zip(EFFECTIVE_PREFERENCES, row):
+            set_committed_value(member, '_' + name, value)
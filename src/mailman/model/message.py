@@ -34,14 +34,39 @@ class Message(Model):
 
     id = Column(Integer, primary_key=True)
     # This is a Messge-ID field representation, not a database row id.
-    message_id = Column(Unicode)
-    message_id_hash = Column(Unicode)
+    message_id = Column(Unicode, index=True)
+    message_id_hash = Column(Unicode, index=True)
+    # Messages stored by older versions are pickled in a file of their own.
     path = Column(Unicode)
+    # Where the compressed headers of the message are in the segment files.
+    segment = Column(Integer, index=True)
+    offset = Column(Integer)
+    length = Column(Integer)
+    body_id = Column(Integer, index=True)
 
     @dbconnection
-    def __init__(self, store, message_id, message_id_hash, path):
+    def __init__(self, store, message_id, message_id_hash, path=None):
         super().__init__()
         self.message_id = message_id
         self.message_id_hash = message_id_hash
         self.path = path
         store.add(self)
+
+
+@public
+class MessageBody(Model):
+    """A compressed message body, which messages can share."""
+
+    __tablename__ = 'message_body'
+
+    id = Column(Integer, primary_key=True)
+    body_hash = Column(Unicode, index=True)
+    segment = Column(Integer, index=True)
+    offset = Column(Integer)
+    length = Column(Integer)
+
+    @dbconnection
+    def __init__(self, store, body_hash):
+        super().__init__()
+        self.body_hash = body_hash
+        store.add(self)
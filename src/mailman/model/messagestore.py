@@ -15,26 +15,256 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Model for message stores."""
+"""Model for message stores.
+
+Messages are packed into append-only segment files.  The headers of each
+message and its body are compressed separately, and messages with the same
+body which are written to the same segment share a single copy of it.  The
+same body may still be stored once in each segment.  The database records
+where in which segment each part is, so reading a message takes a single
+indexed query and usually a single read.
+
+Every process appends to a segment of its own, which it keeps locked.  The
+messages added in a transaction are written to it all at once, when the
+transaction is committed.  Once the segment has grown past `SEGMENT_SIZE`,
+the process moves on to a new one.  A segment which isn't locked by any
+process, and which isn't used by any stored message, is removed when the last
+of its messages is deleted.
+
+Messages stored by older versions are pickled in files of their own.  They
+can still be read and deleted.
+"""
 
 import os
-import errno
+import zlib
+import fcntl
 import pickle
+import hashlib
+import threading
 
+from collections import OrderedDict
 from mailman import public
 from mailman.config import config
 from mailman.database.transaction import dbconnection
+from mailman.email.message import LazyMessage
 from mailman.interfaces.messages import IMessageStore
-from mailman.model.message import Message
+from mailman.model.message import Message, MessageBody
 from mailman.utilities.email import add_message_hash
 from mailman.utilities.filesystem import makedirs, safe_remove
+from sqlalchemy import or_
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session
 from zope.interface import implementer
 
 
-# It could be very bad if you have already stored files and you change this
-# value.  We'd need a script to reshuffle and resplit.
-MAX_SPLITS = 2
-EMPTYSTRING = ''
+# A process starts a new segment once the one it appends to is this large.
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def _segment_directory():
+    return os.path.join(config.MESSAGES_DIR, 'segments')
+
+
+def _segment_path(number):
+    return os.path.join(_segment_directory(), '{:08d}.seg'.format(number))
+
+
+def _lock(path):
+    # Open and lock a segment, unless another process has it locked.  Return
+    # the file descriptor, or None.
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_APPEND)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The segment may have been removed while we were waiting for it.
+        if os.stat(path).st_ino == os.fstat(fd).st_ino:
+            return fd
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    os.close(fd)
+    return None
+
+
+def _read(number, offset, length):
+    with open(_segment_path(number), 'rb') as fp:
+        fp.seek(offset)
+        return fp.read(length)
+
+
+class SegmentWriter:
+    """The segment this process appends messages to."""
+
+    def __init__(self):
+        self.number = None
+        self._fd = None
+        self._size = 0
+        # Segments this process stopped appending to stay locked until the
+        # end of the transaction, since its messages may still use them.
+        self._retired = []
+        self._lock = threading.Lock()
+
+    def _is_current(self):
+        # The segment may have been removed from under us.
+        if self._fd is None:
+            return False
+        try:
+            current = os.stat(_segment_path(self.number))
+        except FileNotFoundError:
+            return False
+        return current.st_ino == os.fstat(self._fd).st_ino
+
+    def _open(self):
+        makedirs(_segment_directory())
+        numbers = sorted(
+            (int(name[:-4]) for name in os.listdir(_segment_directory())
+             if name.endswith('.seg')),
+            reverse=True)
+        # Take over a segment with some room left, which no other process
+        # owns, e.g. because the process which did has exited.
+        for number in numbers:
+            fd = _lock(_segment_path(number))
+            if fd is None:
+                continue
+            size = os.fstat(fd).st_size
+            if size < SEGMENT_SIZE:
+                return number, fd, size
+            os.close(fd)
+        number = (numbers[0] if len(numbers) > 0 else 0) + 1
+        while True:
+            path = _segment_path(number)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL, 0o660))
+            except FileExistsError:
+                pass
+            else:
+                fd = _lock(path)
+                if fd is not None:
+                    return number, fd, 0
+            number += 1
+
+    def write(self, records):
+        """Append records to the segment, and sync it.
+
+        :param records: The records to write.
+        :type records: list of bytes
+        :return: The segment number and the offset of the first record.
+        :rtype: tuple
+        """
+        data = memoryview(b''.join(records))
+        with self._lock:
+            if not self._is_current() or self._size >= SEGMENT_SIZE:
+                if self._fd is not None:
+                    self._retired.append(self._fd)
+                self.number, self._fd, self._size = self._open()
+            number, offset = self.number, self._size
+            while len(data) > 0:
+                data = data[os.write(self._fd, data):]
+            os.fsync(self._fd)
+            self._size = os.fstat(self._fd).st_size
+        return number, offset
+
+    def release(self):
+        """Unlock the segments this process no longer appends to."""
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for fd in retired:
+            os.close(fd)
+
+
+_writer = SegmentWriter()
+
+
+def _pack(message):
+    # Return the compressed headers of the message, and its body.  A message
+    # which can't be flattened is pickled whole instead, and has no body.
+    try:
+        text = message.as_bytes(unixfrom=(message.get_unixfrom() is not None))
+    except (TypeError, UnicodeError):
+        return zlib.compress(pickle.dumps(message, -1)), None
+    # Besides its headers and payload, a message object can carry extra
+    # attributes, e.g. original_size, which must be stored too.
+    attributes = {
+        name: value for name, value in vars(message).items()
+        if name not in LazyMessage.state_attributes
+        }
+    # A stored message always has headers, so they end with an empty line.
+    end = text.find(b'\n\n') + 2
+    headers = pickle.dumps((attributes, text[:end]), -1)
+    return zlib.compress(headers), text[end:]
+
+
+def _unpack(record, body_record):
+    data = zlib.decompress(record)
+    if body_record is None:
+        return pickle.loads(data)
+    attributes, headers = pickle.loads(data)
+    message = LazyMessage(headers + zlib.decompress(body_record))
+    for name, value in attributes.items():
+        setattr(message, name, value)
+    return message
+
+
+def _reclaim(session, numbers):
+    # Return the segments, locked, which can be removed once the transaction
+    # is committed.  A segment which is locked is still being appended to.
+    reclaimed = []
+    for number in numbers:
+        path = _segment_path(number)
+        fd = _lock(path)
+        if fd is None:
+            continue
+        bodies = session.query(MessageBody.id).filter(
+            MessageBody.segment == number)
+        in_use = session.query(Message.id).filter(or_(
+            Message.segment == number,
+            Message.body_id.in_(bodies.subquery()))).first()
+        if in_use is None:
+            session.query(MessageBody).filter(
+                MessageBody.segment == number).delete(
+                    synchronize_session=False)
+            reclaimed.append((path, fd))
+        else:
+            os.close(fd)
+    return reclaimed
+
+
+def _before_commit(session):
+    # Write the messages added in this transaction, before the database rows
+    # pointing at them are committed.
+    records = session.info.pop('message_records', None)
+    session.info.pop('message_bodies', None)
+    if records:
+        number, offset = _writer.write(list(records.values()))
+        for row, record in records.items():
+            row.segment = number
+            row.offset = offset
+            row.length = len(record)
+            offset += len(record)
+    numbers = session.info.pop('message_segments', None)
+    if numbers:
+        session.info['message_reclaimed'] = _reclaim(session, numbers)
+
+
+def _after_commit(session):
+    for path, fd in session.info.pop('message_reclaimed', []):
+        safe_remove(path)
+        os.close(fd)
+    _writer.release()
+
+
+def _after_rollback(session):
+    for key in ('message_records', 'message_bodies', 'message_segments'):
+        session.info.pop(key, None)
+    for path, fd in session.info.pop('message_reclaimed', []):
+        os.close(fd)
+    _writer.release()
+
+
+listen(Session, 'before_commit', _before_commit)
+listen(Session, 'after_commit', _after_commit)
+listen(Session, 'after_rollback', _after_rollback)
 
 
 @public
@@ -53,75 +283,106 @@ class MessageStore:
         if isinstance(message_id, bytes):
             message_id = message_id.decode('ascii')
         # If the Message-ID already exists in the store, don't store it again.
-        existing = store.query(Message).filter(
+        existing = store.query(Message.id).filter(
             Message.message_id == message_id).first()
         if existing is not None:
             return None
         hash32 = add_message_hash(message)
-        # Calculate the path on disk where we're going to store this message
-        # object, in pickled format.
-        parts = []
-        split = list(hash32)
-        while split and len(parts) < MAX_SPLITS:
-            parts.append(split.pop(0) + split.pop(0))
-        parts.append(hash32)
-        relpath = os.path.join(*parts)
-        # Store the message in the database.  This relies on the database
-        # providing a unique serial number, but to get this information, we
-        # have to use a straight insert instead of relying on Elixir to create
-        # the object.
-        Message(message_id=message_id,
-                message_id_hash=hash32,
-                path=relpath)
-        # Now calculate the full file system path.
-        path = os.path.join(config.MESSAGES_DIR, relpath)
-        # Write the file to the path, but catch the appropriate exception in
-        # case the parent directories don't yet exist.  In that case, create
-        # them and try again.
-        while True:
-            try:
-                with open(path, 'wb') as fp:
-                    # -1 says to use the highest protocol available.
-                    pickle.dump(message, fp, -1)
-                    break
-            except IOError as error:
-                if error.errno != errno.ENOENT:
-                    raise
-            makedirs(os.path.dirname(path))
+        # The message is only written to its segment when the transaction is
+        # committed.  Until then, it is kept with the transaction.
+        row = Message(message_id=message_id, message_id_hash=hash32)
+        record, body = _pack(message)
+        records = store.info.setdefault('message_records', OrderedDict())
+        records[row] = record
+        if body is not None:
+            row.body_id = self._add_body(store, body).id
         return hash32
 
-    def _get_message(self, row):
-        path = os.path.join(config.MESSAGES_DIR, row.path)
-        with open(path, 'rb') as fp:
-            return pickle.load(fp)
+    def _add_body(self, store, body):
+        body_hash = hashlib.sha1(body).hexdigest()
+        bodies = store.info.setdefault('message_bodies', {})
+        row = bodies.get(body_hash)
+        if row is None and _writer.number is not None:
+            # Only the bodies in this process's own segment can be shared,
+            # since any other segment could be removed at any time.
+            row = store.query(MessageBody).filter_by(
+                body_hash=body_hash, segment=_writer.number).first()
+        if row is None:
+            row = MessageBody(body_hash)
+            store.info['message_records'][row] = zlib.compress(body)
+            bodies[body_hash] = row
+            # Get the row's id.
+            store.flush()
+        return row
+
+    def _get_message(self, store, row, body):
+        if row.path is not None:
+            path = os.path.join(config.MESSAGES_DIR, row.path)
+            with open(path, 'rb') as fp:
+                return pickle.load(fp)
+        pending = store.info.get('message_records', {})
+        if (body is not None and row not in pending and body not in pending
+                and body.segment == row.segment
+                and body.offset == row.offset + row.length):
+            # The body was written right after the headers.
+            data = _read(row.segment, row.offset, row.length + body.length)
+            return _unpack(data[:row.length], data[row.length:])
+        records = []
+        for part in (row, body):
+            if part is None:
+                records.append(None)
+            elif part in pending:
+                records.append(pending[part])
+            else:
+                records.append(_read(part.segment, part.offset, part.length))
+        return _unpack(*records)
+
+    def _query(self, store):
+        return store.query(Message, MessageBody).outerjoin(
+            MessageBody, Message.body_id == MessageBody.id)
 
     @dbconnection
     def get_message_by_id(self, store, message_id):
-        row = store.query(Message).filter_by(message_id=message_id).first()
-        if row is None:
+        result = self._query(store).filter(
+            Message.message_id == message_id).first()
+        if result is None:
             return None
-        return self._get_message(row)
+        return self._get_message(store, *result)
 
     @dbconnection
     def get_message_by_hash(self, store, message_id_hash):
-        row = store.query(Message).filter_by(
-            message_id_hash=message_id_hash).first()
-        if row is None:
+        result = self._query(store).filter(
+            Message.message_id_hash == message_id_hash).first()
+        if result is None:
             return None
-        return self._get_message(row)
+        return self._get_message(store, *result)
 
     @property
     @dbconnection
     def messages(self, store):
-        for row in store.query(Message).all():
-            yield self._get_message(row)
+        # Read the segments in order.
+        query = self._query(store).order_by(Message.segment, Message.offset)
+        for row, body in query.all():
+            yield self._get_message(store, row, body)
 
     @dbconnection
     def delete_message(self, store, message_id):
         row = store.query(Message).filter_by(message_id=message_id).first()
-        if row is not None:
+        if row is None:
+            return
+        if row.path is not None:
             path = os.path.join(config.MESSAGES_DIR, row.path)
             # It's possible that a race condition caused the file system path
             # to already be deleted.
             safe_remove(path)
-            store.delete(row)
+        store.info.get('message_records', {}).pop(row, None)
+        # The segments holding the message may no longer be needed once the
+        # transaction is committed.
+        numbers = store.info.setdefault('message_segments', set())
+        if row.segment is not None:
+            numbers.add(row.segment)
+        if row.body_id is not None:
+            body = store.query(MessageBody).get(row.body_id)
+            if body is not None and body.segment is not None:
+                numbers.add(body.segment)
+        store.delete(row)
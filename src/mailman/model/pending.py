@@ -24,12 +24,10 @@ from mailman import public
 from mailman.config import config
 from mailman.database.model import Model
 from mailman.database.transaction import dbconnection
-from mailman.interfaces.pending import (
-    IPendable, IPended, IPendedKeyValue, IPendings)
+from mailman.interfaces.pending import IPendable, IPended, IPendings
 from mailman.utilities.datetime import now
 from mailman.utilities.uid import TokenFactory
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode, and_
-from sqlalchemy.orm import aliased, relationship
+from sqlalchemy import Column, DateTime, Integer, Unicode
 from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
@@ -37,23 +35,6 @@ from zope.interface.verify import verifyObject
 token_factory = TokenFactory()
 
 
-@public
-@implementer(IPendedKeyValue)
-class PendedKeyValue(Model):
-    """A pended key/value pair, tied to a token."""
-
-    __tablename__ = 'pendedkeyvalue'
-
-    id = Column(Integer, primary_key=True)
-    key = Column(Unicode, index=True)
-    value = Column(Unicode, index=True)
-    pended_id = Column(Integer, ForeignKey('pended.id'), index=True)
-
-    def __init__(self, key, value):
-        self.key = key
-        self.value = value
-
-
 @public
 @implementer(IPended)
 class Pended(Model):
@@ -64,7 +45,12 @@ class Pended(Model):
     id = Column(Integer, primary_key=True)
     token = Column(Unicode, index=True)
     expiration_date = Column(DateTime, index=True)
-    key_values = relationship('PendedKeyValue', cascade="all, delete-orphan")
+    # The type and the list-id of the pendable are the only keys it can be
+    # searched for, so they get columns of their own.  The rest of its data
+    # is kept as a single JSON object.
+    pend_type = Column(Unicode, index=True)
+    list_id = Column(Unicode, index=True)
+    payload = Column(Unicode)
 
 
 @public
@@ -73,6 +59,33 @@ class UnpendedPendable(dict):
     PEND_TYPE = 'unpended'
 
 
+def _encode(pendable):
+    # Both keys and values must be strings, but bytes values are allowed, as
+    # long as they can be turned back into bytes.  The type is stored in a
+    # column of its own.
+    data = {}
+    for key, value in pendable.items():
+        if key == 'type':
+            continue
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if isinstance(value, bytes):
+            value = dict(__encoding__='utf-8', value=value.decode('utf-8'))
+        data[key] = value
+    return json.dumps(data)
+
+
+def _decode(pend_type, payload):
+    # The `type` key is special and served.  It is not JSONified.  See the
+    # IPendable interface for details.
+    pendable = UnpendedPendable(type=pend_type)
+    for key, value in json.loads(payload).items():
+        if isinstance(value, dict) and '__encoding__' in value:
+            value = value['value'].encode(value['__encoding__'])
+        pendable[key] = value
+    return pendable
+
+
 @public
 @implementer(IPendings)
 class Pendings:
@@ -92,26 +105,15 @@ class Pendings:
                 break
         else:
             raise RuntimeError('Could not find a valid pendings token')
-        # Create the record, and then the individual key/value pairs.
+        # Pendables can be searched for by their list-id, which is always a
+        # string when it is given.
+        list_id = pendable.get('list_id')
         pending = Pended(
             token=token,
-            expiration_date=now() + lifetime)
-        pendable_type = pendable.get('type', pendable.PEND_TYPE)
-        pending.key_values.append(
-            PendedKeyValue(key='type', value=pendable_type))
-        for key, value in pendable.items():
-            # The type has been handled above.
-            if key == 'type':
-                continue
-            # Both keys and values must be strings.
-            if isinstance(key, bytes):
-                key = key.decode('utf-8')
-            if isinstance(value, bytes):
-                # Make sure we can turn this back into a bytes.
-                value = dict(__encoding__='utf-8',
-                             value=value.decode('utf-8'))
-            keyval = PendedKeyValue(key=key, value=json.dumps(value))
-            pending.key_values.append(keyval)
+            expiration_date=now() + lifetime,
+            pend_type=pendable.get('type', pendable.PEND_TYPE),
+            list_id=(list_id if isinstance(list_id, str) else None),
+            payload=_encode(pendable))
         store.add(pending)
         return token
 
@@ -119,58 +121,34 @@ class Pendings:
     def confirm(self, store, token, *, expunge=True):
         # Token can come in as a unicode, but it's stored in the database as
         # bytes.  They must be ascii.
-        pendings = store.query(Pended).filter_by(token=str(token))
-        if pendings.count() == 0:
+        pendings = store.query(Pended).filter_by(token=str(token)).all()
+        if len(pendings) == 0:
             return None
-        assert pendings.count() == 1, (
-            'Unexpected token count: {}'.format(pendings.count()))
+        assert len(pendings) == 1, (
+            'Unexpected token count: {}'.format(len(pendings)))
         pending = pendings[0]
-        pendable = UnpendedPendable()
-        # Iterate on PendedKeyValue entries that are associated with the
-        # pending object's ID.  Watch out for type conversions.
-        for keyvalue in pending.key_values:
-            # The `type` key is special and served.  It is not JSONified.  See
-            # the IPendable interface for details.
-            if keyvalue.key == 'type':
-                value = keyvalue.value
-            else:
-                value = json.loads(keyvalue.value)
-            if isinstance(value, dict) and '__encoding__' in value:
-                value = value['value'].encode(value['__encoding__'])
-            pendable[keyvalue.key] = value
+        pendable = _decode(pending.pend_type, pending.payload)
         if expunge:
             store.delete(pending)
         return pendable
 
     @dbconnection
     def evict(self, store):
-        right_now = now()
-        for pending in store.query(Pended).all():
-            if pending.expiration_date < right_now:
-                store.delete(pending)
+        store.query(Pended).filter(
+            Pended.expiration_date < now()).delete()
 
     @dbconnection
     def find(self, store, mlist=None, pend_type=None):
-        query = store.query(Pended)
+        query = store.query(Pended.token, Pended.pend_type, Pended.payload)
         if mlist is not None:
-            pkv_alias_mlist = aliased(PendedKeyValue)
-            query = query.join(pkv_alias_mlist).filter(and_(
-                pkv_alias_mlist.key == 'list_id',
-                pkv_alias_mlist.value == json.dumps(mlist.list_id)
-                ))
+            query = query.filter(Pended.list_id == mlist.list_id)
         if pend_type is not None:
-            pkv_alias_type = aliased(PendedKeyValue)
-            query = query.join(pkv_alias_type).filter(and_(
-                pkv_alias_type.key == 'type',
-                pkv_alias_type.value == pend_type
-                ))
-        for pending in query:
-            yield pending.token, self.confirm(pending.token, expunge=False)
+            query = query.filter(Pended.pend_type == pend_type)
+        for token, pended_type, payload in query.order_by(Pended.id):
+            yield token, _decode(pended_type, payload)
 
-    @dbconnection
-    def __iter__(self, store):
-        for pending in store.query(Pended).all():
-            yield pending.token, self.confirm(pending.token, expunge=False)
+    def __iter__(self):
+        yield from self.find()
 
     @property
     @dbconnection
@@ -23,15 +23,48 @@ moderator, and administrator roster filters.
 """
 
 from mailman import public
+from mailman.core.constants import system_preferences
 from mailman.database.transaction import dbconnection
 from mailman.interfaces.member import DeliveryMode, MemberRole
-from mailman.interfaces.roster import IRoster
+from mailman.interfaces.roster import IRoster, RosterEntry
 from mailman.model.address import Address
-from mailman.model.member import Member
-from sqlalchemy import or_
+from mailman.model.member import (
+    EffectivePreferences, Member, effective_preference_in)
+from sqlalchemy import and_, or_
 from zope.interface import implementer
 
 
+# The maximum number of email addresses to look up in a single query.  SQLite
+# limits the number of parameters in a statement.
+QUERY_BATCH_SIZE = 500
+
+
+def _effective(value, name):
+    return (getattr(system_preferences, name) if value is None else value)
+
+
+def _entries(query, effective):
+    # Turn a query of members joined to their address into roster entries.
+    query = query.filter(
+        effective.address.id.isnot(None)
+        ).with_entities(
+            effective.address.email,
+            effective.address._original,
+            Member._delivery_mode,
+            Member._delivery_status,
+            Member._receive_own_postings,
+            Member._receive_list_copy)
+    for (email, original, delivery_mode, delivery_status,
+         receive_own_postings, receive_list_copy) in query:
+        yield RosterEntry(
+            email,
+            (email if original is None else original),
+            _effective(delivery_mode, 'delivery_mode'),
+            _effective(delivery_status, 'delivery_status'),
+            _effective(receive_own_postings, 'receive_own_postings'),
+            _effective(receive_list_copy, 'receive_list_copy'))
+
+
 @public
 @implementer(IRoster)
 class AbstractRoster:
@@ -64,6 +97,12 @@ class AbstractRoster:
         """See `IRoster`."""
         return self._query().count()
 
+    @property
+    def entries(self):
+        """See `IRoster`."""
+        effective = EffectivePreferences()
+        yield from _entries(effective.join_address(self._query()), effective)
+
     @property
     def users(self):
         """See `IRoster`."""
@@ -127,6 +166,34 @@ class AbstractRoster:
             count)
         return memberships
 
+    @dbconnection
+    def get_members(self, store, emails):
+        """See ``IRoster``."""
+        # Avoid circular imports.
+        from mailman.model.user import User
+        members = {}
+        emails = list(emails)
+        for start in range(0, len(emails), QUERY_BATCH_SIZE):
+            batch = emails[start:start + QUERY_BATCH_SIZE]
+            # The members subscribed with their preferred address come first,
+            # so that the explicit address memberships take precedence, as in
+            # get_member().
+            via_user = store.query(Member, Address).filter(
+                Member.list_id == self._mlist.list_id,
+                Member.role == self.role,
+                Address.email.in_(batch),
+                Member.user_id == User.id,
+                User._preferred_address_id == Address.id)
+            explicit = store.query(Member, Address).filter(
+                Member.list_id == self._mlist.list_id,
+                Member.role == self.role,
+                Address.email.in_(batch),
+                Member.address_id == Address.id)
+            for query in (via_user, explicit):
+                for member, address in query:
+                    members[address.email] = member
+        return members
+
 
 @public
 class MemberRoster(AbstractRoster):
@@ -183,36 +250,37 @@ class AdministratorRoster(AbstractRoster):
             Address.email == email,
             Member.address_id == Address.id).one_or_none()
 
+    @dbconnection
+    def get_members(self, store, emails):
+        """See `IRoster`."""
+        members = {}
+        emails = list(emails)
+        for start in range(0, len(emails), QUERY_BATCH_SIZE):
+            batch = emails[start:start + QUERY_BATCH_SIZE]
+            query = store.query(Member, Address).filter(
+                Member.list_id == self._mlist.list_id,
+                or_(Member.role == MemberRole.moderator,
+                    Member.role == MemberRole.owner),
+                Address.email.in_(batch),
+                Member.address_id == Address.id)
+            for member, address in query:
+                members[address.email] = member
+        return members
+
 
 @public
 class DeliveryMemberRoster(AbstractRoster):
     """Return all the members having a particular kind of delivery."""
 
     role = MemberRole.member
-
-    @property
-    def member_count(self):
-        """See `IRoster`."""
-        # XXX 2012-03-15 BAW: It would be nice to make this more efficient.
-        # The problem is that you'd have to change the loop in _get_members()
-        # checking the delivery mode to a query parameter.
-        return len(tuple(self.members))
+    delivery_modes = ()
 
     @dbconnection
-    def _get_members(self, store, *delivery_modes):
-        """The set of members for a mailing list, filter by delivery mode.
-
-        :param delivery_modes: The modes to filter on.
-        :type delivery_modes: sequence of `DeliveryMode`.
-        :return: A generator of members.
-        :rtype: generator
-        """
-        results = store.query(Member).filter_by(
-            list_id=self._mlist.list_id,
-            role=MemberRole.member)
-        for member in results:
-            if member.delivery_mode in delivery_modes:
-                yield member
+    def _query(self, store):
+        return store.query(Member).filter(
+            Member.list_id == self._mlist.list_id,
+            Member.role == MemberRole.member,
+            effective_preference_in('delivery_mode', self.delivery_modes))
 
 
 @public
@@ -220,11 +288,7 @@ class RegularMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'regular_members'
-
-    @property
-    def members(self):
-        """See `IRoster`."""
-        yield from self._get_members(DeliveryMode.regular)
+    delivery_modes = (DeliveryMode.regular,)
 
 
 @public
@@ -232,14 +296,11 @@ class DigestMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'digest_members'
-
-    @property
-    def members(self):
-        """See `IRoster`."""
-        yield from self._get_members(
-            DeliveryMode.plaintext_digests,
-            DeliveryMode.mime_digests,
-            DeliveryMode.summary_digests)
+    delivery_modes = (
+        DeliveryMode.plaintext_digests,
+        DeliveryMode.mime_digests,
+        DeliveryMode.summary_digests,
+        )
 
 
 @public
@@ -283,6 +344,17 @@ class Memberships:
         """See `IRoster`."""
         yield from self._query()
 
+    @property
+    @dbconnection
+    def entries(self, store):
+        """See `IRoster`."""
+        effective = EffectivePreferences()
+        query = effective.join_address(store.query(Member)).filter(or_(
+            Member.user_id == self._user.id,
+            and_(Member.address_id.isnot(None),
+                 effective.address.user_id == self._user.id)))
+        yield from _entries(query, effective)
+
     @property
     def users(self):
         """See `IRoster`."""
@@ -302,3 +374,28 @@ class Memberships:
     def get_memberships(self, store, address):
         """See `IRoster`."""
         raise NotImplementedError
+
+    @dbconnection
+    def get_members(self, store, emails):
+        """See `IRoster`."""
+        # Avoid circular imports.
+        from mailman.model.user import User
+        members = {}
+        emails = list(emails)
+        for start in range(0, len(emails), QUERY_BATCH_SIZE):
+            batch = emails[start:start + QUERY_BATCH_SIZE]
+            # As with the mailing list rosters, the explicit address
+            # memberships take precedence.
+            via_user = store.query(Member, Address).filter(
+                Member.user_id == self._user.id,
+                Address.email.in_(batch),
+                Member.user_id == User.id,
+                User._preferred_address_id == Address.id)
+            explicit = store.query(Member, Address).filter(
+                Address.user_id == self._user.id,
+                Address.email.in_(batch),
+                Member.address_id == Address.id)
+            for query in (via_user, explicit):
+                for member, address in query:
+                    members[address.email] = member
+        return members
@@ -17,21 +17,29 @@
 
 """Subscription services."""
 
+from itertools import islice
 from mailman import public
 from mailman.app.membership import delete_member
 from mailman.database.transaction import dbconnection
+from mailman.interfaces.address import InvalidEmailAddressError
+from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.listmanager import IListManager, NoSuchListError
-from mailman.interfaces.member import MemberRole
+from mailman.interfaces.member import (
+    AlreadySubscribedError, MassUnsubscriptionEvent, MemberRole,
+    MembershipIsBannedError, SubscriptionEvent)
 from mailman.interfaces.subscriptions import (
     ISubscriptionService, TooManyMembersError)
-from mailman.interfaces.usermanager import IUserManager
 from mailman.model.address import Address
-from mailman.model.member import Member
+from mailman.model.member import (
+    QUERY_BATCH_SIZE, EffectivePreferences, Member)
+from mailman.model.preferences import Preferences
 from mailman.model.user import User
 from mailman.utilities.queries import QuerySequence
-from operator import attrgetter
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased, joinedload
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from zope.component import getUtility
+from zope.event import notify
 from zope.interface import implementer
 
 
@@ -42,27 +50,29 @@ class SubscriptionService:
 
     __name__ = 'members'
 
-    def get_members(self):
+    @dbconnection
+    def get_members(self, store):
         """See `ISubscriptionService`."""
-        # {list_id -> {role -> [members]}}
-        by_list = {}
-        user_manager = getUtility(IUserManager)
-        for member in user_manager.members:
-            by_role = by_list.setdefault(member.list_id, {})
-            members = by_role.setdefault(member.role.name, [])
-            members.append(member)
-        # Flatten into single list sorted as per the interface.
-        all_members = []
-        address_of_member = attrgetter('address.email')
-        for list_id in sorted(by_list):
-            by_role = by_list[list_id]
-            all_members.extend(
-                sorted(by_role.get('owner', []), key=address_of_member))
-            all_members.extend(
-                sorted(by_role.get('moderator', []), key=address_of_member))
-            all_members.extend(
-                sorted(by_role.get('member', []), key=address_of_member))
-        return all_members
+        # A member's address is either its own, or its user's preferred
+        # address.  Sort on them in the database, so that slicing the result
+        # only loads the requested members.  The same address can be
+        # subscribed both directly and through its user, so the member id
+        # makes the order total, and the slices stable.
+        address = aliased(Address)
+        preferred_address = aliased(Address)
+        role_order = case([
+            (Member.role == MemberRole.owner, 0),
+            (Member.role == MemberRole.moderator, 1),
+            ], else_=2)
+        query = store.query(Member).outerjoin(
+            address, Member._address).outerjoin(
+            Member._user).outerjoin(
+            preferred_address, User._preferred_address).filter(
+            Member.role != MemberRole.nonmember).order_by(
+            Member.list_id, role_order,
+            func.coalesce(address.email, preferred_address.email),
+            Member.id)
+        return QuerySequence(query)
 
     @dbconnection
     def get_member(self, store, member_id):
@@ -149,30 +159,132 @@ class SubscriptionService:
         # XXX for now, no notification or user acknowledgment.
         delete_member(mlist, email, False, False)
 
+    def subscribe_members(self, list_id, records, role=MemberRole.member):
+        """See `ISubscriptionService`."""
+        mlist = getUtility(IListManager).get_by_list_id(list_id)
+        if mlist is None:
+            raise NoSuchListError(list_id)
+        return self._subscribe_members(mlist, records, role)
+
+    @dbconnection
+    def _subscribe_members(self, store, mlist, records, role):
+        records = iter(records)
+        while True:
+            batch = list(islice(records, QUERY_BATCH_SIZE))
+            if len(batch) == 0:
+                break
+            # Don't flush the new rows one at a time while the batch is being
+            # built, but insert them all at once afterward.
+            with store.no_autoflush:
+                results, users = self._subscribe_batch(
+                    store, mlist, batch, role)
+            store.flush()
+            members = [result for result in results
+                       if isinstance(result, Member)]
+            if role is MemberRole.member and len(users) > 0:
+                # Remove the nonmember subscriptions of the new members'
+                # users to this list.
+                user_ids = set(user.id for user in users)
+                nonmembers = store.query(Member).join(Member._address).filter(
+                    Member.list_id == mlist.list_id,
+                    Member.role == MemberRole.nonmember,
+                    Address.user_id.in_(user_ids))
+                for nonmember in nonmembers.all():
+                    nonmember.unsubscribe()
+            for member in members:
+                notify(SubscriptionEvent(mlist, member))
+            yield from zip(batch, results)
+
+    def _subscribe_batch(self, store, mlist, records, role):
+        # Look up everything the records need in a few queries.
+        banned = IBanManager(mlist).is_banned_many(
+            record.email for record in records)
+        emails = set(record.email.lower() for record in records)
+        addresses = {
+            address.email: address
+            for address in store.query(Address).options(
+                joinedload(Address.user).joinedload(User.preferences)
+                ).filter(Address.email.in_(emails))
+            }
+        subscribed = set(
+            email for (email,) in store.query(Address.email).join(
+                Member, Member.address_id == Address.id).filter(
+                    Member.list_id == mlist.list_id,
+                    Member.role == role,
+                    Address.email.in_(emails)))
+        results = []
+        users = set()
+        for record in records:
+            if record.email in banned:
+                results.append(MembershipIsBannedError(mlist, record.email))
+                continue
+            # Make sure there is a user linked with the given address.
+            address = addresses.get(record.email.lower())
+            if address is None:
+                try:
+                    address = Address(record.email, record.display_name)
+                except InvalidEmailAddressError as error:
+                    results.append(error)
+                    continue
+                address.preferences = Preferences()
+                store.add(address)
+                addresses[address.email] = address
+            if address.user is None:
+                user = User(record.display_name or address.display_name,
+                            Preferences())
+                user.link(address)
+            address.user.preferences.preferred_language = record.language
+            if address.email in subscribed:
+                results.append(AlreadySubscribedError(
+                    mlist.fqdn_listname, record.email, role))
+                continue
+            member = Member(role=role,
+                            list_id=mlist.list_id,
+                            subscriber=address)
+            member.preferences = Preferences()
+            member.preferences.preferred_language = record.language
+            member.preferences.delivery_mode = record.delivery_mode
+            store.add(member)
+            subscribed.add(address.email)
+            users.add(address.user)
+            results.append(member)
+        return results, users
+
     @dbconnection
     def unsubscribe_members(self, store, list_id, emails):
         """See 'ISubscriptionService'."""
-        success = set()
-        fail = set()
         mlist = getUtility(IListManager).get_by_list_id(list_id)
         if mlist is None:
             raise NoSuchListError(list_id)
-        # Start with a query on the matching list-id and role.
-        q_member = store.query(Member).filter(
-            Member.list_id == list_id,
-            Member.role == MemberRole.member)
         # De-duplicate.
-        for email in set(emails):
-            unsubscribed = False
-            # Join with a queries matching the email address and preferred
-            # address of any subscribed user.
-            q_address = q_member.join(Member._address).filter(
-                Address.email == email)
-            q_user = q_member.join(Member._user).join(
-                User._preferred_address).filter(Address.email == email)
-            members = q_address.union(q_user).all()
-            for member in members:
-                member.unsubscribe()
-                unsubscribed = True
-            (success if unsubscribed else fail).add(email)
+        emails = list(set(emails))
+        # Find the members by their subscribed address, which is either their
+        # own or the preferred address of their user.
+        effective = EffectivePreferences()
+        query = effective.join_address(
+            store.query(Member, effective.address.email)).filter(
+                Member.list_id == list_id,
+                Member.role == MemberRole.member)
+        members = []
+        success = set()
+        for start in range(0, len(emails), QUERY_BATCH_SIZE):
+            batch = emails[start:start + QUERY_BATCH_SIZE]
+            for member, email in query.filter(
+                    effective.address.email.in_(batch)):
+                members.append(member)
+                success.add(email)
+        fail = set(emails) - success
+        if len(members) == 0:
+            return success, fail
+        # Yes, this must get triggered before the members are deleted.
+        notify(MassUnsubscriptionEvent(mlist, members))
+        # Delete the members, then their preferences.
+        member_ids = [member.id for member in members]
+        preferences_ids = [member.preferences_id for member in members]
+        for model, ids in ((Member, member_ids),
+                           (Preferences, preferences_ids)):
+            for start in range(0, len(ids), QUERY_BATCH_SIZE):
+                store.query(model).filter(
+                    model.id.in_(ids[start:start + QUERY_BATCH_SIZE])
+                    ).delete(synchronize_session='fetch')
         return success, fail
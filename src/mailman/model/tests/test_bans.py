@@ -20,8 +20,10 @@
 import unittest
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
 from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.listmanager import IListManager
+from mailman.model.bans import BanCache
 from mailman.testing.layers import ConfigLayer
 from zope.component import getUtility
 
@@ -46,3 +48,75 @@ class TestMailingListBans(unittest.TestCase):
         getUtility(IListManager).delete(self._mlist)
         self.assertEqual([ban.email for ban in global_ban_manager],
                          ['bart@example.com'])
+
+
+class TestBanCache(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('ant@example.com')
+        self._manager = IBanManager(self._mlist)
+        self._global_manager = IBanManager(None)
+
+    def test_ban_and_unban_invalidate(self):
+        # Bans and unbans take effect immediately.
+        self.assertFalse(self._manager.is_banned('anne@example.com'))
+        self._manager.ban('anne@example.com')
+        self.assertTrue(self._manager.is_banned('anne@example.com'))
+        self._global_manager.ban('^.*@example.org$')
+        self.assertTrue(self._manager.is_banned('bart@example.org'))
+        self._manager.unban('anne@example.com')
+        self._global_manager.unban('^.*@example.org$')
+        self.assertFalse(self._manager.is_banned('anne@example.com'))
+        self.assertFalse(self._manager.is_banned('bart@example.org'))
+
+    def test_ban_from_another_process(self):
+        # Bans added and removed by another process, with its own cache,
+        # also take effect.
+        other_cache = BanCache()
+        self._manager.ban('aaa@example.com')
+        [index] = other_cache.get(config.db.store, self._mlist.list_id)
+        self.assertIn('aaa@example.com', index)
+        # Replacing the last ban with one of the same length can leave the
+        # ban table looking unchanged, but not its generation.
+        self._manager.unban('aaa@example.com')
+        self._manager.ban('bbb@example.com')
+        [index] = other_cache.get(config.db.store, self._mlist.list_id)
+        self.assertNotIn('aaa@example.com', index)
+        self.assertIn('bbb@example.com', index)
+
+    def test_aborted_ban(self):
+        # A ban which is rolled back doesn't stick.
+        config.db.commit()
+        self._manager.ban('anne@example.com')
+        self.assertTrue(self._manager.is_banned('anne@example.com'))
+        config.db.abort()
+        self.assertFalse(self._manager.is_banned('anne@example.com'))
+
+    def test_combined_patterns(self):
+        # Many pattern bans are matched case insensitively, including
+        # ones which can't be combined with the others.
+        for i in range(10):
+            self._global_manager.ban('^.*@spam{}\\.example\\.com$'.format(i))
+        self._manager.ban('^(?P<name>cris)@')
+        self._manager.ban('^(.)\\1.*@example\\.com$')
+        self._manager.ban('^(?P<name>dana)@')
+        self.assertTrue(self._manager.is_banned('anne@SPAM3.example.com'))
+        self.assertFalse(self._manager.is_banned('anne@spam10.example.com'))
+        self.assertTrue(self._manager.is_banned('cris@example.org'))
+        self.assertTrue(self._manager.is_banned('aaron@example.com'))
+        self.assertFalse(self._manager.is_banned('abby@example.com'))
+        self.assertTrue(self._manager.is_banned('dana@example.com'))
+
+    def test_is_banned_many(self):
+        self._manager.ban('anne@example.com')
+        self._global_manager.ban('^bart@')
+        self.assertEqual(
+            self._manager.is_banned_many([
+                'anne@example.com', 'bart@example.com', 'cris@example.com']),
+            {'anne@example.com', 'bart@example.com'})
+        self.assertEqual(
+            self._global_manager.is_banned_many([
+                'anne@example.com', 'bart@example.com']),
+            {'bart@example.com'})
+        self.assertEqual(self._manager.is_banned_many([]), set())
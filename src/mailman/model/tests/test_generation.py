@@ -0,0 +1,62 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test generation markers."""
+
+import unittest
+
+from mailman.config import config
+from mailman.model.generation import Generation
+from mailman.testing.layers import ConfigLayer
+from sqlalchemy.orm import Query
+from unittest.mock import patch
+
+
+class TestGeneration(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._store = config.db.store
+
+    def test_bump_new(self):
+        self.assertIsNone(Generation.get(self._store, 'ant'))
+        Generation.bump(self._store, 'ant')
+        first = Generation.get(self._store, 'ant')
+        self.assertIsNotNone(first)
+        Generation.bump(self._store, 'ant')
+        self.assertNotEqual(Generation.get(self._store, 'ant'), first)
+
+    def test_bump_race(self):
+        # Another process adds the marker after it was found missing.  The
+        # marker is then updated instead.
+        update = Query.update
+        calls = []
+
+        def racing_update(query, *args, **kws):
+            calls.append(query)
+            if len(calls) > 1:
+                return update(query, *args, **kws)
+            self._store.execute(Generation.__table__.insert().values(
+                name='ant', value='other'))
+            return 0
+
+        with patch.object(Query, 'update', racing_update):
+            Generation.bump(self._store, 'ant')
+        self.assertEqual(len(calls), 2)
+        value = Generation.get(self._store, 'ant')
+        self.assertNotIn(value, (None, 'other'))
+        self.assertEqual(self._store.query(Generation).count(), 1)
@@ -80,6 +80,21 @@ class TestListManager(unittest.TestCase):
             sorted(getUtility(IListManager).list_ids),
             ['ant.example.com', 'bee.example.com', 'cat.example.com'])
 
+    def test_generation(self):
+        # The generation changes whenever a mailing list is created or
+        # deleted, even within a single transaction.
+        list_manager = getUtility(IListManager)
+        generations = [list_manager.generation]
+        ant = create_list('ant@example.com')
+        generations.append(list_manager.generation)
+        create_list('bee@example.com')
+        generations.append(list_manager.generation)
+        config.db.commit()
+        self.assertEqual(list_manager.generation, generations[-1])
+        list_manager.delete(ant)
+        generations.append(list_manager.generation)
+        self.assertEqual(len(set(generations)), 4)
+
     def test_delete_list_with_list_archiver_set(self):
         # Ensure that mailing lists with archiver sets can be deleted.  In
         # issue #115, this fails under PostgreSQL, but not SQLite.
@@ -20,8 +20,10 @@
 import unittest
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
 from mailman.interfaces.action import Action
-from mailman.interfaces.member import MemberRole, MembershipError
+from mailman.interfaces.member import (
+    DeliveryMode, MemberRole, MembershipError)
 from mailman.interfaces.user import UnverifiedAddressError
 from mailman.interfaces.usermanager import IUserManager
 from mailman.model.member import Member
@@ -121,3 +123,73 @@ class TestMember(unittest.TestCase):
         self.assertEqual(bart_member.moderation_action, Action.accept)
         self.assertIsNone(cris_member.moderation_action)
         self.assertIsNone(dana_member.moderation_action)
+
+    def test_effective_preferences_follow_address_and_user(self):
+        # A member's effective preferences follow changes to the preferences
+        # of its address or user, even before they are flushed.
+        anne = self._usermanager.create_user('anne@example.com')
+        address = set_preferred(anne)
+        member = self._mlist.subscribe(address)
+        self.assertEqual(member.delivery_mode, DeliveryMode.regular)
+        anne.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        self.assertEqual(member.delivery_mode, DeliveryMode.plaintext_digests)
+        address.preferences.delivery_mode = DeliveryMode.mime_digests
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
+        member.preferences.delivery_mode = DeliveryMode.summary_digests
+        self.assertEqual(member.delivery_mode, DeliveryMode.summary_digests)
+        self.assertEqual(
+            list(self._mlist.digest_members.members), [member])
+        member.preferences.delivery_mode = None
+        address.preferences.delivery_mode = None
+        anne.preferences.delivery_mode = None
+        self.assertEqual(member.delivery_mode, DeliveryMode.regular)
+        self.assertEqual(
+            list(self._mlist.regular_members.members), [member])
+
+    def test_effective_preferences_new_member(self):
+        # A newly subscribed member inherits its address's preferences before
+        # it is flushed.
+        anne = self._usermanager.create_address('anne@example.com')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        anne.preferences.acknowledge_posts = True
+        member = self._mlist.subscribe(anne)
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
+        self.assertTrue(member.acknowledge_posts)
+
+    def test_effective_preferences_materialized(self):
+        # Once flushed, the effective preferences are stored with the member,
+        # and loaded members are updated too.
+        anne = self._usermanager.create_address('anne@example.com')
+        member = self._mlist.subscribe(anne)
+        config.db.store.flush()
+        self.assertIsNone(member._delivery_mode)
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        config.db.store.flush()
+        self.assertEqual(member._delivery_mode, DeliveryMode.mime_digests)
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
+
+    def test_preferred_language_unflushed(self):
+        # A member's preferred language is looked up while there are
+        # unflushed changes to its address.
+        anne = self._usermanager.create_address('anne@example.com')
+        anne.preferences.preferred_language = 'fr'
+        member = self._mlist.subscribe(anne)
+        config.db.store.flush()
+        anne.display_name = 'Anne Person'
+        self.assertTrue(member._has_unflushed_changes())
+        self.assertEqual(member.preferred_language.code, 'fr')
+
+    def test_unrelated_changes_are_not_unflushed(self):
+        # Unflushed changes to other members' addresses don't make a member
+        # look up its preferences the slow way.
+        anne = self._usermanager.create_address('anne@example.com')
+        bart = self._usermanager.create_address('bart@example.com')
+        member = self._mlist.subscribe(anne)
+        self._mlist.subscribe(bart)
+        config.db.store.flush()
+        self.assertFalse(member._has_unflushed_changes())
+        bart.display_name = 'Bart Person'
+        self.assertFalse(member._has_unflushed_changes())
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        self.assertTrue(member._has_unflushed_changes())
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
@@ -18,15 +18,19 @@
 """Test the message store."""
 
 import os
+import pickle
 import unittest
 
 from mailman.config import config
+from mailman.database.transaction import transaction
 from mailman.interfaces.messages import IMessageStore
-from mailman.model.message import Message
+from mailman.model.message import Message, MessageBody
 from mailman.testing.helpers import (
     specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.email import add_message_hash
+from mailman.utilities.filesystem import makedirs
+from unittest.mock import patch
 from zope.component import getUtility
 
 
@@ -79,22 +83,105 @@ Message-ID: <ant>
     def test_can_survive_missing_message_path(self):
         # Deleting a message which is in the store, but which doesn't appear
         # on the file system does not raise an exception, but still removes
-        # the message from the store.
+        # the message from the store.  Only messages stored by older versions
+        # have a file of their own.
         msg = mfs("""\
 Message-ID: <ant>
 
 """)
-        self._store.add(msg)
-        self.assertEqual(len(list(self._store.messages)), 1)
-        # We have to use the SQLAlchemy API because the .get_message_by_*()
-        # methods return email Message objects, not IMessages.  The former
-        # does not give us the path to the object on the file system.
-        row = config.db.store.query(Message).filter_by(
-            message_id='<ant>').first()
-        os.remove(os.path.join(config.MESSAGES_DIR, row.path))
+        hash32 = add_message_hash(msg)
+        Message('<ant>', hash32, os.path.join('MS', '6Q', hash32))
         self._store.delete_message('<ant>')
         self.assertEqual(len(list(self._store.messages)), 0)
 
+    def test_legacy_message(self):
+        # Messages pickled into files of their own can still be read.
+        msg = mfs("""\
+Subject: Pickled
+Message-ID: <ant>
+
+""")
+        hash32 = add_message_hash(msg)
+        relpath = os.path.join('MS', '6Q', hash32)
+        path = os.path.join(config.MESSAGES_DIR, relpath)
+        makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            pickle.dump(msg, fp, -1)
+        Message('<ant>', hash32, relpath)
+        stored_msg = self._store.get_message_by_hash(hash32)
+        self.assertEqual(stored_msg['subject'], 'Pickled')
+        self._store.delete_message('<ant>')
+        self.assertFalse(os.path.exists(path))
+
+    def test_writes_are_batched(self):
+        # The messages added in a transaction are written to their segment
+        # with a single write when the transaction is committed.  Until then,
+        # they can still be read.
+        with patch('mailman.model.messagestore.os.write',
+                   side_effect=os.write) as write:
+            with transaction():
+                for message_id in ('<ant>', '<bee>', '<cat>'):
+                    self._store.add(mfs("""\
+Message-ID: {}
+
+Hello.
+""".format(message_id)))
+                stored_msg = self._store.get_message_by_id('<bee>')
+                self.assertEqual(stored_msg.get_payload(), 'Hello.\n')
+                self.assertEqual(write.call_count, 0)
+        self.assertEqual(write.call_count, 1)
+        segments = os.listdir(os.path.join(config.MESSAGES_DIR, 'segments'))
+        self.assertEqual(len(segments), 1)
+        stored_msg = self._store.get_message_by_id('<cat>')
+        self.assertEqual(stored_msg.get_payload(), 'Hello.\n')
+        self.assertEqual(len(list(self._store.messages)), 3)
+
+    def test_bodies_are_shared(self):
+        # Messages with the same body share a single copy of it.
+        with transaction():
+            for message_id in ('<ant>', '<bee>'):
+                msg = mfs("""\
+Message-ID: {}
+
+The same body.
+""".format(message_id))
+                msg.original_size = 42
+                self._store.add(msg)
+        self.assertEqual(config.db.store.query(MessageBody).count(), 1)
+        for message_id in ('<ant>', '<bee>'):
+            stored_msg = self._store.get_message_by_id(message_id)
+            self.assertEqual(stored_msg['message-id'], message_id)
+            self.assertEqual(stored_msg.get_payload(), 'The same body.\n')
+            self.assertEqual(stored_msg.original_size, 42)
+
+    def test_unused_segments_are_removed(self):
+        # Once none of its messages are stored any more, a segment which no
+        # process appends to is removed.
+        with transaction():
+            self._store.add(mfs("""\
+Message-ID: <ant>
+
+First.
+"""))
+        # Make this process move on to a new segment.
+        with patch('mailman.model.messagestore.SEGMENT_SIZE', 1):
+            with transaction():
+                self._store.add(mfs("""\
+Message-ID: <bee>
+
+Second.
+"""))
+        directory = os.path.join(config.MESSAGES_DIR, 'segments')
+        self.assertEqual(len(os.listdir(directory)), 2)
+        with transaction():
+            self._store.delete_message('<bee>')
+        # This process still appends to the second segment.
+        self.assertEqual(len(os.listdir(directory)), 2)
+        with transaction():
+            self._store.delete_message('<ant>')
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertEqual(config.db.store.query(MessageBody).count(), 1)
+
     def test_message_id_hash(self):
         # The new specification calls for a Message-ID-Hash header,
         # specifically without the X- prefix.
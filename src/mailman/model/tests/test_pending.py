@@ -19,10 +19,11 @@
 
 import unittest
 
+from datetime import timedelta
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.interfaces.pending import IPendable, IPendings
-from mailman.model.pending import PendedKeyValue
+from mailman.model.pending import Pended
 from mailman.testing.layers import ConfigLayer
 from zope.component import getUtility
 from zope.interface import implementer
@@ -38,8 +39,8 @@ class TestPendings(unittest.TestCase):
 
     layer = ConfigLayer
 
-    def test_delete_key_values(self):
-        # Deleting a pending should delete its key-values.
+    def test_delete_pended(self):
+        # Confirming a pending deletes its row, payload and all.
         pendingdb = getUtility(IPendings)
         subscription = SimplePendable(
             type='subscription',
@@ -51,7 +52,25 @@ class TestPendings(unittest.TestCase):
         self.assertEqual(pendingdb.count, 1)
         pendingdb.confirm(token)
         self.assertEqual(pendingdb.count, 0)
-        self.assertEqual(config.db.store.query(PendedKeyValue).count(), 0)
+        self.assertEqual(config.db.store.query(Pended).count(), 0)
+
+    def test_bytes_values(self):
+        # Bytes values are turned back into bytes.
+        pendingdb = getUtility(IPendings)
+        token = pendingdb.add(SimplePendable(
+            type='data', message=b'\xe2\x98\x83', count=3))
+        pendable = pendingdb.confirm(token)
+        self.assertEqual(pendable, dict(
+            type='data', message=b'\xe2\x98\x83', count=3))
+
+    def test_evict(self):
+        # Only the expired pendings are evicted.
+        pendingdb = getUtility(IPendings)
+        pendingdb.add(SimplePendable(type='old'), timedelta(days=-1))
+        token = pendingdb.add(SimplePendable(type='new'), timedelta(days=1))
+        pendingdb.evict()
+        self.assertEqual(pendingdb.count, 1)
+        self.assertEqual(list(pendingdb), [(token, dict(type='new'))])
 
     def test_find(self):
         # Test getting pendables for a mailing-list.
@@ -21,11 +21,14 @@ import unittest
 
 from mailman.app.lifecycle import create_list
 from mailman.interfaces.address import IAddress
-from mailman.interfaces.member import DeliveryMode, MemberRole
+from mailman.interfaces.member import (
+    DeliveryMode, DeliveryStatus, MemberRole)
+from mailman.interfaces.roster import RosterEntry
 from mailman.interfaces.user import IUser
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.helpers import set_preferred
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
 from zope.component import getUtility
 
 
@@ -120,6 +123,68 @@ class TestMailingListRoster(unittest.TestCase):
         self.assertEqual(self._mlist.digest_members.member_count, 1)
         self.assertEqual(self._mlist.subscribers.member_count, 4)
 
+    def test_entries_inherit_preferences(self):
+        # Roster entries have the same effective preferences as the members,
+        # whether they come from the member, the address, the user or the
+        # system.
+        user_manager = getUtility(IUserManager)
+        user = user_manager.create_user()
+        user.link(self._bart)
+        user.preferences.receive_list_copy = False
+        self._anne.preferences.delivery_status = DeliveryStatus.by_user
+        self._cris.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._cris.preferences.receive_own_postings = False
+        self._mlist.subscribe(self._anne)
+        member = self._mlist.subscribe(self._bart)
+        member.preferences.delivery_status = DeliveryStatus.by_moderator
+        self._mlist.subscribe(self._cris)
+        self._mlist.subscribe(self._cris, role=MemberRole.owner)
+        entries = sorted(self._mlist.members.entries)
+        self.assertEqual(entries, sorted(
+            RosterEntry(member.address.email, member.address.original_email,
+                        member.delivery_mode, member.delivery_status,
+                        member.receive_own_postings, member.receive_list_copy)
+            for member in self._mlist.members.members))
+        self.assertEqual(entries, [
+            RosterEntry('anne@example.com', 'anne@example.com',
+                        DeliveryMode.regular, DeliveryStatus.by_user,
+                        True, True),
+            RosterEntry('bart@example.com', 'bart@example.com',
+                        DeliveryMode.regular, DeliveryStatus.by_moderator,
+                        True, False),
+            RosterEntry('cris@example.com', 'cris@example.com',
+                        DeliveryMode.mime_digests, DeliveryStatus.enabled,
+                        False, True),
+            ])
+        self.assertEqual(
+            sorted(entry.email
+                   for entry in self._mlist.regular_members.entries),
+            ['anne@example.com', 'bart@example.com'])
+        self.assertEqual(
+            [entry.email for entry in self._mlist.digest_members.entries],
+            ['cris@example.com'])
+        self.assertEqual(
+            sorted(entry.email for entry in self._mlist.subscribers.entries),
+            ['anne@example.com', 'bart@example.com',
+             'cris@example.com', 'cris@example.com'])
+
+    def test_entries_preferred_address(self):
+        # Members subscribed through their user's preferred address have
+        # that address in their roster entry.
+        user_manager = getUtility(IUserManager)
+        anne = user_manager.create_user('anne@example.org')
+        set_preferred(anne)
+        anne.preferred_address._original = 'Anne@Example.org'
+        anne.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        self._mlist.subscribe(anne)
+        self.assertEqual(list(self._mlist.members.entries), [
+            RosterEntry('anne@example.org', 'Anne@Example.org',
+                        DeliveryMode.plaintext_digests,
+                        DeliveryStatus.enabled, True, True),
+            ])
+        self.assertEqual(self._mlist.regular_members.member_count, 0)
+        self.assertEqual(self._mlist.digest_members.member_count, 1)
+
 
 class TestMembershipsRoster(unittest.TestCase):
     """Test the memberships roster."""
@@ -191,6 +256,35 @@ class TestMembershipsRoster(unittest.TestCase):
             [record.address.email for record in memberships],
             ['anne@example.com', 'anne@example.com'])
 
+    def test_memberships_get_members(self):
+        # A user's memberships can be looked up by email address, and the
+        # explicit address memberships take precedence.
+        bart = getUtility(IUserManager).create_address('bart@example.com')
+        self._ant.subscribe(bart)
+        self._ant.subscribe(self._anne)
+        self.assertEqual(
+            self._anne.memberships.get_members(
+                ['anne@example.com', 'bart@example.com']),
+            {'anne@example.com': self._ant.members.get_member(
+                'anne@example.com')})
+        member = self._bee.subscribe(self._anne.preferred_address)
+        self.assertEqual(
+            self._anne.memberships.get_members(['anne@example.com']),
+            {'anne@example.com': member})
+        self.assertEqual(self._anne.memberships.get_members([]), {})
+
+    def test_memberships_entries(self):
+        # Anne is subscribed as a user, and with an explicit address.
+        self._ant.subscribe(self._anne)
+        address = self._anne.register('aperson@example.com')
+        address.verified_on = now()
+        self._bee.subscribe(address)
+        self._bee.subscribe(
+            getUtility(IUserManager).create_address('bart@example.com'))
+        self.assertEqual(
+            sorted(entry.email for entry in self._anne.memberships.entries),
+            ['anne@example.com', 'aperson@example.com'])
+
     def test_memberships_users(self):
         self._ant.subscribe(self._anne)
         users = list(self._anne.memberships.users)
@@ -225,3 +319,31 @@ class TestUserRoster(unittest.TestCase):
         self._mlist.subscribe(self._dave)
         member = self._mlist.members.get_member('bart@example.com')
         self.assertEqual(member.user, self._bart)
+
+    def test_get_members(self):
+        # Several members can be looked up at once, by their preferred or
+        # explicit addresses.
+        self._mlist.subscribe(self._anne)
+        self._mlist.subscribe(self._bart)
+        self._mlist.subscribe(self._cris.preferred_address)
+        members = self._mlist.members.get_members([
+            'anne@example.com', 'cris@example.com', 'zack@example.com'])
+        self.assertEqual(sorted(members),
+                         ['anne@example.com', 'cris@example.com'])
+        self.assertEqual(members['anne@example.com'],
+                         self._mlist.members.get_member('anne@example.com'))
+        self.assertEqual(members['cris@example.com'],
+                         self._mlist.members.get_member('cris@example.com'))
+        self.assertEqual(self._mlist.owners.get_members(['anne@example.com']),
+                         {})
+
+    def test_get_members_prefers_explicit_address(self):
+        # When an address is subscribed both explicitly and through the
+        # preferred address of its user, the explicit membership is returned,
+        # as with .get_member().
+        self._mlist.subscribe(self._anne)
+        explicit = self._mlist.subscribe(self._anne.preferred_address)
+        members = self._mlist.members.get_members(['anne@example.com'])
+        self.assertEqual(members['anne@example.com'], explicit)
+        self.assertEqual(self._mlist.members.get_member('anne@example.com'),
+                         explicit)
@@ -20,14 +20,23 @@
 import unittest
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.address import InvalidEmailAddressError
+from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.listmanager import NoSuchListError
-from mailman.interfaces.member import MemberRole
+from mailman.interfaces.member import (
+    AlreadySubscribedError, DeliveryMode, MassUnsubscriptionEvent,
+    MemberRole, MembershipIsBannedError, SubscriptionEvent)
 from mailman.interfaces.subscriptions import (
-    ISubscriptionService, TooManyMembersError)
+    ISubscriptionService, RequestRecord, TooManyMembersError)
 from mailman.interfaces.usermanager import IUserManager
-from mailman.testing.helpers import set_preferred, subscribe
+from mailman.model.member import Member
+from mailman.model.preferences import Preferences
+from mailman.testing.helpers import (
+    event_subscribers, set_preferred, subscribe)
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
+from unittest.mock import patch
 from zope.component import getUtility
 
 
@@ -215,6 +224,58 @@ class TestSubscriptionService(unittest.TestCase):
              ('test3', 'anne3', MemberRole.moderator),
              ])
 
+    def test_get_members_sorted(self):
+        # All members are sorted by list, role and address, including the
+        # members subscribed through their user's preferred address.  Slices
+        # are taken after sorting.
+        ant = create_list('ant@example.com')
+        user = self._user_manager.create_user('bart@example.com')
+        set_preferred(user)
+        self._mlist.subscribe(user)
+        self._mlist.subscribe(
+            self._user_manager.create_address('anne@example.com'))
+        self._mlist.subscribe(
+            self._user_manager.create_address('cris@example.com'),
+            MemberRole.owner)
+        self._mlist.subscribe(
+            self._user_manager.create_address('dave@example.com'),
+            MemberRole.nonmember)
+        ant.subscribe(self._user_manager.get_address('cris@example.com'))
+        members = self._service.get_members()
+        self.assertEqual(len(members), 4)
+        self.assertEqual(
+            [(member.list_id, member.address.email, member.role)
+             for member in members],
+            [('ant.example.com', 'cris@example.com', MemberRole.member),
+             ('test.example.com', 'cris@example.com', MemberRole.owner),
+             ('test.example.com', 'anne@example.com', MemberRole.member),
+             ('test.example.com', 'bart@example.com', MemberRole.member),
+             ])
+        self.assertEqual(
+            [member.address.email for member in members[2:4]],
+            ['anne@example.com', 'bart@example.com'])
+
+    def test_get_members_same_address(self):
+        # Members with the same list, role and address are sorted by their
+        # id, so that every slice of the members is stable.
+        user = self._user_manager.create_user('anne@example.com')
+        address = set_preferred(user)
+        members = []
+        for i in range(3):
+            for subscriber in (user, address):
+                member = Member(MemberRole.member, 'test.example.com',
+                                subscriber)
+                member.preferences = Preferences()
+                config.db.store.add(member)
+                members.append(member)
+        config.db.store.flush()
+        self.assertEqual(
+            list(self._service.get_members()),
+            sorted(members, key=lambda member: member.id))
+        self.assertEqual(
+            [self._service.get_members()[i] for i in range(6)],
+            sorted(members, key=lambda member: member.id))
+
     def test_find_no_members(self):
         members = self._service.find_members()
         self.assertEqual(len(members), 0)
@@ -240,6 +301,117 @@ class TestSubscriptionService(unittest.TestCase):
         self.assertRaises(NoSuchListError, self._service.leave,
                           'bogus.example.com', 'anne@example.com')
 
+    def test_subscribe_members_no_such_list(self):
+        # Raises an exception if an invalid list_id is passed
+        self.assertRaises(NoSuchListError, self._service.subscribe_members,
+                          'bogus.example.com',
+                          [RequestRecord('anne@example.com')])
+
+    def test_subscribe_members(self):
+        # New addresses get a user, and the preferences of the request.
+        results = list(self._service.subscribe_members(
+            self._mlist.list_id, [
+                RequestRecord('anne@example.com', 'Anne Person',
+                              DeliveryMode.mime_digests, 'fr'),
+                RequestRecord('Bart@example.com', 'Bart Person'),
+                ]))
+        self.assertEqual(
+            [(record.email, member.address.original_email)
+             for record, member in results],
+            [('anne@example.com', 'anne@example.com'),
+             ('Bart@example.com', 'Bart@example.com')])
+        anne = self._mlist.members.get_member('anne@example.com')
+        self.assertEqual(anne.delivery_mode, DeliveryMode.mime_digests)
+        self.assertEqual(anne.preferred_language.code, 'fr')
+        self.assertEqual(anne.user.display_name, 'Anne Person')
+        self.assertEqual(anne.user.preferences.preferred_language.code, 'fr')
+        bart = self._mlist.members.get_member('bart@example.com')
+        self.assertEqual(bart.delivery_mode, DeliveryMode.regular)
+        self.assertEqual(bart.address.display_name, 'Bart Person')
+        self.assertEqual(bart.user.display_name, 'Bart Person')
+
+    def test_subscribe_members_existing_addresses(self):
+        # Existing addresses are subscribed, whether they are linked to a user
+        # or not.
+        anne = self._user_manager.create_user('anne@example.com', 'Anne')
+        bart = self._user_manager.create_address(
+            'bart@example.com', 'Bart Person')
+        results = list(self._service.subscribe_members(
+            self._mlist.list_id, [
+                RequestRecord('Anne@example.com'),
+                RequestRecord('bart@example.com'),
+                ]))
+        self.assertEqual(results[0][1].user, anne)
+        self.assertEqual(results[1][1].address, bart)
+        self.assertEqual(bart.user.display_name, 'Bart Person')
+        self.assertEqual(len(list(self._user_manager.users)), 2)
+
+    def test_subscribe_members_failures(self):
+        # The records which cannot be subscribed give the reason why.
+        subscribe(self._mlist, 'Anne')
+        IBanManager(self._mlist).ban('bart@example.com')
+        results = list(self._service.subscribe_members(
+            self._mlist.list_id, [
+                RequestRecord('aperson@example.com'),
+                RequestRecord('bart@example.com'),
+                RequestRecord('not an address'),
+                RequestRecord('cate@example.com'),
+                RequestRecord('Cate@example.com'),
+                ]))
+        self.assertEqual(
+            [type(result) for record, result in results],
+            [AlreadySubscribedError, MembershipIsBannedError,
+             InvalidEmailAddressError, Member, AlreadySubscribedError])
+        self.assertEqual(results[4][1].email, 'Cate@example.com')
+        self.assertEqual(
+            [address.email for address in self._mlist.members.addresses],
+            ['aperson@example.com', 'cate@example.com'])
+
+    def test_subscribe_members_other_role(self):
+        # Members can be subscribed with any role.
+        subscribe(self._mlist, 'Anne')
+        results = list(self._service.subscribe_members(
+            self._mlist.list_id, [RequestRecord('aperson@example.com')],
+            MemberRole.moderator))
+        self.assertEqual(results[0][1].role, MemberRole.moderator)
+
+    def test_subscribe_members_removes_nonmembers(self):
+        # Subscribing a user as a member removes the nonmember subscriptions
+        # of their addresses.
+        anne = self._user_manager.create_user('anne@example.com')
+        other = self._user_manager.create_address('anne@example.net')
+        anne.link(other)
+        self._mlist.subscribe(other, MemberRole.nonmember)
+        list(self._service.subscribe_members(
+            self._mlist.list_id, [RequestRecord('anne@example.com')]))
+        self.assertEqual(self._mlist.nonmembers.member_count, 0)
+        self.assertEqual(self._mlist.members.member_count, 1)
+
+    def test_subscribe_members_in_batches(self):
+        # The records are read, and the members are created and announced,
+        # one batch at a time.
+        events = []
+        def record_event(event):                    # noqa
+            if isinstance(event, SubscriptionEvent):
+                events.append(event.member.address.email)
+        read = []
+        def records():                              # noqa
+            for email in ('anne@example.com', 'bart@example.com',
+                          'cate@example.com'):
+                read.append(email)
+                yield RequestRecord(email)
+        with patch('mailman.model.subscriptions.QUERY_BATCH_SIZE', 2), \
+                event_subscribers(record_event):
+            results = self._service.subscribe_members(
+                self._mlist.list_id, records())
+            record, member = next(results)
+            self.assertEqual(member.address.email, 'anne@example.com')
+            self.assertEqual(read, ['anne@example.com', 'bart@example.com'])
+            self.assertEqual(events, read)
+            self.assertEqual(len(list(results)), 2)
+        self.assertEqual(len(events), 3)
+        self.assertEqual(self._mlist.members.member_count, 3)
+
     def test_unsubscribe_members_no_such_list(self):
         # Raises an exception if an invalid list_id is passed
         self.assertRaises(NoSuchListError, self._service.unsubscribe_members,
@@ -397,6 +569,68 @@ class TestSubscriptionService(unittest.TestCase):
             [address.email for address in bee_owners.addresses],
             ['anne_1@example.com'])
 
+    def test_unsubscribe_members_mass_event(self):
+        # A single event is triggered for all the unsubscribed members, while
+        # they are still subscribed.
+        anne = subscribe(self._mlist, 'Anne')
+        bart = subscribe(self._mlist, 'Bart')
+        events = []
+        def record_event(event):                    # noqa
+            events.append(event)
+            if isinstance(event, MassUnsubscriptionEvent):
+                self.assertEqual(self._mlist.members.member_count, 2)
+        with event_subscribers(record_event):
+            self._service.unsubscribe_members(
+                self._mlist.list_id,
+                ['aperson@example.com', 'bperson@example.com'])
+        self.assertEqual(len(events), 1)
+        self.assertIs(events[0].mlist, self._mlist)
+        self.assertEqual(set(events[0].members), {anne, bart})
+        self.assertEqual(str(events[0]), '2 members left test.example.com')
+        self.assertEqual(self._mlist.members.member_count, 0)
+
+    def test_unsubscribe_members_no_event(self):
+        # No event is triggered when nobody was unsubscribed.
+        events = []
+        with event_subscribers(events.append):
+            success, fail = self._service.unsubscribe_members(
+                self._mlist.list_id, ['anne@example.com'])
+        self.assertEqual(events, [])
+        self.assertEqual(fail, {'anne@example.com'})
+
+    def test_unsubscribe_members_deletes_preferences(self):
+        # The members' preferences are deleted along with them.
+        anne = subscribe(self._mlist, 'Anne')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        preferences_id = anne.preferences.id
+        self._service.unsubscribe_members(
+            self._mlist.list_id, ['aperson@example.com'])
+        self.assertEqual(
+            config.db.store.query(Preferences).filter_by(
+                id=preferences_id).count(),
+            0)
+        # The address and its user are kept.
+        user = self._user_manager.get_user('aperson@example.com')
+        self.assertIsNotNone(user.preferences)
+
+    def test_unsubscribe_members_in_batches(self):
+        # Many email addresses are looked up in several queries.
+        for name in ('Anne', 'Bart', 'Cris'):
+            subscribe(self._mlist, name)
+        with patch('mailman.model.subscriptions.QUERY_BATCH_SIZE', 2):
+            success, fail = self._service.unsubscribe_members(
+                self._mlist.list_id, [
+                    'aperson@example.com',
+                    'bperson@example.com',
+                    'cperson@example.com',
+                    'dperson@example.com',
+                    ])
+        self.assertEqual(success, {'aperson@example.com',
+                                   'bperson@example.com',
+                                   'cperson@example.com'})
+        self.assertEqual(fail, {'dperson@example.com'})
+        self.assertEqual(self._mlist.members.member_count, 0)
+
     def test_unsubscribe_members_with_duplicates(self):
         ant = create_list('ant@example.com')
         ant.admin_immed_notify = False
@@ -17,19 +17,25 @@
 
 """Base delivery class."""
 
+import re
 import copy
+import uuid
 import socket
 import logging
 import smtplib
 
 from mailman import public
 from mailman.config import config
+from mailman.email.message import LazyMessage
 from mailman.interfaces.mta import IMailTransportAgentDelivery
 from mailman.mta.connection import Connection
 from zope.interface import implementer
 
 
 log = logging.getLogger('mailman.smtp')
+EMPTYSTRING = b''
+# Any line ending which isn't already CRLF.
+EOL_RE = re.compile(r'(?:\r\n|\n|\r(?!\n))')
 
 
 @public
@@ -45,6 +51,31 @@ class BaseDelivery:
             config.mta.smtp_host, int(config.mta.smtp_port),
             int(config.mta.max_sessions_per_connection),
             username, password)
+        self._rendered = None
+
+    def render(self, msg):
+        """Flatten the message into the bytes sent to the MTA.
+
+        The bytes of the last rendered message are cached, so sending the
+        same message to several chunks of recipients, and calculating its
+        size, only flattens it once.  The cache is keyed on the identity of
+        the message object, which must not be modified after it has been
+        rendered.  Use `forget()` before rendering a modified message.
+
+        :param msg: The message to render.
+        :type msg: `Message`
+        :return: The message text, with CRLF line endings.
+        :rtype: bytes
+        """
+        if self._rendered is None or self._rendered[0] is not msg:
+            # This is what smtplib would do to a str message.
+            text = EOL_RE.sub('\r\n', msg.as_string()).encode('ascii')
+            self._rendered = (msg, text)
+        return self._rendered[1]
+
+    def forget(self):
+        """Drop the cached rendering of the last message."""
+        self._rendered = None
 
     def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
         """Low-level delivery to a set of recipients.
@@ -65,7 +96,7 @@ class BaseDelivery:
         message_id = msg['message-id']
         try:
             refused = self._connection.sendmail(
-                sender, recipients, msg.as_string())
+                sender, recipients, self.render(msg))
         except smtplib.SMTPRecipientsRefused as error:
             log.error('%s recipients refused: %s', message_id, error)
             refused = error.recipients
@@ -113,6 +144,83 @@ class BaseDelivery:
         return sender
 
 
+@public
+def make_marker():
+    """Return a unique string to mark a slot in a `PersonalizationTemplate`.
+    """
+    return 'mailman-slot-' + uuid.uuid4().hex
+
+
+def _encode(text):
+    # Return the text as bytes with LF line endings, and as bytes with CRLF
+    # line endings.  Only ASCII text can be spliced into a rendered message.
+    return text.encode('ascii'), EOL_RE.sub('\r\n', text).encode('ascii')
+
+
+@public
+class PersonalizationTemplate:
+    """A message rendered once, with slots for the per-recipient parts.
+
+    A slot is some text of the rendered message, usually containing a marker
+    from `make_marker()`, along with a function which, given the metadata of a
+    recipient, returns the text to replace it with.  The function returns
+    None if the message has to be individually crafted for the recipient.
+    """
+
+    def __init__(self, text, slots):
+        """Create the template.
+
+        :param text: The rendered message, with the slot texts in it.
+        :type text: str
+        :param slots: The slots of the message.
+        :type slots: sequence of 2-tuples of (text, function)
+        :raise ValueError: if a slot text is not found exactly once in the
+            message, or if the message can't be rendered as ASCII.
+        """
+        positions = []
+        for slot_text, stamp in slots:
+            start = text.find(slot_text)
+            if start < 0 or text.find(slot_text, start + 1) >= 0:
+                raise ValueError('Ambiguous slot: {}'.format(slot_text))
+            positions.append((start, start + len(slot_text), stamp))
+        positions.sort(key=lambda position: position[0])
+        self._pieces = []
+        self._stamps = []
+        end = 0
+        for start, stop, stamp in positions:
+            if start < end:
+                raise ValueError('Overlapping slots')
+            self._pieces.append(_encode(text[end:start]))
+            self._stamps.append(stamp)
+            end = stop
+        self._pieces.append(_encode(text[end:]))
+
+    def stamp(self, msgdata):
+        """Fill in the slots for a recipient.
+
+        :param msgdata: The metadata of the recipient's delivery.
+        :type msgdata: dictionary
+        :return: The message with LF line endings, and the message with CRLF
+            line endings, or None if the message can't be made from the
+            template for this recipient.
+        :rtype: 2-tuple of bytes, or None
+        """
+        lf_parts = [self._pieces[0][0]]
+        crlf_parts = [self._pieces[0][1]]
+        for stamp, (lf_piece, crlf_piece) in zip(
+                self._stamps, self._pieces[1:]):
+            text = stamp(msgdata)
+            if text is None:
+                return None
+            try:
+                lf_text, crlf_text = _encode(text)
+            except UnicodeError:
+                return None
+            lf_parts.extend((lf_text, lf_piece))
+            crlf_parts.extend((crlf_text, crlf_piece))
+        return EMPTYSTRING.join(lf_parts), EMPTYSTRING.join(crlf_parts)
+
+
 @public
 class IndividualDelivery(BaseDelivery):
     """Deliver a unique individual message to each recipient.
@@ -125,12 +233,28 @@ class IndividualDelivery(BaseDelivery):
     The core concept here is that for each recipient, the deliver() method
     iterates over the list of registered callbacks, each of which have a
     chance to modify the message before final delivery.
+
+    Copying and modifying the message for every recipient is expensive, so
+    when every callback `foo` comes with a `foo_template()` method, the
+    message is instead rendered once into a `PersonalizationTemplate`.  The
+    `foo_template()` method takes the same arguments as the callback, but it
+    modifies the message to be rendered by putting markers in place of the
+    per-recipient text, and returns the slots for those markers.  It returns
+    None when the message can't be personalized with a template.
     """
 
-    def __init__(self):
-        """See `BaseDelivery`."""
+    def __init__(self, pipelining=False):
+        """See `BaseDelivery`.
+
+        :param pipelining: Whether to send the recipients' messages over the
+            connection with `Connection.sendmany()`, grouped by the domain of
+            the recipients, instead of one `_deliver_to_recipients()` call at
+            a time.
+        :type pipelining: bool
+        """
         super().__init__()
         self.callbacks = []
+        self._pipelining = pipelining
 
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`.
@@ -139,27 +263,89 @@ class IndividualDelivery(BaseDelivery):
         delivery address in the return envelope so there can be no ambiguity
         in bounce processing.
         """
+        if self._pipelining:
+            return self._connection.sendmany(
+                (self._get_sender(mlist, message_copy, msgdata_copy),
+                 [recipient], self.render(message_copy))
+                for recipient, message_copy, msgdata_copy
+                in self._personalize(mlist, msg, msgdata))
         refused = {}
+        for recipient, message_copy, msgdata_copy in self._personalize(
+                mlist, msg, msgdata):
+            status = self._deliver_to_recipients(
+                mlist, message_copy, msgdata_copy, [recipient])
+            refused.update(status)
+        return refused
+
+    def _personalize(self, mlist, msg, msgdata):
+        """Craft the message for each recipient in turn.
+
+        :return: The recipients, with their message and metadata.
+        :rtype: iterator of 3-tuples of (recipient, message, metadata)
+        """
         recipients = msgdata.get('recipients', set())
+        if self._pipelining:
+            # Consecutive messages for the same domain let the MTA relay them
+            # over the same connection.
+            recipients = sorted(
+                recipients,
+                key=lambda recipient: recipient.rpartition('@')[2].lower())
+        # See which recipients are members of the mailing list, so that this
+        # information can be squirreled away for use by other modules, such
+        # as the header/footer decorator.
+        members = mlist.members.get_members(recipients)
+        template = None
+        if len(recipients) > 1:
+            template = self._make_template(mlist, msg, msgdata)
         for recipient in recipients:
             log.debug('IndividualDelivery to: %s', recipient)
-            # Make a copy of the original messages and operator on it, since
-            # we're going to munge it repeatedly for each recipient.
-            message_copy = copy.deepcopy(msg)
             msgdata_copy = msgdata.copy()
             # Squirrel the current recipient away in the message metadata.
             # That way the subclass's _get_sender() override can encode the
             # recipient address in the sender, e.g. for VERP.
             msgdata_copy['recipient'] = recipient
-            # See if the recipient is a member of the mailing list, and if so,
-            # squirrel this information away for use by other modules, such as
-            # the header/footer decorator.  XXX 2012-03-05 this is probably
-            # highly inefficient on the database.
-            member = mlist.members.get_member(recipient)
-            msgdata_copy['member'] = member
-            for callback in self.callbacks:
-                callback(mlist, message_copy, msgdata_copy)
-            status = self._deliver_to_recipients(
-                mlist, message_copy, msgdata_copy, [recipient])
-            refused.update(status)
-        return refused
+            msgdata_copy['member'] = members.get(recipient)
+            rendered = None
+            if template is not None:
+                # The slots may record things in the metadata, but only keep
+                # them if the template could be used for this recipient.
+                stamped_msgdata = msgdata_copy.copy()
+                rendered = template.stamp(stamped_msgdata)
+                if rendered is not None:
+                    msgdata_copy = stamped_msgdata
+            if rendered is None:
+                # Make a copy of the original messages and operator on it,
+                # since we're going to munge it repeatedly for each
+                # recipient.
+                message_copy = copy.deepcopy(msg)
+                for callback in self.callbacks:
+                    callback(mlist, message_copy, msgdata_copy)
+            else:
+                lf_text, crlf_text = rendered
+                message_copy = LazyMessage(lf_text)
+                self._rendered = (message_copy, crlf_text)
+            yield recipient, message_copy, msgdata_copy
+
+    def _make_template(self, mlist, msg, msgdata):
+        """Render the message once for all the recipients, if possible.
+
+        :return: The template, or None if the message has to be crafted
+            individually for every recipient.
+        :rtype: `PersonalizationTemplate` or None
+        """
+        template_msg = copy.deepcopy(msg)
+        template_msgdata = msgdata.copy()
+        slots = []
+        for callback in self.callbacks:
+            make_slots = getattr(
+                self, getattr(callback, '__name__', '') + '_template', None)
+            if make_slots is None:
+                return None
+            callback_slots = make_slots(mlist, template_msg, template_msgdata)
+            if callback_slots is None:
+                return None
+            slots.extend(callback_slots)
+        try:
+            return PersonalizationTemplate(template_msg.as_string(), slots)
+        except ValueError:
+            return None
@@ -17,8 +17,11 @@
 
 """Bulk message delivery."""
 
+from concurrent.futures import ThreadPoolExecutor
 from mailman import public
+from mailman.config import config
 from mailman.mta.base import BaseDelivery
+from mailman.mta.connection import ConnectionPool
 
 
 # A mapping of top-level domains to bucket numbers.  The zeroth bucket is
@@ -38,18 +41,33 @@ CHUNKMAP = dict(
 class BulkDelivery(BaseDelivery):
     """Deliver messages to the MSA in as few sessions as possible."""
 
-    def __init__(self, max_recipients=None):
+    def __init__(self, max_recipients=None, max_threads=None):
         """See `BaseDelivery`.
 
         :param max_recipients: The maximum number of recipients per delivery
             chunk.  None, zero or less means to group all recipients into one
             big chunk.
         :type max_recipients: integer
+        :param max_threads: The maximum number of chunks delivered in
+            parallel, each over its own connection to the SMTP server.  None,
+            one or less means to deliver the chunks one after the other.
+        :type max_threads: integer
         """
         super().__init__()
         self._max_recipients = (max_recipients
                                 if max_recipients is not None
                                 else 0)
+        self._max_threads = (max_threads
+                             if max_threads is not None
+                             else 0)
+        if self._max_threads > 1:
+            username = (config.mta.smtp_user if config.mta.smtp_user else None)
+            password = (config.mta.smtp_pass if config.mta.smtp_pass else None)
+            self._connection = ConnectionPool(
+                self._max_threads,
+                config.mta.smtp_host, int(config.mta.smtp_port),
+                int(config.mta.max_sessions_per_connection),
+                username, password)
 
     def chunkify(self, recipients):
         """Split a set of recipients into chunks.
@@ -96,8 +114,29 @@ class BulkDelivery(BaseDelivery):
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`."""
         refused = {}
-        for recipients in self.chunkify(msgdata.get('recipients', set())):
-            chunk_refused = self._deliver_to_recipients(
-                mlist, msg, msgdata, recipients)
-            refused.update(chunk_refused)
+        chunks = list(self.chunkify(msgdata.get('recipients', set())))
+        # Flatten the message once, for all the chunks.
+        self.forget()
+        self.render(msg)
+        if self._max_threads <= 1 or len(chunks) <= 1:
+            for recipients in chunks:
+                chunk_refused = self._deliver_to_recipients(
+                    mlist, msg, msgdata, recipients)
+                refused.update(chunk_refused)
+            return refused
+        # Calculate the sender once before starting the threads, so that any
+        # database access needed for it happens in this thread.
+        self._get_sender(mlist, msg, msgdata)
+        threads = min(self._max_threads, len(chunks))
+        try:
+            with ThreadPoolExecutor(threads) as executor:
+                results = [
+                    executor.submit(self._deliver_to_recipients,
+                                    mlist, msg, msgdata, recipients)
+                    for recipients in chunks
+                    ]
+                for result in results:
+                    refused.update(result.result())
+        finally:
+            self._connection.quit()
         return refused
@@ -17,16 +17,32 @@
 
 """MTA connections."""
 
+import re
+import socket
 import logging
 import smtplib
 
 from contextlib import suppress
+from queue import LifoQueue
 from lazr.config import as_boolean
 from mailman import public
 from mailman.config import config
 
 
 log = logging.getLogger('mailman.smtp')
+EMPTYSTRING = b''
+CRLF = b'\r\n'
+# Lines of message content starting with a period must have it doubled.
+PERIOD_RE = re.compile(br'^\.', re.MULTILINE)
+
+
+def _data(msgtext):
+    # Return the message content as sent after the DATA command, including
+    # the terminating line with a single period.
+    text = PERIOD_RE.sub(b'..', msgtext)
+    if not text.endswith(CRLF):
+        text += CRLF
+    return text + b'.' + CRLF
 
 
 @public
@@ -59,6 +75,10 @@ class Connection:
         self._password = smtp_pass
         self._session_count = None
         self._connection = None
+        # The pipelined transaction whose content hasn't been sent yet, as a
+        # 2-tuple of the accepted recipients and the message text.
+        self._in_flight = None
+        self._reset_needed = False
 
     def _connect(self):
         """Open a new connection."""
@@ -69,6 +89,7 @@ class Connection:
             log.debug('Logging in')
             self._connection.login(self._username, self._password)
         self._session_count = self._sessions_per_connection
+        self._reset_needed = False
 
     def sendmail(self, envsender, recipients, msgtext):
         """Mimic `smtplib.SMTP.sendmail`."""
@@ -96,6 +117,131 @@ class Connection:
             self.quit()
         return results
 
+    def sendmany(self, transactions):
+        """Send several messages, pipelining the SMTP commands if possible.
+
+        When the SMTP server supports the PIPELINING extension (RFC 2920),
+        the MAIL, RCPT and DATA commands of each message are sent in one go,
+        along with the content of the previous message, so that there is only
+        one round trip to the server per message.  Otherwise, the messages are
+        sent one after the other with `sendmail()`.
+
+        :param transactions: The messages to send.
+        :type transactions: iterable of 3-tuples of (envsender, recipients,
+            msgtext)
+        :return: The refused recipients, as for `smtplib.SMTP.sendmail`.
+            This includes all the recipients of the messages which could not
+            be sent at all, with the SMTP error code of the failure, or 444 if
+            the connection to the server failed.
+        :rtype: dictionary
+        """
+        refused = {}
+        for envsender, recipients, msgtext in transactions:
+            if as_boolean(config.devmode.enabled):
+                recipients = [config.devmode.recipient] * len(recipients)
+            try:
+                if self._connection is None:
+                    self._connect()
+                    self._connection.ehlo_or_helo_if_needed()
+                if self._connection.has_extn('pipelining'):
+                    self._pipeline(envsender, recipients, msgtext, refused)
+                else:
+                    refused.update(
+                        self.sendmail(envsender, recipients, msgtext))
+            except smtplib.SMTPRecipientsRefused as error:
+                log.error('%s recipients refused: %s', envsender, error)
+                refused.update(error.recipients)
+            except smtplib.SMTPResponseException as error:
+                log.error('%s response exception: %s', envsender, error)
+                self._abort(recipients, error.smtp_code, error.smtp_error,
+                            refused)
+            except (socket.error, smtplib.SMTPException) as error:
+                # As for `BaseDelivery`, treat this as a temporary failure of
+                # all the recipients which haven't been dealt with yet.
+                log.error('%s low level smtp error: %s', envsender, error)
+                self._abort(recipients, 444, str(error), refused)
+        self._finish(refused)
+        return refused
+
+    def _pipeline(self, envsender, recipients, msgtext, refused):
+        """Send one message, pipelining it with the one in flight."""
+        commands = []
+        previous = self._in_flight
+        if previous is not None:
+            commands.append(_data(previous[1]))
+        reset = self._reset_needed
+        if reset:
+            commands.append(b'RSET' + CRLF)
+        commands.append('MAIL FROM:{}'.format(
+            smtplib.quoteaddr(envsender)).encode('ascii') + CRLF)
+        for recipient in recipients:
+            commands.append('RCPT TO:{}'.format(
+                smtplib.quoteaddr(recipient)).encode('ascii') + CRLF)
+        commands.append(b'DATA' + CRLF)
+        log.debug('envsender: %s, recipients: %s, size(msgtext): %s',
+                  envsender, recipients, len(msgtext))
+        self._connection.send(EMPTYSTRING.join(commands))
+        if previous is not None:
+            code, response = self._connection.getreply()
+            self._in_flight = None
+            if code != 250:
+                refused.update(dict.fromkeys(previous[0], (code, response)))
+        if reset:
+            self._connection.getreply()
+        mail_code, mail_response = self._connection.getreply()
+        accepted = []
+        for recipient in recipients:
+            code, response = self._connection.getreply()
+            if mail_code != 250:
+                refused[recipient] = (mail_code, mail_response)
+            elif code not in (250, 251):
+                refused[recipient] = (code, response)
+            else:
+                accepted.append(recipient)
+        code, response = self._connection.getreply()
+        if code == 354:
+            # Some servers accept the DATA command even when there are no
+            # valid recipients, in which case an empty message is sent.
+            self._in_flight = ((accepted, msgtext) if accepted
+                               else ([], EMPTYSTRING))
+            self._reset_needed = False
+        else:
+            self._in_flight = None
+            self._reset_needed = True
+            if mail_code == 250:
+                refused.update(dict.fromkeys(accepted, (code, response)))
+        self._session_count -= 1
+        if self._session_count == 0:
+            self._finish(refused)
+            self.quit()
+
+    def _finish(self, refused):
+        """Send the content of the pipelined message in flight, if any."""
+        if self._in_flight is None:
+            return
+        recipients, msgtext = self._in_flight
+        try:
+            self._connection.send(_data(msgtext))
+            code, response = self._connection.getreply()
+        except (socket.error, smtplib.SMTPException) as error:
+            log.error('low level smtp error: %s', error)
+            self._abort([], 444, str(error), refused)
+            return
+        self._in_flight = None
+        if code != 250:
+            refused.update(dict.fromkeys(recipients, (code, response)))
+
+    def _abort(self, recipients, code, response, refused):
+        """Refuse the recipients, including those of the message in flight.
+
+        The connection is closed, so the next message is sent over a new one.
+        """
+        if self._in_flight is not None:
+            refused.update(dict.fromkeys(self._in_flight[0], (code, response)))
+            self._in_flight = None
+        refused.update(dict.fromkeys(recipients, (code, response)))
+        self.quit()
+
     def quit(self):
         """Mimic `smtplib.SMTP.quit`."""
         if self._connection is None:
@@ -103,3 +249,48 @@ class Connection:
         with suppress(smtplib.SMTPException):
             self._connection.quit()
         self._connection = None
+
+
+@public
+class ConnectionPool:
+    """Share a bounded number of connections to the SMTP server.
+
+    This has the same interface as `Connection`, but it can be used from
+    several threads at once.  Each `sendmail()` call borrows an idle
+    connection from the pool for the duration of the SMTP session.
+    """
+    def __init__(self, size, host, port, sessions_per_connection,
+                 smtp_user=None, smtp_pass=None):
+        """Create a connection pool.
+
+        :param size: The maximum number of connections open at the same time.
+        :type size: integer
+
+        The remaining arguments are passed to each `Connection`.
+        """
+        self._connections = [
+            Connection(host, port, sessions_per_connection,
+                       smtp_user, smtp_pass)
+            for i in range(size)
+            ]
+        # Connections are opened lazily, so prefer the most recently used
+        # one, which is the most likely to still be open.
+        self._idle = LifoQueue()
+        for connection in self._connections:
+            self._idle.put(connection)
+
+    def sendmail(self, envsender, recipients, msgtext):
+        """Mimic `smtplib.SMTP.sendmail`."""
+        connection = self._idle.get()
+        try:
+            return connection.sendmail(envsender, recipients, msgtext)
+        finally:
+            self._idle.put(connection)
+
+    def quit(self):
+        """Mimic `smtplib.SMTP.quit`.
+
+        This must only be called when no sessions are in progress.
+        """
+        for connection in self._connections:
+            connection.quit()
@@ -19,7 +19,15 @@
 
 from mailman import public
 from mailman.config import config
+from mailman.handlers.decorate import (
+    Decorate, archiver_substitutions, decorate_message, decorate_template,
+    load_decoration, member_substitutions)
+from mailman.mta.base import make_marker
 from mailman.mta.verp import VERPDelivery
+from urllib.error import URLError
+
+
+NL = '\n'
 
 
 @public
@@ -33,6 +41,67 @@ class DecoratingMixin:
         # Do not decorate a message more than once.
         msgdata['nodecorate'] = True
 
+    def decorate_template(self, mlist, msg, msgdata):
+        """See `decorate()` and `IndividualDelivery`."""
+        if type(config.handlers['decorate']) is not Decorate:
+            # Only the standard decorations can be templated.
+            return None
+        if msgdata.get('isdigest') or msgdata.get('nodecorate'):
+            return []
+        try:
+            header_template = load_decoration(mlist, mlist.header_uri)
+            footer_template = load_decoration(mlist, mlist.footer_uri)
+        except URLError:
+            # Let decorate() log the error for every recipient.
+            return None
+        header_marker = (make_marker() if header_template else '')
+        footer_marker = (make_marker() if footer_template else '')
+        inline = decorate_message(mlist, msg, header_marker, footer_marker)
+        if inline is None:
+            return []
+        # The markers must show up in the rendered message as they are, so
+        # the parts they were added to must not be encoded.
+        for part in msg.walk():
+            payload = part.get_payload()
+            if not isinstance(payload, str):
+                continue
+            if ((header_marker and header_marker in payload) or
+                    (footer_marker and footer_marker in payload)):
+                cte = part.get('content-transfer-encoding', '7bit').lower()
+                if cte not in ('7bit', '8bit'):
+                    return None
+        archiver_data = archiver_substitutions(mlist, msg)
+        def expand(msgdata, template):              # noqa
+            # This is what the decorate handler does for every recipient.
+            msgdata['nodecorate'] = True
+            d = {}
+            member = msgdata.get('member')
+            if member is not None:
+                recipient = msgdata.get(
+                    'recipient', member.address.original_email)
+                d.update(member_substitutions(member, recipient))
+            d.update(archiver_data)
+            d.update(msgdata.get('decoration-data', {}))
+            return decorate_template(mlist, template, d)
+        slots = []
+        if header_marker:
+            def stamp_header(msgdata):              # noqa
+                header = expand(msgdata, header_template)
+                if not header:
+                    # The message would be decorated differently.
+                    return None
+                if inline and not header.endswith(NL):
+                    header += NL
+                return header
+            slots.append((header_marker + NL if inline else header_marker,
+                          stamp_header))
+        if footer_marker:
+            def stamp_footer(msgdata):              # noqa
+                footer = expand(msgdata, footer_template)
+                return (footer if footer else None)
+            slots.append((footer_marker, stamp_footer))
+        return slots
+
 
 @public
 class DecoratingDelivery(DecoratingMixin, VERPDelivery):
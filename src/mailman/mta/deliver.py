@@ -20,6 +20,7 @@
 import time
 import logging
 
+from lazr.config import as_boolean
 from mailman import public
 from mailman.config import config
 from mailman.interfaces.mailinglist import Personalization
@@ -49,8 +50,9 @@ class Deliver(VERPMixin, DecoratingMixin, PersonalizedMixin,
     * Header/Footer decoration
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, pipelining=False):
+        """See `IndividualDelivery`."""
+        super().__init__(pipelining)
         self.callbacks.extend([
             self.avoid_duplicates,
             self.decorate,
@@ -70,11 +72,12 @@ def deliver(mlist, msg, msgdata):
     # use individual delivery.  If not specified, use bulk delivery.  See the
     # to-outgoing handler for when the 'verp' key is set in the metadata.
     if msgdata.get('verp', False):
-        agent = Deliver()
+        agent = Deliver(as_boolean(config.mta.pipelining))
     elif mlist.personalize != Personalization.none:
-        agent = Deliver()
+        agent = Deliver(as_boolean(config.mta.pipelining))
     else:
-        agent = BulkDelivery(int(config.mta.max_recipients))
+        agent = BulkDelivery(int(config.mta.max_recipients),
+                             int(config.mta.max_delivery_threads))
     log.debug('Using agent: %s', agent)
     # Keep track of the original recipients and the original sender for
     # logging purposes.
@@ -88,7 +91,7 @@ def deliver(mlist, msg, msgdata):
     # Log this posting.
     size = getattr(msg, 'original_size', msgdata.get('original_size'))
     if size is None:
-        size = len(msg.as_string())
+        size = len(agent.render(msg))
     substitutions = dict(
         msgid       = msg.get('message-id', 'n/a'),   # noqa
         listname    = mlist.fqdn_listname,            # noqa
@@ -22,6 +22,7 @@ from email.utils import formataddr
 from mailman import public
 from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.usermanager import IUserManager
+from mailman.mta.base import make_marker
 from mailman.mta.verp import VERPDelivery
 from zope.component import getUtility
 
@@ -45,17 +46,42 @@ class PersonalizedMixin:
         # Personalize the To header if the list requests it.
         if mlist.personalize != Personalization.full:
             return
+        msg.replace_header('To', self._personalized_to(msgdata))
+
+    def personalize_to_template(self, mlist, msg, msgdata):
+        """See `personalize_to()` and `IndividualDelivery`."""
+        if mlist.personalize != Personalization.full:
+            return []
+        if 'to' not in msg:
+            # Let personalize_to() fail for every recipient.
+            return None
+        marker = make_marker()
+        msg.replace_header('To', marker)
+        def stamp(msgdata):                         # noqa
+            return self._personalized_to(msgdata)
+        return [(marker, stamp)]
+
+    def _personalized_to(self, msgdata):
+        """Return the To header contents for the recipient.
+
+        This is the recipient's address, and if the recipient is a user
+        registered with Mailman, the recipient's real name too.
+        """
         recipient = msgdata['recipient']
-        user_manager = getUtility(IUserManager)
-        user = user_manager.get_user(recipient)
-        if user is None:
-            msg.replace_header('To', recipient)
+        member = msgdata.get('member')
+        if member is not None and member.address.email == recipient:
+            # Avoid a database query.
+            user = member.address.user
         else:
-            # Convert the unicode name to an email-safe representation.
-            # Create a Header instance for the name so that it's properly
-            # encoded for email transport.
-            name = Header(user.display_name).encode()
-            msg.replace_header('To', formataddr((name, recipient)))
+            user_manager = getUtility(IUserManager)
+            user = user_manager.get_user(recipient)
+        if user is None:
+            return recipient
+        # Convert the unicode name to an email-safe representation.  Create a
+        # Header instance for the name so that it's properly encoded for
+        # email transport.
+        name = Header(user.display_name).encode()
+        return formataddr((name, recipient))
 
 
 @public
@@ -0,0 +1,194 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test bulk delivery."""
+
+import smtplib
+import unittest
+import threading
+
+from mailman.app.lifecycle import create_list
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.connection import Connection, ConnectionPool
+from mailman.mta.deliver import deliver
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import Mock, patch
+
+
+class TestParallelDelivery(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+""")
+        self._recipients = set(
+            'person{:02d}@example.{}'.format(i, tld)
+            for i, tld in enumerate(['com', 'org', 'net', 'edu'] * 5))
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _sendmail(self, connection, envsender, recipients, msgtext):
+        # Record the session and refuse the recipients at example.org.
+        with self._lock:
+            self._sessions.append((connection, envsender, set(recipients)))
+        return {recipient: (550, 'No such user')
+                for recipient in recipients
+                if recipient.endswith('.org')}
+
+    def test_parallel_chunks(self):
+        # Every chunk is delivered, over a bounded number of connections.
+        agent = BulkDelivery(3, 4)
+        with patch.object(Connection, 'sendmail', autospec=True,
+                          side_effect=self._sendmail):
+            refused = agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        # Each top level domain makes two chunks.
+        self.assertEqual(len(self._sessions), 8)
+        delivered = set()
+        for connection, envsender, recipients in self._sessions:
+            self.assertEqual(envsender, 'test-bounces@example.com')
+            self.assertLessEqual(len(recipients), 3)
+            delivered |= recipients
+        self.assertEqual(delivered, self._recipients)
+        self.assertLessEqual(
+            len(set(session[0] for session in self._sessions)), 4)
+        # The refusals of all the chunks are collected.
+        self.assertEqual(refused, {
+            recipient: (550, 'No such user')
+            for recipient in self._recipients
+            if recipient.endswith('.org')
+            })
+
+    def test_parallel_low_level_error(self):
+        # A chunk which fails to be delivered is refused as a whole, without
+        # affecting the other chunks.
+        def sendmail(connection, envsender, recipients, msgtext):
+            if any(recipient.endswith('.edu') for recipient in recipients):
+                raise smtplib.SMTPServerDisconnected('Oops')
+            return {}
+        agent = BulkDelivery(5, 2)
+        with patch.object(Connection, 'sendmail', autospec=True,
+                          side_effect=sendmail):
+            refused = agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {
+            recipient: (444, 'Oops')
+            for recipient in self._recipients
+            if recipient.endswith('.edu')
+            })
+
+    def test_serial(self):
+        # Without threads, all chunks go over the same connection.
+        agent = BulkDelivery(3)
+        with patch.object(Connection, 'sendmail', autospec=True,
+                          side_effect=self._sendmail):
+            agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(len(self._sessions), 8)
+        self.assertEqual(
+            len(set(session[0] for session in self._sessions)), 1)
+
+    @configuration('mta', max_sessions_per_connection=2)
+    def test_sessions_per_connection(self):
+        # Each pooled connection honors max_sessions_per_connection.
+        agent = BulkDelivery(3, 2)
+        self.assertIsInstance(agent._connection, ConnectionPool)
+        connects = []
+        def connect(connection):                    # noqa
+            connects.append(connection)
+            connection._connection = smtp = Mock()
+            smtp.sendmail.return_value = {}
+            connection._session_count = connection._sessions_per_connection
+        with patch.object(Connection, '_connect', autospec=True,
+                          side_effect=connect):
+            agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        # Eight sessions over two connections at a time need at least four
+        # connects, since each connection is closed after two sessions.
+        self.assertGreaterEqual(len(connects), 4)
+        self.assertLessEqual(len(set(connects)), 2)
+
+
+class TestRenderOnce(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+First line.
+Second line.
+""")
+        self._texts = []
+
+    def _sendmail(self, connection, envsender, recipients, msgtext):
+        self._texts.append(msgtext)
+        return {}
+
+    def test_flatten_once(self):
+        # The message is flattened once for all chunks, and for logging its
+        # size.
+        recipients = set('person{}@example.com'.format(i) for i in range(10))
+        with patch.object(self._msg, 'as_string',
+                          wraps=self._msg.as_string) as as_string, \
+                patch.object(Connection, 'sendmail', autospec=True,
+                             side_effect=self._sendmail), \
+                configuration('mta', max_recipients=2):
+            deliver(self._mlist, self._msg, dict(recipients=recipients))
+        self.assertEqual(as_string.call_count, 1)
+        self.assertEqual(len(self._texts), 5)
+        # The same buffer is sent to every chunk.
+        for text in self._texts:
+            self.assertIs(text, self._texts[0])
+
+    def test_crlf_bytes(self):
+        # The message is sent as bytes, with CRLF line endings.
+        agent = BulkDelivery()
+        with patch.object(Connection, 'sendmail', autospec=True,
+                          side_effect=self._sendmail):
+            agent.deliver(self._mlist, self._msg,
+                          dict(recipients=['bart@example.com']))
+        self.assertEqual(self._texts[0], b"""\
+From: anne@example.com\r
+To: test@example.com\r
+Subject: test\r
+Message-ID: <ant>\r
+\r
+First line.\r
+Second line.\r
+""")
+
+    def test_forget(self):
+        # A modified message must be forgotten before it is rendered again.
+        agent = BulkDelivery()
+        text = agent.render(self._msg)
+        self._msg['X-Extra'] = 'yes'
+        self.assertIs(agent.render(self._msg), text)
+        agent.forget()
+        self.assertIn(b'X-Extra: yes\r\n', agent.render(self._msg))
@@ -17,12 +17,16 @@
 
 """Test MTA connections."""
 
+import smtplib
 import unittest
+import threading
+import socketserver
 
 from mailman.config import config
 from mailman.mta.connection import Connection
-from mailman.testing.layers import SMTPLayer
+from mailman.testing.layers import ConfigLayer, SMTPLayer
 from smtplib import SMTPAuthenticationError
+from unittest.mock import patch
 
 
 class TestConnection(unittest.TestCase):
@@ -57,3 +61,139 @@ Subject: aardvarks
 """)
         self.assertEqual(self.layer.smtpd.get_authentication_credentials(),
                          'AHRlc3R1c2VyAHRlc3RwYXNz')
+
+
+class PipeliningHandler(socketserver.StreamRequestHandler):
+    # A minimal SMTP server which advertises PIPELINING, and refuses the
+    # recipients whose local part starts with "bad".
+    def _reply(self, text):
+        self.wfile.write(text.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        self._reply('220 localhost')
+        sender = recipients = None
+        while True:
+            line = self.rfile.readline().decode('ascii').rstrip('\r\n')
+            command = line[:4].upper()
+            if command == 'EHLO':
+                self._reply('250-localhost')
+                self._reply('250 PIPELINING')
+            elif command == 'MAIL':
+                if sender is not None:
+                    self._reply('503 Nested MAIL command')
+                else:
+                    sender, recipients = line[10:].strip('<>'), []
+                    self._reply('250 OK')
+            elif command == 'RCPT':
+                recipient = line[8:].strip('<>')
+                if sender is None:
+                    self._reply('503 Need MAIL command')
+                elif recipient.startswith('bad'):
+                    self._reply('550 No such user')
+                else:
+                    recipients.append(recipient)
+                    self._reply('250 OK')
+            elif command == 'DATA':
+                if not recipients:
+                    self._reply('554 No valid recipients')
+                    continue
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line == b'.\r\n':
+                        break
+                    lines.append(line)
+                server.messages.append(
+                    (sender, recipients, b''.join(lines)))
+                sender = recipients = None
+                self._reply('250 OK')
+            elif command == 'RSET':
+                sender = recipients = None
+                self._reply('250 OK')
+            else:
+                self._reply('221 Bye')
+                return
+
+
+class TestPipelining(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._server = socketserver.TCPServer(
+            ('127.0.0.1', 0), PipeliningHandler)
+        self._server.messages = []
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self._server.server_close)
+        self.addCleanup(self._server.shutdown)
+        self._port = self._server.server_address[1]
+
+    def _transactions(self, *recipients):
+        for recipient in recipients:
+            yield ('bounces+{}@example.com'.format(recipient.split('@')[0]),
+                   [recipient],
+                   'To: {}\r\n\r\n.dot\r\n'.format(recipient).encode())
+
+    def test_pipelining(self):
+        # All the messages are delivered, with one round trip each.
+        connection = Connection('127.0.0.1', self._port, 0)
+        with patch.object(smtplib.SMTP, 'send', autospec=True,
+                          side_effect=smtplib.SMTP.send) as send:
+            refused = connection.sendmany(self._transactions(
+                'anne@example.com', 'bart@example.com', 'cris@example.com'))
+        connection.quit()
+        self.assertEqual(refused, {})
+        self.assertEqual(self._server.messages, [
+            ('bounces+anne@example.com', ['anne@example.com'],
+             b'To: anne@example.com\r\n\r\n..dot\r\n'),
+            ('bounces+bart@example.com', ['bart@example.com'],
+             b'To: bart@example.com\r\n\r\n..dot\r\n'),
+            ('bounces+cris@example.com', ['cris@example.com'],
+             b'To: cris@example.com\r\n\r\n..dot\r\n'),
+            ])
+        # EHLO, three pipelined transactions and the content of the last.
+        self.assertEqual(send.call_count, 5)
+
+    def test_refused_recipients(self):
+        # Refused recipients are reported, and the messages after them are
+        # still delivered.
+        connection = Connection('127.0.0.1', self._port, 0)
+        refused = connection.sendmany(self._transactions(
+            'bad@example.com', 'anne@example.com', 'badder@example.com',
+            'bart@example.com'))
+        connection.quit()
+        self.assertEqual(refused, {
+            'bad@example.com': (550, b'No such user'),
+            'badder@example.com': (550, b'No such user'),
+            })
+        self.assertEqual(
+            [message[1] for message in self._server.messages],
+            [['anne@example.com'], ['bart@example.com']])
+
+    def test_sessions_per_connection(self):
+        # The connection is reopened after the maximum number of sessions.
+        connection = Connection('127.0.0.1', self._port, 2)
+        with patch.object(Connection, '_connect', autospec=True,
+                          side_effect=Connection._connect) as connect:
+            refused = connection.sendmany(self._transactions(
+                'anne@example.com', 'bart@example.com', 'cris@example.com'))
+        connection.quit()
+        self.assertEqual(refused, {})
+        self.assertEqual(len(self._server.messages), 3)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_connection_failure(self):
+        # When the server can't be reached, all the recipients are refused
+        # with a temporary failure.
+        self._server.shutdown()
+        self._server.server_close()
+        connection = Connection('127.0.0.1', self._port, 0)
+        refused = connection.sendmany(self._transactions(
+            'anne@example.com', 'bart@example.com'))
+        self.assertEqual(sorted(refused), [
+            'anne@example.com', 'bart@example.com'])
+        self.assertEqual(
+            set(code for code, response in refused.values()), {444})
@@ -18,21 +18,26 @@
 """Test various aspects of email delivery."""
 
 import os
+import re
 import shutil
 import tempfile
 import unittest
 
 from mailman.app.lifecycle import create_list
 from mailman.config import config
+from mailman.email.message import LazyMessage
 from mailman.interfaces.mailinglist import Personalization
+from mailman.mta.connection import Connection
 from mailman.mta.deliver import Deliver
 from mailman.testing.helpers import (
     specialized_message_from_string as mfs, subscribe)
 from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
 
 
 # Global test capture.
 _deliveries = []
+BOUNDARY_RE = re.compile(r'=+\d+==')
 
 
 # Derive this from the default individual delivery class.  The point being
@@ -126,3 +131,205 @@ name     : Anne Person
 options  : http://example.com/anne@example.org
 
 """)
+
+
+class RenderTester(Deliver):
+    def __init__(self, templates=True):
+        super().__init__()
+        self.rendered = {}
+        self.templated = set()
+        self._templates = templates
+
+    def _make_template(self, mlist, msg, msgdata):
+        if not self._templates:
+            return None
+        return super()._make_template(mlist, msg, msgdata)
+
+    def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
+        self.rendered[recipients[0]] = self.render(msg)
+        if isinstance(msg, LazyMessage):
+            self.templated.add(recipients[0])
+        return []
+
+
+class TestTemplateDelivery(unittest.TestCase):
+    """Test personalized delivery from a rendered template."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.personalize = Personalization.full
+        subscribe(self._mlist, 'Anne', email='anne@example.org')
+        subscribe(self._mlist, 'Bart', email='bart@example.org')
+        self._recipients = ['anne@example.org', 'bart@example.org',
+                            'cris@example.org']
+        self._template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._template_dir)
+        config.push('templates', """
+        [paths.testing]
+        template_dir: {0}
+        """.format(self._template_dir))
+        self.addCleanup(config.pop, 'templates')
+        self._add_template('member-header.txt', 'Hello $user_name')
+        self._add_template('member-footer.txt', """\
+address: $user_address
+list: $display_name
+""")
+        self._mlist.header_uri = 'mailman:///member-header.txt'
+        self._mlist.footer_uri = 'mailman:///member-footer.txt'
+        self.maxDiff = None
+
+    def _add_template(self, name, text):
+        path = os.path.join(self._template_dir, 'site', 'en', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            print(text, file=fp)
+
+    def _deliver(self, msg, templates):
+        agent = RenderTester(templates)
+        msgdata = dict(recipients=list(self._recipients))
+        agent.deliver(self._mlist, msg, msgdata)
+        self.assertEqual(sorted(agent.rendered), self._recipients)
+        return agent
+
+    def _assert_same(self, text, templated=True):
+        # Delivering from a template gives the same bytes as crafting the
+        # message for each recipient.
+        slow = self._deliver(mfs(text), False).rendered
+        agent = self._deliver(mfs(text), True)
+        fast = agent.rendered
+        self.assertEqual(agent.templated,
+                         set(self._recipients) if templated else set())
+        for recipient in self._recipients:
+            # Each crafted message gets its own MIME boundary.
+            self.assertMultiLineEqual(
+                BOUNDARY_RE.sub('BOUNDARY', fast[recipient].decode('ascii')),
+                BOUNDARY_RE.sub('BOUNDARY', slow[recipient].decode('ascii')))
+        return fast
+
+    def test_plain_text(self):
+        rendered = self._assert_same("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A message.
+""")
+        anne = rendered['anne@example.org'].decode('ascii')
+        self.assertIn('To: Anne Person <anne@example.org>\r\n', anne)
+        self.assertIn('Hello Anne Person\r\n', anne)
+        self.assertIn('address: anne@example.org\r\n', anne)
+        cris = rendered['cris@example.org'].decode('ascii')
+        self.assertIn('To: cris@example.org\r\n', cris)
+
+    def test_multipart(self):
+        self._assert_same("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+A message.
+--BOUNDARY
+Content-Type: image/png
+Content-Transfer-Encoding: base64
+
+aGVsbG8=
+--BOUNDARY--
+""")
+
+    def test_html(self):
+        self._assert_same("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+MIME-Version: 1.0
+Content-Type: text/html
+
+<p>A message.</p>
+""")
+
+    def test_duplicates(self):
+        # Recipients asking for the X-Mailman-Copy header get it.
+        self._mlist.personalize = Personalization.individual
+        msg = """\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A message.
+"""
+        agent = RenderTester()
+        msgdata = dict(recipients=list(self._recipients),
+                       **{'add-dup-header': {'bart@example.org'}})
+        agent.deliver(self._mlist, mfs(msg), msgdata)
+        self.assertIn(b'X-Mailman-Copy: yes\r\n',
+                      agent.rendered['bart@example.org'])
+        self.assertNotIn(b'X-Mailman-Copy',
+                         agent.rendered['anne@example.org'])
+
+    def test_non_ascii_footer(self):
+        # Non-ASCII decorations fall back to crafting each message.
+        self._add_template('member-footer.txt', 'Grüße $user_address')
+        self._assert_same("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A message.
+""", templated=False)
+
+
+class TestPipelinedDelivery(unittest.TestCase):
+    """Test pipelined individual delivery."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A message.
+""")
+        self._transactions = []
+
+    def _sendmany(self, connection, transactions):
+        self._transactions.extend(transactions)
+        return {'bart@example.net': (550, b'No such user')}
+
+    def test_grouped_by_domain(self):
+        # The VERPed messages are sent over the connection in one go, grouped
+        # by the domain of their recipients.
+        recipients = {'anne@example.org', 'bart@example.net',
+                      'cris@example.org', 'dave@EXAMPLE.net'}
+        msgdata = dict(recipients=recipients, verp=True)
+        agent = Deliver(pipelining=True)
+        with patch.object(Connection, 'sendmany', autospec=True,
+                          side_effect=self._sendmany):
+            refused = agent.deliver(self._mlist, self._msg, msgdata)
+        self.assertEqual(refused, {'bart@example.net': (550, b'No such user')})
+        self.assertEqual(len(self._transactions), 4)
+        domains = [transaction[1][0].rpartition('@')[2].lower()
+                   for transaction in self._transactions]
+        self.assertEqual(domains, sorted(domains))
+        for envsender, recipients, msgtext in self._transactions:
+            self.assertEqual(len(recipients), 1)
+            local_part, domain = recipients[0].split('@')
+            self.assertEqual(
+                envsender,
+                'test-bounces+{}={}@example.com'.format(local_part, domain))
+            self.assertIn(b'\r\nA message.\r\n', msgtext)
@@ -21,7 +21,7 @@ import logging
 
 from mailman import public
 from mailman.config import config
-from mailman.mta.base import IndividualDelivery
+from mailman.mta.base import IndividualDelivery, make_marker
 from mailman.utilities.email import split_email
 from mailman.utilities.string import expand
 
@@ -84,6 +84,17 @@ class VERPMixin:
         if recipient in msgdata.get('add-dup-header', {}):
             msg['X-Mailman-Copy'] = 'yes'
 
+    def avoid_duplicates_template(self, mlist, msg, msgdata):
+        """See `avoid_duplicates()` and `IndividualDelivery`."""
+        marker = make_marker()
+        del msg['x-mailman-copy']
+        msg['X-Mailman-Copy'] = marker
+        def stamp(msgdata):                         # noqa
+            if msgdata['recipient'] in msgdata.get('add-dup-header', {}):
+                return 'X-Mailman-Copy: yes\n'
+            return ''
+        return [('X-Mailman-Copy: {}\n'.format(marker), stamp)]
+
 
 @public
 class VERPDelivery(VERPMixin, IndividualDelivery):
@@ -26,7 +26,6 @@ from enum import Enum
 from lazr.config import as_boolean
 from mailman import public
 from mailman.config import config
-from pprint import pformat
 
 
 class ExtendedEncoder(json.JSONEncoder):
@@ -49,32 +48,46 @@ class ExtendedEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def _tag(resource):
+    # Calculate the tag from a predictable (i.e. key-sorted and compact) JSON
+    # representation of the dictionary.  The actual details aren't so
+    # important, but the JSON encoder is much faster than pretty-printing.
+    assert 'http_etag' not in resource, 'Resource already etagged'
+    hashfood = json.dumps(resource, cls=ExtendedEncoder, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha1(hashfood).hexdigest()
+    resource['http_etag'] = '"{}"'.format(etag)
+
+
+class _Representation(str):
+    # The JSON representation of a resource, which remembers its etag, so
+    # that it can be sent in the ETag header.
+    etag = None
+
+
 @public
 def etag(resource):
     """Calculate the etag and return a JSON representation.
 
     The input is a dictionary representing the resource.  This
     dictionary must not contain an `http_etag` key.  This function
-    calculates the etag by using the sha1 hexdigest of the
-    pretty-printed (and thus key-sorted and predictable) representation
-    of the dictionary.  It then inserts this value under the `http_etag`
-    key, and returns the JSON representation of the modified dictionary.
+    calculates the etag by using the sha1 hexdigest of the key-sorted
+    and thus predictable JSON representation of the dictionary.  It
+    then inserts this value under the `http_etag` key, and returns the
+    JSON representation of the modified dictionary.
 
     :param resource: The original resource representation.
     :type resource: dictionary
-    :return: JSON representation of the modified dictionary.
+    :return: JSON representation of the modified dictionary, with the etag
+        in its `etag` attribute.
     :rtype string
     """
-    assert 'http_etag' not in resource, 'Resource already etagged'
-    # Calculate the tag from a predictable (i.e. sorted) representation of the
-    # dictionary.  The actual details aren't so important.  pformat() is
-    # guaranteed to sort the keys, however it returns a str and the hash
-    # library requires a bytes.  Use the safest possible encoding.
-    hashfood = pformat(resource).encode('raw-unicode-escape')
-    etag = hashlib.sha1(hashfood).hexdigest()
-    resource['http_etag'] = '"{}"'.format(etag)
-    return json.dumps(resource, cls=ExtendedEncoder,
-                      sort_keys=as_boolean(config.devmode.enabled))
+    _tag(resource)
+    representation = _Representation(json.dumps(
+        resource, cls=ExtendedEncoder,
+        sort_keys=as_boolean(config.devmode.enabled)))
+    representation.etag = resource['http_etag']
+    return representation
 
 
 @public
@@ -141,7 +154,8 @@ class CollectionMixin:
                        for resource in collection]
             assert None not in entries, entries
             # Tag the resources but use the dictionaries.
-            [etag(resource) for resource in entries]
+            for resource in entries:
+                _tag(resource)
             # Create the collection resource
             result['entries'] = entries
         return result
@@ -253,6 +267,8 @@ def okay(response, body=None):
     response.status = falcon.HTTP_200
     if body is not None:
         response.body = body
+        # Representations returned by etag() carry their etag along.
+        response.etag = getattr(body, 'etag', None)
 
 
 @public
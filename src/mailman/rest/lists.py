@@ -17,19 +17,23 @@
 
 """REST for mailing lists."""
 
+from email.utils import parseaddr
 from lazr.config import as_boolean
 from mailman import public
 from mailman.app.digests import (
     bump_digest_number_and_volume, maybe_send_digest_now)
 from mailman.app.lifecycle import create_list, remove_list
 from mailman.config import config
+from mailman.interfaces.address import InvalidEmailAddressError
 from mailman.interfaces.domain import BadDomainSpecificationError
 from mailman.interfaces.listmanager import (
     IListManager, ListAlreadyExistsError)
 from mailman.interfaces.mailinglist import IListArchiverSet
-from mailman.interfaces.member import MemberRole
+from mailman.interfaces.member import (
+    AlreadySubscribedError, DeliveryMode, MemberRole, MembershipIsBannedError)
 from mailman.interfaces.styles import IStyleManager
-from mailman.interfaces.subscriptions import ISubscriptionService
+from mailman.interfaces.subscriptions import (
+    ISubscriptionService, RequestRecord)
 from mailman.rest.bans import BannedEmails
 from mailman.rest.header_matches import HeaderMatches
 from mailman.rest.helpers import (
@@ -39,7 +43,8 @@ from mailman.rest.listconf import ListConfiguration
 from mailman.rest.members import AMember, MemberCollection
 from mailman.rest.post_moderation import HeldMessages
 from mailman.rest.sub_moderation import SubscriptionRequests
-from mailman.rest.validator import Validator, list_of_strings_validator
+from mailman.rest.validator import (
+    Validator, enum_validator, language_validator, list_of_strings_validator)
 from zope.component import getUtility
 
 
@@ -248,6 +253,39 @@ class MembersOfList(MemberCollection):
             list_id=self._mlist.list_id,
             role=self._role)
 
+    def on_post(self, request, response):
+        """Subscribe a batch of addresses to the named mailing list."""
+        try:
+            validator = Validator(
+                emails=list_of_strings_validator,
+                delivery_mode=enum_validator(DeliveryMode),
+                language=language_validator,
+                _optional=('delivery_mode', 'language'))
+            arguments = validator(request)
+        except ValueError as error:
+            bad_request(response, str(error))
+            return
+        delivery_mode = arguments.pop('delivery_mode', DeliveryMode.regular)
+        language = arguments.pop('language', self._mlist.preferred_language)
+        records = (
+            RequestRecord(email, display_name, delivery_mode, language.code)
+            for display_name, email in map(parseaddr, arguments.pop('emails')))
+        results = getUtility(ISubscriptionService).subscribe_members(
+            self._mlist.list_id, records, self._role)
+        # Report the outcome of every address, in the order they were given.
+        entries = []
+        for record, result in results:
+            if isinstance(result, AlreadySubscribedError):
+                outcome = 'Already subscribed'
+            elif isinstance(result, MembershipIsBannedError):
+                outcome = 'Banned address'
+            elif isinstance(result, InvalidEmailAddressError):
+                outcome = 'Invalid email address'
+            else:
+                outcome = True
+            entries.append(dict(email=record.email, outcome=outcome))
+        okay(response, etag(dict(entries=entries)))
+
     def on_delete(self, request, response):
         """Delete the members of the named mailing list."""
         status = {}
@@ -76,7 +76,7 @@ class _MemberBase(CollectionMixin):
 
     def _get_collection(self, request):
         """See `CollectionMixin`."""
-        return list(getUtility(ISubscriptionService))
+        return getUtility(ISubscriptionService).get_members()
 
 
 @public
@@ -61,6 +61,13 @@ class TestHelpers(unittest.TestCase):
         helpers.forbidden(response, body=None)
         self.assertEqual(response.body, 'not set')
 
+    def test_okay_etag(self):
+        # The etag of a representation is sent along with it.
+        response = FakeResponse()
+        resource = dict(name='ant')
+        helpers.okay(response, helpers.etag(resource))
+        self.assertEqual(response.etag, resource['http_etag'])
+
     def test_json_encoding_datetime_seconds(self):
         resource = dict(interval=timedelta(seconds=2))
         unjson = eval(helpers.etag(resource))
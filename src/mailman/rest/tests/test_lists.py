@@ -23,6 +23,7 @@ from datetime import timedelta
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.database.transaction import transaction
+from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.digests import DigestFrequency
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.mailinglist import IAcceptableAliasSet
@@ -319,6 +320,65 @@ class TestLists(unittest.TestCase):
         self.assertEqual(cm.exception.code, 400)
         self.assertEqual(cm.exception.reason, b'Missing parameters: emails')
 
+    def test_list_mass_subscribe_owners(self):
+        # Any roster can be subscribed to in bulk.
+        resource, response = call_api(
+            'http://localhost:9001/3.0/lists/test.example.com'
+            '/roster/owner', {
+                'emails': ['aperson@example.com',
+                           'Bart Person <bperson@example.com>',
+                           'aperson@example.com',
+                           ],
+                'language': 'fr',
+                })
+        self.assertEqual(response.status, 200)
+        # Remove variable data.
+        resource.pop('http_etag')
+        # Every address gets an outcome, in order, even one given twice.
+        self.assertEqual(resource, {'entries': [
+            {'email': 'aperson@example.com', 'outcome': True},
+            {'email': 'bperson@example.com', 'outcome': True},
+            {'email': 'aperson@example.com', 'outcome': 'Already subscribed'},
+            ]})
+        owners = self._mlist.owners
+        self.assertEqual(
+            sorted(address.email for address in owners.addresses),
+            ['aperson@example.com', 'bperson@example.com'])
+        bart = owners.get_member('bperson@example.com')
+        self.assertEqual(bart.address.display_name, 'Bart Person')
+        self.assertEqual(bart.preferred_language.code, 'fr')
+        self.assertEqual(self._mlist.members.member_count, 0)
+
+    def test_list_mass_subscribe_banned(self):
+        with transaction():
+            IBanManager(self._mlist).ban('aperson@example.com')
+        resource, response = call_api(
+            'http://localhost:9001/3.0/lists/test.example.com'
+            '/roster/member', {
+                'emails': ['aperson@example.com'],
+                })
+        self.assertEqual(resource['entries'], [
+            {'email': 'aperson@example.com', 'outcome': 'Banned address'},
+            ])
+        self.assertEqual(self._mlist.members.member_count, 0)
+
+    def test_list_mass_subscribe_bad_language(self):
+        with self.assertRaises(HTTPError) as cm:
+            call_api('http://localhost:9001/3.0/lists/test.example.com'
+                     '/roster/member', {
+                         'emails': ['aperson@example.com'],
+                         'language': 'xx',
+                         })
+        self.assertEqual(cm.exception.code, 400)
+
+    def test_list_mass_subscribe_with_no_data(self):
+        with self.assertRaises(HTTPError) as cm:
+            call_api('http://localhost:9001/3.0/lists/test.example.com'
+                     '/roster/member',
+                     {}, 'POST')
+        self.assertEqual(cm.exception.code, 400)
+        self.assertEqual(cm.exception.reason, b'Missing parameters: emails')
+
 
 class TestListArchivers(unittest.TestCase):
     """Test corner cases for list archivers."""
@@ -0,0 +1,164 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the REST server."""
+
+import unittest
+import threading
+
+from http.client import HTTPConnection
+from mailman.config import config
+from mailman.testing.helpers import LogFileMark
+from mailman.testing.layers import ConfigLayer
+
+
+def make_server(**kws):
+    # The REST application cannot be imported before the configuration has
+    # been loaded.
+    from mailman.rest.wsgiapp import make_server
+    return make_server(**kws)
+
+
+def simple_app(environ, start_response):
+    body = b'ok'
+    start_response('200 OK', [
+        ('Content-Type', 'text/plain'),
+        ('Content-Length', str(len(body))),
+        ])
+    return [body]
+
+
+class TestServer(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        # Let the operating system pick a free port.
+        config.push('any port', """
+        [webservice]
+        port: 0
+        """)
+        self.addCleanup(config.pop, 'any port')
+
+    def _serve(self, server):
+        # Serve requests in a thread, with a trivial application which does
+        # not need the database.
+        server.set_app(simple_app)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def stop():                                 # noqa
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        host, port = server.server_address
+        connection = HTTPConnection(host, port)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_connection_closed(self):
+        # By default, the server closes the connection after every request.
+        connection = self._serve(make_server())
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.version, 10)
+        self.assertEqual(response.read(), b'ok')
+        self.assertIsNone(connection.sock)
+
+    def test_keepalive(self):
+        # The connection can be kept open between requests.
+        config.push('keepalive', """
+        [webservice]
+        keepalive: 10s
+        """)
+        self.addCleanup(config.pop, 'keepalive')
+        connection = self._serve(make_server())
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.version, 11)
+        self.assertEqual(response.read(), b'ok')
+        sock = connection.sock
+        self.assertIsNotNone(sock)
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.read(), b'ok')
+        # The second request was sent over the same connection.
+        self.assertIs(connection.sock, sock)
+
+    def test_idle_connection_gives_way(self):
+        # Each server only serves one connection at a time, so an idle
+        # persistent connection is closed when another client connects.
+        config.push('keepalive', """
+        [webservice]
+        keepalive: 10s
+        """)
+        self.addCleanup(config.pop, 'keepalive')
+        server = make_server()
+        connection = self._serve(server)
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        self.assertEqual(response.read(), b'ok')
+        host, port = server.server_address
+        other = HTTPConnection(host, port, timeout=5)
+        self.addCleanup(other.close)
+        other.request('GET', '/')
+        response = other.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.read(), b'ok')
+        # The first connection was closed by the server.
+        connection.sock.settimeout(5)
+        self.assertEqual(connection.sock.recv(1), b'')
+
+    def test_request_duration_logged(self):
+        # The log entry for the request includes the time it took.
+        mark = LogFileMark('mailman.http')
+        server = make_server()
+        connection = self._serve(server)
+        connection.request('GET', '/')
+        connection.getresponse().read()
+        # The request is logged after the response is sent, so wait until
+        # the server is done with it.
+        server.shutdown()
+        self.assertRegex(mark.read(), r'"GET / HTTP/1.1" 200 2 \d+\.\d{3}s')
+
+    def test_reuse_port(self):
+        # Several servers can listen on the same port when they are told to.
+        server = make_server(reuse_port=True)
+        self.addCleanup(server.server_close)
+        host, port = server.server_address
+        config.push('same port', """
+        [webservice]
+        port: {}
+        """.format(port))
+        self.addCleanup(config.pop, 'same port')
+        other = make_server(reuse_port=True)
+        self.addCleanup(other.server_close)
+        self.assertEqual(other.server_address, (host, port))
+
+    def test_port_in_use(self):
+        # Otherwise, the port can only be used by one server.
+        server = make_server()
+        self.addCleanup(server.server_close)
+        host, port = server.server_address
+        config.push('same port', """
+        [webservice]
+        port: {}
+        """.format(port))
+        self.addCleanup(config.pop, 'same port')
+        self.assertRaises(OSError, make_server)
@@ -18,17 +18,22 @@
 """Basic WSGI Application object for REST server."""
 
 import re
+import time
+import select
+import socket
 import logging
 
 from base64 import b64decode
-from falcon import API, HTTPUnauthorized
+from datetime import timedelta
+from falcon import API, HTTP_200, HTTP_304, HTTPUnauthorized
 from falcon.routing import create_http_method_map
+from lazr.config import as_timedelta
 from mailman import public
 from mailman.config import config
 from mailman.database.transaction import transactional
 from mailman.rest.root import Root
 from wsgiref.simple_server import (
-    WSGIRequestHandler, WSGIServer, make_server as wsgi_server)
+    ServerHandler, WSGIRequestHandler, WSGIServer)
 
 
 log = logging.getLogger('mailman.http')
@@ -42,6 +47,19 @@ REALM = 'mailman3-rest'
 class AdminWSGIServer(WSGIServer):
     """Server class that integrates error handling with our log files."""
 
+    def __init__(self, *args, reuse_port=False, **kws):
+        # Whether other processes may listen on the same port.  When several
+        # REST runners are started, the kernel spreads the connections among
+        # them.
+        self.reuse_port = reuse_port
+        super().__init__(*args, **kws)
+
+    def server_bind(self):
+        """See `TCPServer`."""
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
     def handle_error(self, request, client_address):
         # Interpose base class method so that the exception gets printed to
         # our log file rather than stderr.
@@ -62,9 +80,75 @@ class StderrLogger:
         self._buffer = []
 
 
+class AdminServerHandler(ServerHandler):
+    """Request handler which speaks the protocol of the server."""
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        # Without a content length, the client can only tell where the
+        # response ends by the connection being closed.
+        if 'Content-Length' not in self.headers:
+            self.request_handler.close_connection = True
+
+
 class AdminWebServiceWSGIRequestHandler(WSGIRequestHandler):
     """Handler class which just logs output to the right place."""
 
+    def handle(self):
+        """See `WSGIRequestHandler`."""
+        # The base class handles a single request per connection.  When
+        # persistent connections are enabled, keep handling the requests on
+        # this connection until the client closes it, or it stays idle for
+        # too long.  This process only serves one connection at a time, so
+        # the connection is also closed when another client is waiting to be
+        # served, once the request the client may already have sent is done.
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            readable, writable, errors = select.select(
+                [self.connection, self.server.socket], [], [], self.timeout)
+            if self.connection not in readable:
+                break
+            self.handle_one_request()
+            if self.server.socket in readable:
+                break
+
+    def handle_one_request(self):
+        """See `BaseHTTPRequestHandler`."""
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            # The persistent connection has been idle for too long.
+            self.close_connection = True
+            return
+        self.start_time = time.time()
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            # The client closed the connection.
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            # An error code has been sent, just exit.
+            return
+        handler = AdminServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=False)
+        handler.http_version = self.protocol_version.split('/')[1]
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_request(self, code='-', size='-'):
+        """See `BaseHTTPRequestHandler`."""
+        # Include the time it took to handle the request.
+        duration = time.time() - self.start_time
+        self.log_message('"%s" %s %s %.3fs',
+                         self.requestline, code, size, duration)
+
     def log_message(self, format, *args):
         """See `BaseHTTPRequestHandler`."""
         log.info('%s - - %s', self.address_string(), format % args)
@@ -75,12 +159,25 @@ class AdminWebServiceWSGIRequestHandler(WSGIRequestHandler):
         return StderrLogger()
 
 
+class PersistentWSGIRequestHandler(AdminWebServiceWSGIRequestHandler):
+    """Handler class which keeps the connections open between requests."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """See `StreamRequestHandler`."""
+        # Idle connections are closed after this many seconds.
+        self.timeout = as_timedelta(
+            config.webservice.keepalive).total_seconds()
+        super().setup()
+
+
 class Middleware:
     """Falcon middleware object for Mailman's REST API.
 
-    This does two things.  It sets the API version on the resource
-    object, and it verifies that the proper authentication has been
-    performed.
+    This does three things.  It sets the API version on the resource
+    object, it verifies that the proper authentication has been
+    performed, and it answers conditional GETs.
     """
     def process_resource(self, request, response, resource, params):
         # Set this attribute on the resource right before it is dispatched to.
@@ -104,6 +201,24 @@ class Middleware:
                 'REST API authorization failed',
                 challenges=['Basic realm=Mailman3'])
 
+    def process_response(self, request, response, resource):
+        # When the client already has the current version of the resource,
+        # as identified by the etag sent in the ETag header, tell it so
+        # instead of sending the resource again.
+        if_none_match = request.get_header('If-None-Match')
+        etag = response.etag
+        if (if_none_match is None or etag is None or
+                request.method != 'GET' or response.status != HTTP_200):
+            return
+        # GETs use the weak comparison, so weak etags match too.
+        etags = set()
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            etags.add(tag[2:] if tag.startswith('W/') else tag)
+        if etag in etags or '*' in etags:
+            response.status = HTTP_304
+            response.body = None
+
 
 class ObjectRouter:
     def __init__(self, root):
@@ -219,15 +334,22 @@ def make_application():
 
 
 @public
-def make_server():
+def make_server(reuse_port=False):
     """Create the Mailman REST server.
 
     Use this if you just want to run Mailman's wsgiref-based REST server.
+
+    :param reuse_port: Whether other processes may serve requests on the same
+        port, so that several servers can share the load.
+    :type reuse_port: bool
     """
     host = config.webservice.hostname
     port = int(config.webservice.port)
-    server = wsgi_server(
-        host, port, make_application(),
-        server_class=AdminWSGIServer,
-        handler_class=AdminWebServiceWSGIRequestHandler)
+    if as_timedelta(config.webservice.keepalive) > timedelta(0):
+        handler_class = PersistentWSGIRequestHandler
+    else:
+        handler_class = AdminWebServiceWSGIRequestHandler
+    server = AdminWSGIServer(
+        (host, port), handler_class, reuse_port=reuse_port)
+    server.set_app(make_application())
     return server
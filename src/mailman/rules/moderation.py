@@ -17,8 +17,6 @@
 
 """Membership related rules."""
 
-import re
-
 from mailman import public
 from mailman.core.i18n import _
 from mailman.interfaces.action import Action
@@ -26,6 +24,7 @@ from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.member import MemberRole
 from mailman.interfaces.rules import IRule
 from mailman.interfaces.usermanager import IUserManager
+from mailman.utilities.patterns import compile_patterns
 from zope.component import getUtility
 from zope.interface import implementer
 
@@ -66,10 +65,9 @@ class MemberModeration:
         """See `IRule`."""
         # The MemberModeration rule misses unconditionally if any of the
         # senders are banned.
-        ban_manager = IBanManager(mlist)
-        for sender in msg.senders:
-            if ban_manager.is_banned(sender):
-                return False
+        senders = msg.senders
+        if IBanManager(mlist).is_banned_many(senders):
+            return False
         member = _find_sender_member(mlist, msg)
         if member is None:
             return False
@@ -83,7 +81,7 @@ class MemberModeration:
             # We must stringify the moderation action so that it can be
             # stored in the pending request table.
             msgdata['moderation_action'] = action.name
-            msgdata['moderation_sender'] = sender
+            msgdata['moderation_sender'] = senders[-1]
             msgdata.setdefault('moderation_reasons', []).append(
                 # This will get translated at the point of use.
                 'The message comes from a moderated member')
@@ -92,6 +90,47 @@ class MemberModeration:
         return False
 
 
+# The legacy nonmember lists, in the order they are checked.
+NONMEMBER_ACTIONS = ('accept', 'hold', 'reject', 'discard')
+
+
+class _NonmemberMatcher:
+    """The legacy '*_these_nonmembers' lists of a mailing list."""
+
+    def __init__(self, checklists):
+        self._checklists = []
+        for action, checklist in zip(NONMEMBER_ACTIONS, checklists):
+            addresses = set(checklist)
+            patterns = compile_patterns(
+                addr for addr in addresses if addr.startswith('^'))
+            self._checklists.append((action, addresses, patterns))
+
+    def match(self, sender):
+        """Return the first action whose list matches the sender, or None."""
+        for action, addresses, patterns in self._checklists:
+            if sender in addresses or any(
+                    pattern.match(sender) is not None for pattern in patterns):
+                return action
+        return None
+
+
+# The nonmember matchers of this process, keyed by list-id.  Each is stored
+# with the lists it was built from, so that it is rebuilt when they change.
+_nonmember_matchers = {}
+
+
+def _get_nonmember_matcher(mlist):
+    checklists = tuple(
+        tuple(getattr(mlist, '{}_these_nonmembers'.format(action)))
+        for action in NONMEMBER_ACTIONS)
+    cached_checklists, matcher = _nonmember_matchers.get(
+        mlist.list_id, (None, None))
+    if cached_checklists != checklists:
+        matcher = _NonmemberMatcher(checklists)
+        _nonmember_matchers[mlist.list_id] = (checklists, matcher)
+    return matcher
+
+
 def _record_action(msgdata, action, sender, reason):
     msgdata['moderation_action'] = action
     msgdata['moderation_sender'] = sender
@@ -109,13 +148,11 @@ class NonmemberModeration:
 
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
-        ban_manager = IBanManager(mlist)
         user_manager = getUtility(IUserManager)
         # The NonmemberModeration rule misses unconditionally if any of the
         # senders are banned.
-        for sender in msg.senders:
-            if ban_manager.is_banned(sender):
-                return False
+        if IBanManager(mlist).is_banned_many(msg.senders):
+            return False
         # Every sender email must be a member or nonmember directly.  If it is
         # neither, make the email a nonmembers.
         for sender in msg.senders:
@@ -133,6 +170,7 @@ class NonmemberModeration:
         if member is not None:
             return False
         # Do nonmember moderation check.
+        matcher = _get_nonmember_matcher(mlist)
         for sender in msg.senders:
             nonmember = mlist.nonmembers.get_member(sender)
             assert nonmember is not None, (
@@ -140,17 +178,13 @@ class NonmemberModeration:
             # Check the '*_these_nonmembers' properties first.  XXX These are
             # legacy attributes from MM2.1; their database type is 'pickle' and
             # they should eventually get replaced.
-            for action in ('accept', 'hold', 'reject', 'discard'):
-                legacy_attribute_name = '{}_these_nonmembers'.format(action)
-                checklist = getattr(mlist, legacy_attribute_name)
-                for addr in checklist:
-                    if ((addr.startswith('^') and re.match(addr, sender))
-                            or addr == sender):     # noqa
-                        # The reason will get translated at the point of use.
-                        reason = 'The sender is in the nonmember {} list'
-                        _record_action(msgdata, action, sender,
-                                       reason.format(action))
-                        return True
+            action = matcher.match(sender)
+            if action is not None:
+                # The reason will get translated at the point of use.
+                reason = 'The sender is in the nonmember {} list'
+                _record_action(msgdata, action, sender,
+                               reason.format(action))
+                return True
             action = (mlist.default_nonmember_action
                       if nonmember.moderation_action is None
                       else nonmember.moderation_action)
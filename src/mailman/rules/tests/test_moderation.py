@@ -147,6 +147,38 @@ A message body.
                 msgdata['moderation_action'], action_name,
                 'Wrong action for {}: {}'.format(address, action_name))
 
+    def test_these_nonmembers_first_action_wins(self):
+        # The legacy lists are checked in order, and the first one with a
+        # matching address or pattern wins.  Changes to the lists are seen
+        # by the next check.
+        user_manager = getUtility(IUserManager)
+        user_manager.create_address('anne@example.com')
+        self._mlist.hold_these_nonmembers = [
+            '^bart@', '^.*@example.com$', '^cris@']
+        self._mlist.reject_these_nonmembers = ['anne@example.com']
+        rule = moderation.NonmemberModeration()
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: A test message
+Message-ID: <ant>
+MIME-Version: 1.0
+
+A message body.
+""")
+        msgdata = {}
+        self.assertTrue(rule.check(self._mlist, msg, msgdata))
+        self.assertEqual(msgdata['moderation_action'], 'hold')
+        self._mlist.accept_these_nonmembers = ['^anne@']
+        msgdata = {}
+        self.assertTrue(rule.check(self._mlist, msg, msgdata))
+        self.assertEqual(msgdata['moderation_action'], 'accept')
+        self._mlist.accept_these_nonmembers = []
+        self._mlist.hold_these_nonmembers = []
+        msgdata = {}
+        self.assertTrue(rule.check(self._mlist, msg, msgdata))
+        self.assertEqual(msgdata['moderation_action'], 'reject')
+
     def test_nonmember_fallback_to_list_defaults(self):
         # https://gitlab.com/mailman/mailman/issues/189
         self._mlist.default_nonmember_action = Action.hold
@@ -15,31 +15,154 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Digest runner."""
+"""Digest runner.
+
+The digests are built in a single pass over the messages.  Usually, the parts
+of the digests each message makes up were rendered and journaled when the
+message was posted; otherwise the messages are read from the digest mailbox
+and rendered one at a time.  The table of contents entries are collected in
+memory, while the parts are written to a spool file for each of the digest
+formats.  Once all the messages have been seen, each digest is assembled in a
+file of its own and queued as a memory mapped message, so neither the
+messages nor the digests are ever held in memory all at once.
+"""
 
 import re
+import mmap
+import time
+import codecs
 import logging
+import tempfile
 
-from copy import deepcopy
+from email.charset import BASE64, QP, Charset
+from email.generator import Generator
 from email.header import Header
-from email.mime.message import MIMEMessage
 from email.mime.text import MIMEText
-from email.utils import formatdate, getaddresses, make_msgid
+from datetime import datetime
+from email.utils import formatdate, make_msgid
+from functools import partial
 from io import StringIO
+from itertools import chain
 from mailman import public
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.runner import Runner
-from mailman.email.message import Message, MultipartDigestMessage
+from mailman.email.message import (
+    LazyMessage, Message, MultipartDigestMessage)
 from mailman.handlers.decorate import decorate
 from mailman.interfaces.member import DeliveryMode, DeliveryStatus
 from mailman.utilities.i18n import make
 from mailman.utilities.mailbox import Mailbox
-from mailman.utilities.string import oneline, wrap
+from mailman.utilities.string import wrap
 from urllib.error import URLError
 
 
 log = logging.getLogger('mailman.error')
+rlog = logging.getLogger('mailman.runner')
+
+# The number of bytes or characters to read from a spool file at a time.
+BLOCK_SIZE = 65536
+
+NEWLINES = re.compile(rb'\r\n?')
+
+
+def _spool(mode='w+b', **kws):
+    # The spool files live in the digest queue's directory, but have no
+    # names, so they disappear once they are closed.
+    return tempfile.TemporaryFile(
+        mode, dir=config.switchboards['digest'].queue_directory, **kws)
+
+
+def _map(fp):
+    # Turn an assembled digest into a message which is only parsed when it
+    # is used.  The memory map stays valid after the file is closed.
+    fp.flush()
+    with fp:
+        raw = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return LazyMessage(raw)
+
+
+def _contains(fp, data):
+    # Search the spool file for the bytes, one block at a time.
+    fp.seek(0)
+    tail = b''
+    try:
+        for block in iter(partial(fp.read, BLOCK_SIZE), b''):
+            window = tail + block
+            if data in window:
+                return True
+            tail = window[1 - len(data):]
+        return False
+    finally:
+        fp.seek(0, 2)
+
+
+def _body_encode(blocks, charset):
+    # Encode the blocks of text for transfer in the character set.  The
+    # blocks are cut into pieces which encode the same on their own as they
+    # would as part of the whole text, i.e. whole lines for quoted-printable
+    # and whole lines of 57 bytes for base64.
+    encoder = codecs.getincrementalencoder(charset.output_charset)()
+    pending = b''
+    for text in chain(blocks, [None]):
+        if text is None:
+            data = pending + encoder.encode('', final=True)
+            end = len(data)
+        else:
+            data = pending + encoder.encode(text)
+            if charset.body_encoding is QP:
+                end = data.rfind(b'\n') + 1
+            elif charset.body_encoding is BASE64:
+                end = len(data) - len(data) % 57
+            else:
+                # The carriage return may be the first half of a CRLF.
+                end = len(data) - data.endswith(b'\r')
+        pending = data[end:]
+        encoded = charset.body_encode(data[:end])
+        if isinstance(encoded, str):
+            yield encoded.encode('ascii')
+        else:
+            # Like the generator, write all the line endings of text which
+            # isn't transfer encoded as newlines.
+            yield NEWLINES.sub(b'\n', encoded)
+
+
+class _TextSpool:
+    """A spool file for the text of a digest.
+
+    As the text is written, this keeps track of the character set it can be
+    encoded in, and whether the encoded text is 7-bit clean.
+    """
+
+    def __init__(self, charset):
+        self.charset = Charset(charset)
+        self.is_7bit = True
+        self._file = _spool('w+', encoding='utf-8', newline='\n')
+
+    def check(self, text):
+        """Fall back to utf-8 if the text can't be encoded otherwise."""
+        try:
+            data = text.encode(self.charset.output_charset)
+        except UnicodeError:
+            self.charset = Charset('utf-8')
+            data = text.encode('utf-8')
+        if self.is_7bit:
+            try:
+                data.decode('ascii')
+            except UnicodeDecodeError:
+                self.is_7bit = False
+
+    def write(self, text):
+        self.check(text)
+        self._file.write(text)
+
+    def blocks(self):
+        """Read the text back, one block at a time."""
+        self._file.seek(0)
+        yield from iter(partial(self._file.read, BLOCK_SIZE), '')
+
+    def close(self):
+        self._file.close()
 
 
 class Digester:
@@ -87,24 +210,10 @@ class Digester:
         self._toc = StringIO()
         print(_("Today's Topics:\n"), file=self._toc)
 
-    def add_to_toc(self, msg, count):
-        """Add a message to the table of contents."""
-        subject = msg.get('subject', _('(no subject)'))
-        subject = oneline(subject, in_unicode=True)
-        # Don't include the redundant subject prefix in the toc
-        mo = re.match('(re:? *)?({0})'.format(
-            re.escape(self._mlist.subject_prefix)),
-                      subject, re.IGNORECASE)
-        if mo:
-            subject = subject[:mo.start(2)] + subject[mo.end(2):]
-        # Take only the first author we find.
-        username = ''
-        addresses = getaddresses(
-            [oneline(msg.get('from', ''), in_unicode=True)])
-        if addresses:
-            username = addresses[0][0]
-            if not username:
-                username = addresses[0][1]
+    def add_toc_entry(self, subject, username, count):
+        """Add a message's subject and author to the table of contents."""
+        if subject is None:
+            subject = _('(no subject)')
         if username:
             username = ' ({})'.format(username)
         lines = wrap('{:2}. {}'. format(count, subject), 65).split('\n')
@@ -122,24 +231,6 @@ class Digester:
             else:
                 print('     ', line.lstrip(), file=self._toc)
 
-    def add_message(self, msg, count):
-        """Add the message to the digest."""
-        # We do not want all the headers of the original message to leak
-        # through in the digest messages.
-        keepers = {}
-        for header in self._keepers:
-            keepers[header] = msg.get_all(header, [])
-        # Remove all the unkempt <wink> headers.  Use .keys() to allow for
-        # destructive iteration...
-        for header in msg.keys():
-            del msg[header]
-        # ... and add them in the designated order.
-        for header in self._keepers:
-            for value in keepers[header]:
-                msg[header] = value
-        # Add some useful extra stuff.
-        msg['Message'] = count.decode('utf-8')
-
 
 class MIMEDigester(Digester):
     """A MIME digester."""
@@ -156,8 +247,13 @@ class MIMEDigester(Digester):
                               _charset=self._charset)
             header['Content-Description'] = _('Digest Header')
             self._message.attach(header)
-        # Calculate the set of headers we're to keep in the MIME digest.
-        self._keepers = set(config.digests.mime_digest_keep_headers.split())
+        # The messages are flattened to a spool file as they are added, and
+        # only put between the multipart/digest boundaries when the digest is
+        # finished.  So the boundaries are picked up front.
+        self._spool = _spool()
+        self._sizes = []
+        for part in (self._message, self._digest_part):
+            part.set_boundary(Generator._make_boundary())
 
     def _make_message(self):
         return MultipartDigestMessage('mixed')
@@ -177,11 +273,23 @@ class MIMEDigester(Digester):
             "Today's Topics ($count messages)")
         self._message.attach(toc_part)
 
-    def add_message(self, msg, count):
-        """Add the message to the digest."""
-        # Make a copy of the message object, since the RFC 1153 processing
-        # scrubs out attachments.
-        self._digest_part.attach(MIMEMessage(deepcopy(msg)))
+    def add_part(self, text, count):
+        """Add a flattened message/rfc822 part to the digest."""
+        for part in (self._message, self._digest_part):
+            boundary = part.get_boundary()
+            if ('--' + boundary).encode('ascii') not in text:
+                continue
+            # This is very unlikely, but then the new boundary must not show
+            # up in any of the messages spooled so far either.
+            while True:
+                boundary = Generator._make_boundary()
+                delimiter = ('--' + boundary).encode('ascii')
+                if (delimiter not in text and
+                        not _contains(self._spool, delimiter)):
+                    break
+            part.set_boundary(boundary)
+        self._spool.write(text)
+        self._sizes.append(len(text))
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
@@ -206,7 +314,22 @@ class MIMEDigester(Digester):
         # never got complaints before, but if we do, just wax this.  It's
         # primarily included for (marginally useful) backwards compatibility.
         self._message.postamble = _('End of ') + self._digest_id
-        return self._message
+        # Flatten the digest with a stand-in for the body of the
+        # multipart/digest part, and then put the spooled messages there.
+        delimiter = '--' + self._digest_part.get_boundary()
+        self._digest_part.set_payload(delimiter)
+        before, delimiter, after = self._message.as_bytes().partition(
+            delimiter.encode('ascii'))
+        digest = _spool()
+        digest.write(before)
+        self._spool.seek(0)
+        for index, size in enumerate(self._sizes):
+            digest.write((b'\n' if index > 0 else b'') + delimiter + b'\n')
+            digest.write(self._spool.read(size))
+        digest.write(b'\n' + delimiter + b'--\n')
+        digest.write(after)
+        self._spool.close()
+        return _map(digest)
 
 
 class RFC1153Digester(Digester):
@@ -223,8 +346,10 @@ class RFC1153Digester(Digester):
         if mlist.digest_header_uri is not None:
             print(self._header, file=self._text)
             print(file=self._text)
-        # Calculate the set of headers we're to keep in the RFC1153 digest.
-        self._keepers = set(config.digests.plain_digest_keep_headers.split())
+        # The messages come after the table of contents, which is only
+        # complete once all of them have been seen, so they are spooled to a
+        # file in the meantime.
+        self._spool = _TextSpool(self._charset)
 
     def _make_message(self):
         return Message()
@@ -240,36 +365,12 @@ class RFC1153Digester(Digester):
         print(self._separator70, file=self._text)
         print(file=self._text)
 
-    def add_message(self, msg, count):
-        """Add the message to the digest."""
+    def add_part(self, text, count):
+        """Add a message's section to the digest."""
         if count > 1:
-            print(self._separator30, file=self._text)
-            print(file=self._text)
-        # Each message section contains a few headers.
-        for header in config.digests.plain_digest_keep_headers.split():
-            if header in msg:
-                value = oneline(msg[header], in_unicode=True)
-                value = wrap('{}: {}'.format(header, value))
-                value = '\n\t'.join(value.split('\n'))
-                print(value, file=self._text)
-        print(file=self._text)
-        # Add the payload.  If the decoded payload is empty, this may be a
-        # multipart message.  In that case, just stringify it.
-        payload = msg.get_payload(decode=True)
-        if not payload:
-            payload = msg.as_string().split('\n\n', 1)[1]
-        if isinstance(payload, bytes):
-            try:
-                # Do the decoding inside the try/except so that if the charset
-                # conversion fails, we'll just drop back to ascii.
-                charset = msg.get_content_charset('us-ascii')
-                payload = payload.decode(charset, 'replace')
-            except (LookupError, TypeError):
-                # Unknown or empty charset.
-                payload = payload.decode('us-ascii', 'replace')
-        print(payload, file=self._text)
-        if not payload.endswith('\n'):
-            print(file=self._text)
+            print(self._separator30, file=self._spool)
+            print(file=self._spool)
+        self._spool.write(text)
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
@@ -286,65 +387,123 @@ class RFC1153Digester(Digester):
             # MAS: There is no real place for the digest_footer in an RFC 1153
             # compliant digest, so add it as an additional message with
             # Subject: Digest Footer
-            print(self._separator30, file=self._text)
-            print(file=self._text)
-            print('Subject: ' + _('Digest Footer'), file=self._text)
-            print(file=self._text)
-            print(footer_text, file=self._text)
-            print(file=self._text)
-            print(self._separator30, file=self._text)
-            print(file=self._text)
+            print(self._separator30, file=self._spool)
+            print(file=self._spool)
+            print('Subject: ' + _('Digest Footer'), file=self._spool)
+            print(file=self._spool)
+            print(footer_text, file=self._spool)
+            print(file=self._spool)
+            print(self._separator30, file=self._spool)
+            print(file=self._spool)
         # Add the sign-off.
         sign_off = _('End of ') + self._digest_id
-        print(sign_off, file=self._text)
-        print('*' * len(sign_off), file=self._text)
+        print(sign_off, file=self._spool)
+        print('*' * len(sign_off), file=self._spool)
         # If the digest message can't be encoded by the list character set,
         # fall back to utf-8.
-        text = self._text.getvalue()
-        try:
-            self._message.set_payload(text.encode(self._charset),
-                                      charset=self._charset)
-        except UnicodeError:
-            self._message.set_payload(text.encode('utf-8'), charset='utf-8')
-        return self._message
+        front = self._text.getvalue()
+        self._spool.check(front)
+        charset = self._spool.charset
+        self._message['MIME-Version'] = '1.0'
+        self._message.add_header('Content-Type', 'text/plain',
+                                 charset=charset.get_output_charset())
+        if charset.body_encoding is None:
+            cte = ('7bit' if self._spool.is_7bit else '8bit')
+        else:
+            cte = charset.get_body_encoding()
+        self._message['Content-Transfer-Encoding'] = cte
+        digest = _spool()
+        digest.write(self._message.as_bytes())
+        for chunk in _body_encode(
+                chain([front], self._spool.blocks()), charset):
+            digest.write(chunk)
+        self._spool.close()
+        return _map(digest)
 
 
 @public
 class DigestRunner(Runner):
     """The digest runner."""
 
+    def __init__(self, name, slice=None):
+        super().__init__(name, slice)
+        # The queue entries which are being held off, mapped to their
+        # delivery times.
+        self._held = {}
+
+    def _get_files(self):
+        """See `IRunner`."""
+        # Avoid circular imports.
+        from mailman.utilities.datetime import now
+        # Periodic digests may be spread out over the send window.  Those
+        # whose time hasn't come yet are left alone in the queue, and each
+        # entry's metadata is only read once to find out when that is.
+        current = now()
+        held = {}
+        files = []
+        for filebase in super()._get_files():
+            deliver_after = self._held.get(filebase)
+            if deliver_after is None:
+                try:
+                    msgdata = self.switchboard.metadata(filebase)
+                except FileNotFoundError:
+                    # Another instance of this runner claimed it.
+                    continue
+                except Exception:
+                    # Let the entry fail to be dequeued instead.
+                    files.append(filebase)
+                    continue
+                deliver_after = msgdata.get(
+                    'deliver_after', datetime.fromtimestamp(0))
+            if current < deliver_after:
+                held[filebase] = deliver_after
+            else:
+                files.append(filebase)
+        self._held = held
+        return files
+
     def _dispose(self, mlist, msg, msgdata):
         """See `IRunner`."""
+        # Avoid circular imports.
+        from mailman.app.digests import DigestJournal, digest_parts
         volume = msgdata['volume']
         digest_number = msgdata['digest_number']
+        started = time.time()
         # Backslashes make me cry.
         code = mlist.preferred_language.code
         with Mailbox(msgdata['digest_path']) as mailbox, _.using(code):
             # Create the digesters.
             mime_digest = MIMEDigester(mlist, volume, digest_number)
             rfc1153_digest = RFC1153Digester(mlist, volume, digest_number)
-            # Cruise through all the messages in the mailbox, first building
-            # the table of contents and accumulating Subject: headers and
-            # authors.  The question really is whether it's better from a1
-            # performance and memory footprint to go through the mailbox once
-            # and cache the messages in a list, or to cruise through the
-            # mailbox twice.  We'll do the latter, but it's a complete guess.
+            # The parts of the digests each message makes up are usually
+            # journaled as the messages are added to the mailbox.  Otherwise,
+            # cruise through all the messages in the mailbox once, rendering
+            # them one at a time.
+            journal = DigestJournal(msgdata['digest_path'])
+            records = journal.load()
+            if records is None:
+                parts = (digest_parts(mlist, message)
+                         for key, message in mailbox.iteritems())
+            else:
+                parts = journal.parts(records)
+            # Build the table of contents from the Subject: headers and
+            # authors, while the digesters spool the messages themselves.
             count = None
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_to_toc(message, count)
-                rfc1153_digest.add_to_toc(message, count)
+            for count, (subject, username, mime, text) in enumerate(parts, 1):
+                mime_digest.add_toc_entry(subject, username, count)
+                rfc1153_digest.add_toc_entry(subject, username, count)
+                mime_digest.add_part(mime, count)
+                rfc1153_digest.add_part(text, count)
             assert count is not None, 'No digest messages?'
-            # Add the table of contents.
+            # Add the table of contents, which goes before the messages.
             mime_digest.add_toc(count)
             rfc1153_digest.add_toc(count)
-            # Cruise through the set of messages a second time, adding them to
-            # the actual digest.
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_message(message, count)
-                rfc1153_digest.add_message(message, count)
             # Finish up the digests.
             mime = mime_digest.finish()
             rfc1153 = rfc1153_digest.finish()
+        rlog.info('%s digest volume %s, number %s: %s messages built in '
+                  '%.3f seconds', mlist.list_id, volume, digest_number, count,
+                  time.time() - started)
         # Calculate the recipients lists
         mime_recipients = set()
         rfc1153_recipients = set()
@@ -30,34 +30,35 @@ Mailman's incoming queue for normal processing.  If they don't look good, or
 are destined for a bogus sub-address, they are rejected right away, hopefully
 so that the peer mail server can provide better diagnostics.
 
+Large messages are written to a spool file as they are received, rather than
+being held in memory, and only their headers are parsed before they are
+queued.
+
 [1] RFC 2033 Local Mail Transport Protocol
     http://www.faqs.org/rfcs/rfc2033.html
 """
 
-import sys
+import mmap
 import email
+import socket
+import asyncio
 import logging
-import asyncore
+import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parseaddr
 from mailman import public
 from mailman.config import config
 from mailman.core.runner import Runner
 from mailman.database.transaction import transactional
-from mailman.email.message import Message
-from mailman.interfaces.listmanager import IListManager
+from mailman.email.message import LazyMessage, Message
+from mailman.interfaces.listmanager import (
+    IListManager, ListCreatedEvent, ListDeletedEvent)
 from mailman.utilities.datetime import now
 from mailman.utilities.email import add_message_hash
+from zope import event
 from zope.component import getUtility
 
-# Python 3.4's smtpd module can't handle non-UTF-8 byte input.  Unfortunately
-# we do get such emails in the wild.  Python 3.5's version of the module does
-# handle it correctly.  We vendor a version to use in the Python 3.4 case.
-if sys.version_info < (3, 5):
-    from mailman.compat import smtpd
-else:
-    import smtpd
-
 
 elog = logging.getLogger('mailman.error')
 qlog = logging.getLogger('mailman.runner')
@@ -93,180 +94,473 @@ SUBADDRESS_QUEUES = dict(
 DASH = '-'
 CRLF = '\r\n'
 ERR_451 = '451 Requested action aborted: error in processing'
+ERR_500 = '500 Error: bad syntax'
+ERR_500_COMMAND = '500 Error: command "{}" not recognized'
+ERR_500_LINE = '500 Error: line too long'
 ERR_501 = '501 Message has defects'
-ERR_502 = '502 Error: command HELO not implemented'
+ERR_502 = '502 Error: command {} not implemented'
+ERR_503_LHLO = '503 Error: send LHLO first'
 ERR_550 = '550 Requested action not taken: mailbox unavailable'
 ERR_550_MID = '550 No Message-ID header provided'
+ERR_552 = '552 Error: Too much mail data'
+OK_250 = '250 OK'
 
-# XXX Blech
-smtpd.__version__ = 'GNU Mailman LMTP runner 1.1'
-
+VERSION = 'GNU Mailman LMTP runner 2.0'
 
-def split_recipient(address):
-    """Split an address into listname, subaddress and domain parts.
+# The longest command line, and the largest message, the server accepts.
+COMMAND_SIZE_LIMIT = 512
+DATA_SIZE_LIMIT = 33554432
 
-    For example:
+# The end of the message data, i.e. a line with a single dot.
+END_OF_DATA = b'\r\n.\r\n'
 
-    >>> split_recipient('mylist@example.com')
-    ('mylist', None, 'example.com')
 
-    >>> split_recipient('mylist-request@example.com')
-    ('mylist', 'request', 'example.com')
+class RoutingTable:
+    """The destinations of the addresses of all mailing lists.
 
-    :param address: The destination address.
-    :return: A 3-tuple of the form (list-shortname, subaddress, domain).
-        subaddress may be None if this is the list's posting address.
+    This maps the posting address and every subaddress of each mailing list
+    to a (list-id, queue, subaddress) tuple, where subaddress is the
+    canonical subaddress name, or None for the posting address.
     """
-    localpart, domain = address.split('@', 1)
-    localpart = localpart.split(config.mta.verp_delimiter, 1)[0]
-    parts = localpart.split(DASH)
-    if parts[-1] in SUBADDRESS_NAMES:
-        listname = DASH.join(parts[:-1])
-        subaddress = parts[-1]
-    else:
-        listname = localpart
-        subaddress = None
-    return listname, subaddress, domain
-
-
-class Channel(smtpd.SMTPChannel):
-    """An LMTP channel."""
-
-    def __init__(self, server, conn, addr):
-        super().__init__(server, conn, addr, decode_data=False)
-        # Stash this here since the subclass uses private attributes. :(
-        self._server = server
+
+    def __init__(self):
+        self._routes = None
+        self._generation = None
+
+    def handle_event(self, event):
+        # The generation also changes when this process creates or deletes a
+        # mailing list, but there's no need to wait for the next check.
+        if isinstance(event, (ListCreatedEvent, ListDeletedEvent)):
+            self._routes = None
+
+    def refresh(self):
+        """Rebuild the table if a mailing list was created or deleted."""
+        list_manager = getUtility(IListManager)
+        generation = list_manager.generation
+        if self._routes is not None and generation == self._generation:
+            return
+        components = list(list_manager.name_components)
+        routes = {}
+        for list_name, mail_host in components:
+            list_id = '{}.{}'.format(list_name, mail_host)
+            for name, subaddress in SUBADDRESS_NAMES.items():
+                address = '{}{}{}@{}'.format(list_name, DASH, name, mail_host)
+                routes[address] = (
+                    list_id, SUBADDRESS_QUEUES[subaddress], subaddress)
+        # Posting addresses come last, since a mailing list may be named like
+        # a subaddress of another one, e.g. mylist-join@example.com.
+        for list_name, mail_host in components:
+            address = '{}@{}'.format(list_name, mail_host)
+            list_id = '{}.{}'.format(list_name, mail_host)
+            routes[address] = (list_id, 'in', None)
+        self._routes = routes
+        self._generation = generation
+
+    def get(self, address):
+        """Return the destination of an address, or None."""
+        local, at, domain = address.partition('@')
+        local = local.split(config.mta.verp_delimiter, 1)[0]
+        return self._routes.get('{}@{}'.format(local, domain))
+
+
+def _unstuff(data):
+    # Undo the dot-stuffing of the message lines, and turn their line endings
+    # into newlines.  The data must start with a line ending.
+    return data.replace(b'\r\n.', b'\r\n').replace(b'\r\n', b'\n')
+
+
+def _getaddr(keyword, arg):
+    # Return the address in a MAIL FROM: or RCPT TO: argument, ignoring any
+    # parameters, or None if the argument is malformed.
+    if arg[:len(keyword)].upper() != keyword:
+        return None
+    arg = arg[len(keyword):].strip()
+    if arg.startswith('<'):
+        end = arg.find('>')
+        return None if end < 0 else arg[1:end]
+    parts = arg.split()
+    return parts[0] if len(parts) > 0 else None
+
+
+class Channel(asyncio.Protocol):
+    """An LMTP session."""
+
+    def __init__(self, runner):
+        self._runner = runner
+        self._transport = None
+        self._buffer = bytearray()
+        self._greeted = False
+        self._busy = False
+        self._too_long = False
+        self._reset()
+
+    def _reset(self):
+        self._mailfrom = None
+        self._rcpttos = []
+        self._in_data = False
+        self._too_much_data = False
+        self._search_from = 0
+        # A large message is spooled to a file while it is being received.
+        self._spool = None
+        self._spooled = 0
+
+    def _push(self, *lines):
+        if self._transport is not None:
+            self._transport.write(
+                ''.join(line + CRLF for line in lines).encode('utf-8'))
+
+    def connection_made(self, transport):
+        self._transport = transport
+        slog.debug('LMTP accept from %s', transport.get_extra_info('peername'))
+        self._push('220 {} {}'.format(self._runner.fqdn, VERSION))
+
+    def connection_lost(self, exc):
+        self._transport = None
+        self._close_spool()
+
+    def _close_spool(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        self._process()
+
+    def _process(self):
+        # Handle everything in the buffer, stopping while a message is being
+        # processed so that pipelined commands are answered in order.
+        while not self._busy and self._transport is not None:
+            if self._in_data:
+                if not self._collect():
+                    return
+                continue
+            eol = self._buffer.find(b'\n')
+            if eol < 0:
+                if len(self._buffer) > COMMAND_SIZE_LIMIT:
+                    # Discard the line, and complain once it ends.
+                    self._too_long = True
+                    del self._buffer[:]
+                return
+            line = bytes(self._buffer[:eol]).rstrip(b'\r')
+            del self._buffer[:eol + 1]
+            if self._too_long or len(line) > COMMAND_SIZE_LIMIT:
+                self._too_long = False
+                self._push(ERR_500_LINE)
+                continue
+            command, space, arg = line.decode('utf-8', 'replace').partition(
+                ' ')
+            if len(command) == 0:
+                self._push(ERR_500)
+                continue
+            method = getattr(self, 'smtp_' + command.upper(), None)
+            if method is None:
+                self._push(ERR_500_COMMAND.format(command))
+            else:
+                method(arg.strip())
+
+    def _collect(self):
+        # Look for the end of the message data.  Its last few bytes are
+        # searched again in case the terminator was split across reads.
+        end = self._buffer.find(END_OF_DATA, self._search_from)
+        if end < 0:
+            if self._spooled + len(self._buffer) > DATA_SIZE_LIMIT:
+                self._too_much_data = True
+                self._close_spool()
+                del self._buffer[:-len(END_OF_DATA)]
+            elif (self._spool is not None or
+                    len(self._buffer) > self._runner.spool_size > 0):
+                self._spill()
+            self._search_from = max(
+                0, len(self._buffer) - len(END_OF_DATA) + 1)
+            return False
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end + len(END_OF_DATA)]
+        if self._too_much_data:
+            self._push(*[ERR_552] * len(self._rcpttos))
+            self._reset()
+            return True
+        if self._spool is not None:
+            # The rest of the message goes to its spool file too, which the
+            # worker then gets instead of the data.
+            self._spool.write(_unstuff(data))
+            self._spool.flush()
+            data = self._spool
+            self._spool = None
+        # Stop reading from the MTA until the message has been handled.
+        self._busy = True
+        self._transport.pause_reading()
+        future = self._runner.submit(self._mailfrom, self._rcpttos, data)
+        future.add_done_callback(self._done)
+        return True
+
+    def _spill(self):
+        # Move the complete lines of a large message to its spool file.  The
+        # line ending before the rest of the data stays in the buffer, since
+        # it is part of the end of data marker, or of an escaped dot.
+        end = self._buffer.rfind(b'\r\n')
+        if end <= 0:
+            return
+        data = _unstuff(self._buffer[:end])
+        if self._spool is None:
+            self._spool = self._runner.spool()
+            # Drop the line ending that was put before the first line.
+            data = data[1:]
+        self._spool.write(data)
+        self._spooled += end
+        del self._buffer[:end]
+
+    def _done(self, future):
+        self._busy = False
+        if future.cancelled():
+            return
+        try:
+            status = future.result()
+        except Exception:
+            elog.exception('LMTP message processing')
+            status = [ERR_451] * len(self._rcpttos)
+        # RFC 2033 requires us to return a status code for every recipient.
+        self._push(*status)
+        self._reset()
+        if self._transport is not None:
+            self._transport.resume_reading()
+            self._process()
 
     def smtp_LHLO(self, arg):
         """The LMTP greeting, used instead of HELO/EHLO."""
-        super().smtp_HELO(arg)
+        if not arg:
+            self._push('501 Syntax: LHLO hostname')
+        elif self._greeted:
+            self._push('503 Duplicate LHLO')
+        else:
+            self._greeted = True
+            self._push('250-{}'.format(self._runner.fqdn),
+                       '250-PIPELINING',
+                       '250 8BITMIME')
 
     def smtp_HELO(self, arg):
         """HELO is not a valid LMTP command."""
-        self.push(ERR_502)
-
-    # def push(self, arg):
-    #     import pdb; pdb.set_trace()
-    #     return super().push(arg)
+        self._push(ERR_502.format('HELO'))
+
+    def smtp_EHLO(self, arg):
+        """EHLO is not a valid LMTP command."""
+        self._push(ERR_502.format('EHLO'))
+
+    def smtp_NOOP(self, arg):
+        self._push('501 Syntax: NOOP' if arg else OK_250)
+
+    def smtp_QUIT(self, arg):
+        self._push('221 Bye')
+        self._transport.close()
+        self._transport = None
+
+    def smtp_RSET(self, arg):
+        if arg:
+            self._push('501 Syntax: RSET')
+        else:
+            self._reset()
+            self._push(OK_250)
+
+    def smtp_MAIL(self, arg):
+        if not self._greeted:
+            self._push(ERR_503_LHLO)
+            return
+        if self._mailfrom is not None:
+            self._push('503 Error: nested MAIL command')
+            return
+        address = _getaddr('FROM:', arg)
+        if address is None:
+            self._push('501 Syntax: MAIL FROM:<address>')
+            return
+        self._mailfrom = address
+        self._push(OK_250)
+
+    def smtp_RCPT(self, arg):
+        if not self._greeted:
+            self._push(ERR_503_LHLO)
+            return
+        if self._mailfrom is None:
+            self._push('503 Error: need MAIL command')
+            return
+        address = _getaddr('TO:', arg)
+        if not address:
+            self._push('501 Syntax: RCPT TO:<address>')
+            return
+        self._rcpttos.append(address)
+        self._push(OK_250)
+
+    def smtp_DATA(self, arg):
+        if not self._greeted:
+            self._push(ERR_503_LHLO)
+            return
+        if len(self._rcpttos) == 0:
+            self._push('503 Error: need RCPT command')
+            return
+        if arg:
+            self._push('501 Syntax: DATA')
+            return
+        self._push('354 End data with <CR><LF>.<CR><LF>')
+        # Start the data with a line ending, so that the very first line can
+        # be the end of the data, and be unstuffed like all the others.
+        self._buffer[0:0] = CRLF.encode('ascii')
+        self._in_data = True
 
 
 @public
-class LMTPRunner(Runner, smtpd.SMTPServer):
-    # Only __init__ is called on startup. Asyncore is responsible for later
-    # connections from the MTA.  slice and numslices are ignored and are
-    # necessary only to satisfy the API.
+class LMTPRunner(Runner):
+    # Only __init__ is called on startup.  The event loop is responsible for
+    # later connections from the MTA.  slice and numslices are ignored and
+    # are necessary only to satisfy the API.
 
     is_queue_runner = False
 
     def __init__(self, name, slice=None):
+        super().__init__(name, slice)
+        self.fqdn = socket.getfqdn()
+        # Messages are parsed and queued by a pool of worker threads, while
+        # the event loop keeps serving the MTA's connections.  All database
+        # access happens in one more thread of its own, since the database
+        # session must not be used by several threads at once.
+        self._workers = ThreadPoolExecutor(int(config.mta.lmtp_workers))
+        self.spool_size = int(config.mta.lmtp_spool_size)
+        self._database = ThreadPoolExecutor(1)
+        self._pending = set()
+        self._routing_table = RoutingTable()
+        event.subscribers.append(self._routing_table.handle_event)
+        self._loop = asyncio.new_event_loop()
         localaddr = config.mta.lmtp_host, int(config.mta.lmtp_port)
-        # Do not call Runner's constructor because there's no QDIR to create
         qlog.debug('LMTP server listening on %s:%s',
                    localaddr[0], localaddr[1])
-        smtpd.SMTPServer.__init__(self, localaddr, remoteaddr=None)
-        super().__init__(name, slice)
-
-    def handle_accept(self):
-        conn, addr = self.accept()
-        Channel(self, conn, addr)
-        slog.debug('LMTP accept from %s', addr)
-
-    @transactional
-    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self._server = self._loop.run_until_complete(
+            self._loop.create_server(lambda: Channel(self), *localaddr))
+
+    def submit(self, mailfrom, rcpttos, data):
+        """Process a message in a worker thread.
+
+        :return: A future for the statuses of the recipients.
+        """
+        future = self._loop.run_in_executor(
+            self._workers, self.process_message, mailfrom, rcpttos, data)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def spool(self):
+        """Return a new file to spool a large message to.
+
+        The file lives in the incoming queue's directory, but has no name, so
+        it disappears once it is closed.
+        """
+        return tempfile.TemporaryFile(
+            dir=config.switchboards['in'].queue_directory)
+
+    def process_message(self, mailfrom, rcpttos, data):
         try:
-            # Refresh the list of list names every time we process a message
-            # since the set of mailing lists could have changed.
-            listnames = set(getUtility(IListManager).names)
             # Parse the message data.  If there are any defects in the
             # message, reject it right away; it's probably spam.
-            msg = email.message_from_bytes(data, Message)
+            if isinstance(data, bytes):
+                data = _unstuff(data)[1:]
+                msg = email.message_from_bytes(data, Message)
+                defects = msg.defects
+            else:
+                # The message was spooled to a file, already unstuffed.  Map
+                # the file and parse only the headers, so that the body is
+                # never read into memory here.  It is copied straight from the
+                # mapping to the queue files.
+                with data:
+                    data = mmap.mmap(
+                        data.fileno(), 0, access=mmap.ACCESS_READ)
+                msg = LazyMessage(data)
+                defects = msg.header_defects
         except Exception:
             elog.exception('LMTP message parsing')
-            config.db.abort()
-            return CRLF.join(ERR_451 for to in rcpttos)
+            return [ERR_451] * len(rcpttos)
         # Do basic post-processing of the message, checking it for defects or
         # other missing information.
         message_id = msg.get('message-id')
         if message_id is None:
-            return ERR_550_MID
-        if msg.defects:
-            return ERR_501
+            return [ERR_550_MID] * len(rcpttos)
+        if defects:
+            return [ERR_501] * len(rcpttos)
         msg.original_size = len(data)
         add_message_hash(msg)
         msg['X-MailFrom'] = mailfrom
-        # RFC 2033 requires us to return a status code for every recipient.
-        status = []
-        # Now for each address in the recipients, parse the address to first
-        # see if it's destined for a valid mailing list.  If so, then queue
-        # the message to the appropriate place and record a 250 status for
-        # that recipient.  If not, record a failure status for that recipient.
+        try:
+            routes = self._database.submit(
+                self._route, message_id, rcpttos).result()
+        except Exception:
+            elog.exception('LMTP message routing')
+            return [ERR_451] * len(rcpttos)
+        # Queue the message for each recipient which is a valid destination,
+        # and record a 250 status for it.  Record a failure status for the
+        # others.
         received_time = now()
-        for to in rcpttos:
+        status = []
+        for queue, msgdata in routes:
+            if queue is None:
+                status.append(ERR_550)
+                continue
+            msgdata.update(original_size=msg.original_size,
+                           received_time=received_time)
             try:
-                to = parseaddr(to)[1].lower()
-                local, subaddress, domain = split_recipient(to)
-                if subaddress is not None:
-                    # Check that local-subaddress is not an actual list name.
-                    listname = '{}-{}@{}'.format(local, subaddress, domain)
-                    if listname in listnames:
-                        local = '{}-{}'.format(local, subaddress)
-                        subaddress = None
-                slog.debug('%s to: %s, list: %s, sub: %s, dom: %s',
-                           message_id, to, local, subaddress, domain)
-                listname = '{}@{}'.format(local, domain)
-                if listname not in listnames:
-                    status.append(ERR_550)
-                    continue
-                listid = '{}.{}'.format(local, domain)
-                # The recipient is a valid mailing list.  Find the subaddress
-                # if there is one, and set things up to enqueue to the proper
-                # queue.
-                queue = None
-                msgdata = dict(listid=listid,
-                               original_size=msg.original_size,
-                               received_time=received_time)
-                canonical_subaddress = SUBADDRESS_NAMES.get(subaddress)
-                queue = SUBADDRESS_QUEUES.get(canonical_subaddress)
-                if subaddress is None:
-                    # The message is destined for the mailing list.
-                    msgdata['to_list'] = True
-                    queue = 'in'
-                elif canonical_subaddress is None:
-                    # The subaddress was bogus.
-                    slog.error('%s unknown sub-address: %s',
-                               message_id, subaddress)
-                    status.append(ERR_550)
-                    continue
-                else:
-                    # A valid subaddress.
-                    msgdata['subaddress'] = canonical_subaddress
-                    if canonical_subaddress == 'owner':
-                        msgdata.update(dict(
-                            to_owner=True,
-                            envsender=config.mailman.site_owner,
-                            ))
-                        queue = 'in'
-                # If we found a valid destination, enqueue the message and add
-                # a success status for this recipient.
-                if queue is not None:
-                    config.switchboards[queue].enqueue(msg, msgdata)
-                    slog.debug('%s subaddress: %s, queue: %s',
-                               message_id, canonical_subaddress, queue)
-                    status.append('250 Ok')
+                config.switchboards[queue].enqueue(msg, msgdata)
             except Exception:
-                slog.exception('Queue detection: %s', msg['message-id'])
-                config.db.abort()
+                slog.exception('Queue detection: %s', message_id)
                 status.append(ERR_550)
-        # All done; returning this big status string should give the expected
-        # response to the LMTP client.
-        return CRLF.join(status)
+                continue
+            slog.debug('%s subaddress: %s, queue: %s',
+                       message_id, msgdata.get('subaddress'), queue)
+            status.append('250 Ok')
+        return status
+
+    @transactional
+    def _route(self, message_id, rcpttos):
+        # Find the queue and the metadata for each recipient, or None if the
+        # recipient is not a valid destination.  This runs in the database
+        # thread.
+        self._routing_table.refresh()
+        routes = []
+        for to in rcpttos:
+            to = parseaddr(to)[1].lower()
+            route = self._routing_table.get(to)
+            if route is None:
+                slog.debug('%s to: %s, no such list', message_id, to)
+                routes.append((None, None))
+                continue
+            list_id, queue, subaddress = route
+            slog.debug('%s to: %s, list: %s, sub: %s',
+                       message_id, to, list_id, subaddress)
+            msgdata = dict(listid=list_id)
+            if subaddress is None:
+                # The message is destined for the mailing list.
+                msgdata['to_list'] = True
+            else:
+                msgdata['subaddress'] = subaddress
+                if subaddress == 'owner':
+                    msgdata.update(dict(
+                        to_owner=True,
+                        envsender=config.mailman.site_owner,
+                        ))
+            routes.append((queue, msgdata))
+        return routes
 
     def run(self):
         """See `IRunner`."""
-        asyncore.loop(use_poll=True)
+        self._loop.run_forever()
+        # Stop accepting connections, and let the messages being processed
+        # finish, so that the MTA gets their statuses.
+        self._server.close()
+        if len(self._pending) > 0:
+            self._loop.run_until_complete(asyncio.wait(self._pending))
+        self._workers.shutdown()
+        self._database.shutdown()
+        self._loop.close()
+        # Don't keep the routing table alive once the runner is gone.
+        event.subscribers.remove(self._routing_table.handle_event)
 
     def stop(self):
         """See `IRunner`."""
-        asyncore.socket_map.clear()
-        asyncore.close_all()
-        self.close()
+        super().stop()
+        # This is called from a signal handler, so wake up the event loop.
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -22,6 +22,7 @@ import logging
 import threading
 
 from mailman import public
+from mailman.config import config
 from mailman.core.runner import Runner
 from mailman.rest.wsgiapp import make_server
 
@@ -48,7 +49,11 @@ class RESTRunner(Runner):
         # to use the signal handler to notify a shutdown thread that the
         # shutdown should happen.  That thread will wake up and stop the main
         # server.
-        self._server = make_server()
+        #
+        # When more than one instance of this runner is started, they all
+        # listen on the same port.
+        section = getattr(config, 'runner.' + name)
+        self._server = make_server(reuse_port=int(section.instances) > 1)
         self._event = threading.Event()
         def stopper(event, server):                 # noqa
             event.wait()
@@ -19,6 +19,8 @@
 
 import unittest
 
+from email.header import decode_header, make_header
+from email.generator import Generator
 from email.iterators import _structure as structure
 from email.mime.text import MIMEText
 from io import StringIO
@@ -26,14 +28,16 @@ from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.email.message import Message
 from mailman.interfaces.member import DeliveryMode
-from mailman.runners.digest import DigestRunner
+from mailman.runners.digest import DigestRunner, _TextSpool
 from mailman.testing.helpers import (
     LogFileMark, digest_mbox, get_queue_messages, make_digest_messages,
     make_testable_runner, message_from_string,
     specialized_message_from_string as mfs,
     subscribe)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.mailbox import Mailbox
 from string import Template
+from unittest.mock import patch
 
 
 class TestDigest(unittest.TestCase):
@@ -203,6 +207,79 @@ multipart/mixed
     text/plain
 """)
 
+    def test_digest_from_journal(self):
+        # The parts of the digests were journaled when the messages were
+        # posted, so the digest runner doesn't read the mailbox.
+        anne = subscribe(self._mlist, 'Anne')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        with patch.object(Mailbox, 'iteritems', autospec=True,
+                          side_effect=Mailbox.iteritems) as iteritems:
+            make_digest_messages(self._mlist)
+        self.assertEqual(iteritems.call_count, 0)
+        items = get_queue_messages('virgin', expected_count=1)
+        post = items[0].msg.get_payload(2).get_payload(0).get_payload(0)
+        self.assertEqual(post['message-id'], '<testing>')
+
+    def test_build_time_logged(self):
+        # The time it took to build the digests is logged.
+        anne = subscribe(self._mlist, 'Anne')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        mark = LogFileMark('mailman.runner')
+        make_digest_messages(self._mlist)
+        self.assertRegex(
+            mark.read(),
+            r'test.example.com digest volume 1, number 1: 1 messages built '
+            r'in \d+\.\d{3} seconds')
+
+    def test_digest_without_journal(self):
+        # A message was added to the mailbox without being journaled, so the
+        # digest runner renders the messages itself, in a single pass over
+        # the digest mailbox.
+        anne = subscribe(self._mlist, 'Anne')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        mbox = digest_mbox(self._mlist)
+        mbox.add(mfs("""\
+From: anne@example.org
+To: test@example.com
+Message-ID: <ant>
+
+"""))
+        mbox.flush()
+        with patch.object(Mailbox, 'iteritems', autospec=True,
+                          side_effect=Mailbox.iteritems) as iteritems:
+            make_digest_messages(self._mlist)
+        self.assertEqual(iteritems.call_count, 1)
+        items = get_queue_messages('virgin', expected_count=1)
+        posts = items[0].msg.get_payload(2).get_payload()
+        self.assertEqual(
+            [post.get_payload(0)['message-id'] for post in posts],
+            ['<ant>', '<testing>'])
+
+    def test_boundary_in_message(self):
+        # The boundaries of the MIME digest are picked before the messages
+        # are added.  If a message happens to contain one of them, another
+        # one is picked.
+        anne = subscribe(self._mlist, 'Anne')
+        anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Message-ID: <ant>
+
+--===============0000000000000000002==
+""")
+        boundaries = ['==============={:019d}=='.format(i) for i in range(4)]
+        with patch.object(Generator, '_make_boundary',
+                          side_effect=boundaries[1:]):
+            make_digest_messages(self._mlist, msg)
+        items = get_queue_messages('virgin', expected_count=1)
+        digest = items[0].msg.get_payload(2)
+        self.assertEqual(items[0].msg.get_boundary(), boundaries[1])
+        self.assertEqual(digest.get_boundary(), boundaries[3])
+        self.assertEqual(len(digest.get_payload()), 1)
+        post = digest.get_payload(0).get_payload(0)
+        self.assertEqual(post.get_payload(), boundaries[2].join(['--', '\n']))
+
 
 class TestI18nDigest(unittest.TestCase):
     layer = ConfigLayer
@@ -252,9 +329,9 @@ Content-Transfer-Encoding: 7bit
             rfc1153, mime = items[0].msg, items[1].msg
         # The MIME version contains a mix of French and Japanese.  The digest
         # chrome added by Mailman is in French.
-        self.assertEqual(mime['subject'].encode(),
+        self.assertEqual(mime['subject'],
                          '=?iso-8859-1?q?Groupe_Test=2C_Vol_1=2C_Parution_1?=')
-        self.assertEqual(str(mime['subject']),
+        self.assertEqual(str(make_header(decode_header(mime['subject']))),
                          'Groupe Test, Vol 1, Parution 1')
         # The first subpart contains the iso-8859-1 masthead.
         masthead = mime.get_payload(0).get_payload(decode=True).decode(
@@ -279,8 +356,44 @@ Content-Transfer-Encoding: 7bit
         self.assertEqual(post.get_payload(decode=True), b'\x1b$B0lHV\x1b(B\n')
         # The RFC 1153 digest will have the same subject, but its payload will
         # be recast into utf-8.
-        self.assertEqual(str(rfc1153['subject']),
+        self.assertEqual(str(make_header(decode_header(rfc1153['subject']))),
                          'Groupe Test, Vol 1, Parution 1')
-        self.assertEqual(rfc1153.get_charset(), 'utf-8')
+        self.assertEqual(rfc1153.get_content_charset(), 'utf-8')
         lines = rfc1153.get_payload(decode=True).decode('utf-8').splitlines()
         self.assertEqual(lines[0], 'Envoyez vos messages pour la liste Test à')
+
+
+class TestTextSpool(unittest.TestCase):
+    layer = ConfigLayer
+
+    def _spool(self, charset):
+        spool = _TextSpool(charset)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_7bit(self):
+        spool = self._spool('us-ascii')
+        spool.write('Today\'s Topics\n')
+        spool.write('An ordinary message\n')
+        self.assertTrue(spool.is_7bit)
+        self.assertEqual(str(spool.charset), 'us-ascii')
+        self.assertEqual(''.join(spool.blocks()),
+                         'Today\'s Topics\nAn ordinary message\n')
+
+    def test_8bit(self):
+        # Once any of the text isn't 7-bit clean, the spool isn't either.
+        spool = self._spool('iso-8859-1')
+        spool.write('Th\xe8mes du jour\n')
+        spool.write('An ordinary message\n')
+        self.assertFalse(spool.is_7bit)
+        self.assertEqual(str(spool.charset), 'iso-8859-1')
+
+    def test_utf8_fallback(self):
+        # Text which can't be encoded in the spool's character set switches
+        # it to utf-8.
+        spool = self._spool('us-ascii')
+        spool.write('Hello\n')
+        self.assertTrue(spool.is_7bit)
+        spool.write('\u65e5\u672c\u8a9e\n')
+        self.assertFalse(spool.is_7bit)
+        self.assertEqual(str(spool.charset), 'utf-8')
@@ -18,6 +18,7 @@
 """Tests for the LMTP server."""
 
 import os
+import socket
 import smtplib
 import unittest
 
@@ -25,8 +26,12 @@ from datetime import datetime
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.database.transaction import transaction
+from mailman.interfaces.listmanager import IListManager
+from mailman.runners.lmtp import LMTPRunner
 from mailman.testing.helpers import get_lmtp_client, get_queue_messages
-from mailman.testing.layers import LMTPLayer
+from mailman.testing.layers import ConfigLayer, LMTPLayer
+from zope import event
+from zope.component import getUtility
 
 
 class TestLMTP(unittest.TestCase):
@@ -165,6 +170,161 @@ Subject: This will be recognized as a join command.
         get_queue_messages('in', expected_count=0)
         get_queue_messages('command', expected_count=1)
 
+    def test_deleted_mailing_list(self):
+        # The LMTP server notices mailing lists which were created or deleted
+        # by other processes.
+        self._lmtp.sendmail('anne@example.com', ['test@example.com'], """\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        get_queue_messages('in', expected_count=1)
+        with transaction():
+            getUtility(IListManager).delete(self._mlist)
+            create_list('test2@example.com')
+        with self.assertRaises(smtplib.SMTPDataError) as cm:
+            self._lmtp.sendmail('anne@example.com', ['test@example.com'], """\
+From: anne@example.com
+To: test@example.com
+Message-ID: <bee>
+
+""")
+        self.assertEqual(cm.exception.smtp_code, 550)
+        self._lmtp.sendmail('anne@example.com', ['test2@example.com'], """\
+From: anne@example.com
+To: test2@example.com
+Message-ID: <cat>
+
+""")
+        items = get_queue_messages('in', expected_count=1)
+        self.assertEqual(items[0].msgdata['listid'], 'test2.example.com')
+
+
+class TestSessions(unittest.TestCase):
+    """Test LMTP sessions on the wire."""
+
+    layer = LMTPLayer
+
+    def setUp(self):
+        with transaction():
+            create_list('ant@example.com')
+        self._sockets = []
+
+    def tearDown(self):
+        for sock in self._sockets:
+            sock.close()
+
+    def _connect(self):
+        sock = socket.create_connection(
+            (config.mta.lmtp_host, int(config.mta.lmtp_port)), timeout=10)
+        self._sockets.append(sock)
+        reader = sock.makefile('rb')
+        self.assertTrue(reader.readline().startswith(b'220 '))
+        return sock, reader
+
+    def _read(self, reader, count=1):
+        return [reader.readline().rstrip(b'\r\n') for i in range(count)]
+
+    def test_pipelined_recipients(self):
+        # Pipelined commands are answered in order, and there is one status
+        # for each recipient after the data.
+        sock, reader = self._connect()
+        sock.sendall(b"""\
+LHLO remote.example.org\r
+MAIL FROM:<anne@example.com> BODY=8BITMIME\r
+RCPT TO:<ant@example.com>\r
+RCPT TO:<bogus@example.com>\r
+RCPT TO:<ant-request@example.com>\r
+DATA\r
+From: anne@example.com\r
+Message-ID: <ant>\r
+\r
+..hidden\r
+.\r
+QUIT\r
+""")
+        self.assertEqual(self._read(reader, 3), [
+            b'250-' + socket.getfqdn().encode('ascii'),
+            b'250-PIPELINING',
+            b'250 8BITMIME',
+            ])
+        self.assertEqual(self._read(reader, 4), [b'250 OK'] * 4)
+        self.assertTrue(self._read(reader)[0].startswith(b'354 '))
+        self.assertEqual(self._read(reader, 4), [
+            b'250 Ok',
+            b'550 Requested action not taken: mailbox unavailable',
+            b'250 Ok',
+            b'221 Bye',
+            ])
+        items = get_queue_messages('in', expected_count=1)
+        # The dot-stuffing is undone.
+        self.assertEqual(items[0].msg.get_payload(), '.hidden')
+        self.assertEqual(items[0].msg['x-mailfrom'], 'anne@example.com')
+        get_queue_messages('command', expected_count=1)
+
+    def test_helo(self):
+        # HELO and EHLO are not LMTP commands.
+        sock, reader = self._connect()
+        sock.sendall(b'HELO remote.example.org\r\nEHLO remote.example.org\r\n'
+                     b'MAIL FROM:<anne@example.com>\r\n')
+        self.assertEqual(self._read(reader, 3), [
+            b'502 Error: command HELO not implemented',
+            b'502 Error: command EHLO not implemented',
+            b'503 Error: send LHLO first',
+            ])
+
+    def test_concurrent_sessions(self):
+        # A session which is in the middle of sending its data doesn't hold
+        # up the other sessions.
+        slow, slow_reader = self._connect()
+        slow.sendall(b'LHLO remote.example.org\r\n'
+                     b'MAIL FROM:<anne@example.com>\r\n'
+                     b'RCPT TO:<ant@example.com>\r\n'
+                     b'DATA\r\n'
+                     b'From: anne@example.com\r\n'
+                     b'Message-ID: <slow>\r\n')
+        self._read(slow_reader, 6)
+        lmtp = get_lmtp_client(quiet=True)
+        self.addCleanup(lmtp.close)
+        lmtp.lhlo('remote.example.org')
+        lmtp.sendmail('bart@example.com', ['ant@example.com'], """\
+From: bart@example.com
+Message-ID: <fast>
+
+""")
+        items = get_queue_messages('in', expected_count=1)
+        self.assertEqual(items[0].msg['message-id'], '<fast>')
+        # The slow session can still finish its message.
+        slow.sendall(b'\r\n.\r\n')
+        self.assertEqual(self._read(slow_reader), [b'250 Ok'])
+        items = get_queue_messages('in', expected_count=1)
+        self.assertEqual(items[0].msg['message-id'], '<slow>')
+
+    def test_large_message(self):
+        # A large message is spooled to disk while it is received, and is
+        # queued without being parsed.  The dot-stuffing is undone even where
+        # the data is split between reads.
+        sock, reader = self._connect()
+        sock.sendall(b'LHLO remote.example.org\r\n'
+                     b'MAIL FROM:<anne@example.com>\r\n'
+                     b'RCPT TO:<ant@example.com>\r\n'
+                     b'DATA\r\n')
+        self._read(reader, 6)
+        lines = [b'..line ' + str(i).encode('ascii') for i in range(300000)]
+        data = (b'From: anne@example.com\r\nMessage-ID: <large>\r\n\r\n' +
+                b'\r\n'.join(lines) + b'\r\n.\r\n')
+        for start in range(0, len(data), 65537):
+            sock.sendall(data[start:start + 65537])
+        self.assertEqual(self._read(reader), [b'250 Ok'])
+        items = get_queue_messages('in', expected_count=1)
+        msg = items[0].msg
+        self.assertTrue(msg.is_mapped)
+        self.assertEqual(msg['message-id'], '<large>')
+        self.assertEqual(msg['x-mailfrom'], 'anne@example.com')
+        self.assertEqual(msg.get_payload().encode('ascii'),
+                         b'\n'.join(line[1:] for line in lines))
+
 
 class TestBugs(unittest.TestCase):
     """Test some LMTP related bugs."""
@@ -204,3 +364,19 @@ Message-ID: <alpha>
 """)
         items = get_queue_messages('in', expected_count=1)
         self.assertEqual(items[0].msg['message-id'], '<alpha>')
+
+
+class TestRunner(unittest.TestCase):
+    """Test the LMTP runner itself."""
+
+    layer = ConfigLayer
+
+    def test_stop_removes_event_subscriber(self):
+        # The runner's routing table follows the creation and deletion of
+        # mailing lists until the runner stops.
+        runner = LMTPRunner('lmtp')
+        handler = runner._routing_table.handle_event
+        self.assertIn(handler, event.subscribers)
+        runner.stop()
+        runner.run()
+        self.assertNotIn(handler, event.subscribers)
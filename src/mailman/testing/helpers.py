@@ -459,7 +459,8 @@ def reset_the_world():
     # handler) in the lists' data directories.
     for dirpath, dirnames, filenames in os.walk(config.LIST_DATA_DIR):
         for filename in filenames:
-            if filename.endswith('.mmdf') or filename == 'members.txt':
+            if (filename.endswith(('.mmdf', '.journal')) or
+                    filename == 'members.txt'):
                 os.remove(os.path.join(dirpath, filename))
     # Remove all residual queue files.
     for dirpath, dirnames, filenames in os.walk(config.QUEUE_DIR):
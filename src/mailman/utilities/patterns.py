@@ -0,0 +1,66 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Matching strings against many regular expressions at once."""
+
+import re
+
+from mailman import public
+
+
+# Patterns which refer to their own groups by number or name can't be combined
+# with other patterns, since the group numbers would change.
+BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+# Neither can patterns with inline flags, since before Python 3.11, flags in
+# the middle of a pattern apply to the whole combined regular expression.
+INLINE_FLAGS_RE = re.compile(r'\(\?[aiLmsux]')
+
+
+@public
+def compile_patterns(patterns, flags=0):
+    """Compile regular expressions which are to be matched together.
+
+    As many of the patterns as possible are combined into a single regular
+    expression, so that a string can be matched against all of them in one
+    call.
+
+    :param patterns: The regular expressions.
+    :type patterns: iterable of str
+    :param flags: The `re` flags to compile the patterns with.
+    :type flags: int
+    :return: The compiled regular expressions.  A string matches one of the
+        patterns if any of these match it.
+    :rtype: list
+    """
+    compiled = []
+    combined = []
+    for pattern in patterns:
+        if (BACKREFERENCE_RE.search(pattern) is None and
+                INLINE_FLAGS_RE.search(pattern) is None):
+            combined.append(pattern)
+        else:
+            compiled.append(re.compile(pattern, flags))
+    if len(combined) > 0:
+        try:
+            compiled.append(re.compile(
+                '|'.join('(?:{})'.format(pattern) for pattern in combined),
+                flags))
+        except re.error:
+            # Some patterns use clashing group names, so they have to be
+            # matched one by one.
+            compiled.extend(re.compile(pattern, flags) for pattern in combined)
+    return compiled
@@ -27,14 +27,19 @@ class QuerySequence(Sequence):
 
     Use this to provide a sequence-like API around query results, such as
     being able to use len() and slicing, where the results objects don't
-    natively provide them.
+    natively provide them.  Slices are turned into LIMIT and OFFSET clauses,
+    so only the requested results are loaded.  The length is only counted
+    the first time it is asked for.
     """
     def __init__(self, query=None):
         super().__init__()
         self._query = query
+        self._count = None
 
     def __len__(self):
-        return (0 if self._query is None else self._query.count())
+        if self._count is None:
+            self._count = (0 if self._query is None else self._query.count())
+        return self._count
 
     def __getitem__(self, index):
         if self._query is None:
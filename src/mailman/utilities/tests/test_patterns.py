@@ -0,0 +1,74 @@
+# Copyright (C) 2016 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test combined regular expressions."""
+
+import re
+import unittest
+
+from mailman.utilities.patterns import compile_patterns
+
+
+def _matches(patterns, string):
+    return any(pattern.match(string) is not None for pattern in patterns)
+
+
+class TestCompilePatterns(unittest.TestCase):
+
+    def test_no_patterns(self):
+        self.assertEqual(compile_patterns([]), [])
+
+    def test_combined(self):
+        patterns = compile_patterns(['^anne@', '^.*@example\\.org$'])
+        self.assertEqual(len(patterns), 1)
+        self.assertTrue(_matches(patterns, 'anne@example.com'))
+        self.assertTrue(_matches(patterns, 'bart@example.org'))
+        self.assertFalse(_matches(patterns, 'bart@example.com'))
+        self.assertFalse(_matches(patterns, 'Anne@example.com'))
+
+    def test_flags(self):
+        patterns = compile_patterns(['^anne@'], re.IGNORECASE)
+        self.assertTrue(_matches(patterns, 'ANNE@example.com'))
+
+    def test_backreferences(self):
+        # Patterns with backreferences are compiled on their own, so that
+        # their group numbers don't change.
+        patterns = compile_patterns(['^bart@', '^(.)\\1'])
+        self.assertEqual(len(patterns), 2)
+        self.assertTrue(_matches(patterns, 'aaron@example.com'))
+        self.assertFalse(_matches(patterns, 'abby@example.com'))
+        self.assertTrue(_matches(patterns, 'bart@example.com'))
+
+    def test_inline_flags(self):
+        # Patterns with inline flags are compiled on their own, so that their
+        # flags don't apply to the other patterns.
+        patterns = compile_patterns(['^anne person@', '(?x) ^bart @'])
+        self.assertEqual(len(patterns), 2)
+        self.assertTrue(_matches(patterns, 'anne person@example.com'))
+        self.assertFalse(_matches(patterns, 'anneperson@example.com'))
+        self.assertTrue(_matches(patterns, 'bart@example.com'))
+
+    def test_clashing_group_names(self):
+        # Patterns which can't be combined are matched one by one.
+        patterns = compile_patterns(['^(?P<name>anne)@', '^(?P<name>bart)@'])
+        self.assertEqual(len(patterns), 2)
+        self.assertTrue(_matches(patterns, 'anne@example.com'))
+        self.assertTrue(_matches(patterns, 'bart@example.com'))
+        self.assertFalse(_matches(patterns, 'cris@example.com'))
+
+    def test_bad_pattern(self):
+        self.assertRaises(re.error, compile_patterns, ['^(anne'])
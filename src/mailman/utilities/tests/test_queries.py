@@ -21,6 +21,7 @@ import unittest
 
 from mailman.utilities.queries import QuerySequence
 from operator import getitem
+from unittest.mock import Mock
 
 
 class TestQueries(unittest.TestCase):
@@ -32,3 +33,12 @@ class TestQueries(unittest.TestCase):
     def test_iterate_with_none(self):
         query = QuerySequence(None)
         self.assertEqual(list(query), [])
+
+    def test_count_once(self):
+        # The length of the query results is only counted once.
+        query = Mock()
+        query.count.return_value = 7
+        sequence = QuerySequence(query)
+        self.assertEqual(len(sequence), 7)
+        self.assertEqual(len(sequence), 7)
+        self.assertEqual(query.count.call_count, 1)